@@ -0,0 +1,232 @@
+import glob
+import os
+import re
+
+import click
+import h5py
+import numpy as np
+import pandas as pd
+import yaml
+
+from eventlog import read_events
+from psychometric import weibull
+
+LOG_RE = re.compile(r'sub-(?P<sub>\d+)_ses-(?P<ses>\d+)_task-(?P<task>[a-zA-Z0-9]+)'
+                    r'_run-(?P<run>\d+)_events\.(?P<ext>tsv|h5)$')
+RUN_KEYS = ['sub', 'ses', 'task', 'run']
+TRIAL_COLUMNS = ['trial_nr', 'onset', 'staircase_value', 'response_correct', 'response_sign',
+                 'correct_response_sign', 'response_time', 'color', 'block', 'radians']
+
+
+def read_trials(fn):
+    """ Reads the answered trials of one events log (.tsv or .h5)
+
+    Keeps the first response row of every trial that got a cw/ccw answer,
+    the rows data/staircase.ipynb selects by hand.
+    """
+    if fn.endswith('.h5'):
+        events = read_events(fn)
+    else:
+        # exptools2 writes trial_nr as the index, it is read back as a column
+        events = pd.read_csv(fn, sep='\t', na_values='NA')
+    if 'response_correct' not in events.columns:
+        return pd.DataFrame(columns=TRIAL_COLUMNS)
+
+    responses = events.loc[(events['event_type'] == 'response') &
+                           (events['response'] != 'space') &
+                           events['response_correct'].notnull()]
+    responses = responses.drop_duplicates('trial_nr', keep='first')
+    trials = pd.DataFrame({col: responses[col].to_numpy() if col in responses.columns else np.nan
+                           for col in TRIAL_COLUMNS})
+    trials['color'] = trials['color'].astype(str)
+    return trials
+
+
+class LogIndex:
+
+    def __init__(self, log_dir, index_fn=None):
+        """ Persistent index of the answered trials of all runs in a logs directory.
+
+        Every run (one sub/ses/task/run) is stored as its own group in an
+        HDF5 file, together with the size and mtime of the events log it
+        was read from. `scan` only (re)reads logs that are new or changed
+        since the last scan, so refreshing the index after a scan session
+        costs a handful of file reads. When a run has both an _events.h5
+        and an _events.tsv, the .h5 is used.
+
+        Parameters
+        ----------
+        log_dir : str
+            Directory with the _events logs.
+        index_fn : str
+            Path of the index file, by default analysis_index.h5 in `log_dir`.
+        """
+        self.log_dir = log_dir
+        self.index_fn = index_fn or os.path.join(log_dir, 'analysis_index.h5')
+
+    def _logs(self):
+        """ Returns {run name: path} of the events logs in log_dir """
+        logs = {}
+        for fn in sorted(glob.glob(os.path.join(self.log_dir, 'sub-*_events.*'))):
+            match = LOG_RE.search(os.path.basename(fn))
+            if match is None:
+                continue
+            name = os.path.basename(fn)[:match.start('ext') - len('_events.')]
+            if name not in logs or fn.endswith('.h5'):
+                logs[name] = fn
+        return logs
+
+    def scan(self):
+        """ Brings the index up to date, returns the names of the (re)indexed runs """
+        logs = self._logs()
+        updated = []
+        with h5py.File(self.index_fn, 'a') as h5:
+            for name in set(h5) - set(logs):
+                del h5[name]
+            for name, fn in logs.items():
+                stat = os.stat(fn)
+                if name in h5 and h5[name].attrs['source'] == fn and \
+                        h5[name].attrs['mtime'] == stat.st_mtime and \
+                        h5[name].attrs['size'] == stat.st_size:
+                    continue
+                trials = read_trials(fn)
+                if name in h5:
+                    del h5[name]
+                group = h5.create_group(name)
+                for col in TRIAL_COLUMNS:
+                    if col == 'color':
+                        group.create_dataset(col, data=trials[col].to_numpy().astype('S'))
+                    else:
+                        group.create_dataset(col, data=trials[col].to_numpy(dtype='f8'))
+                match = LOG_RE.search(os.path.basename(fn))
+                group.attrs.update({'source': fn, 'mtime': stat.st_mtime, 'size': stat.st_size,
+                                    'sub': int(match['sub']), 'ses': int(match['ses']),
+                                    'task': match['task'], 'run': int(match['run'])})
+                updated.append(name)
+        return updated
+
+    def trials(self):
+        """ Returns the answered trials of all indexed runs in one DataFrame """
+        columns = {col: [] for col in RUN_KEYS + TRIAL_COLUMNS}
+        with h5py.File(self.index_fn, 'r') as h5:
+            for name in sorted(h5):
+                group = h5[name]
+                n_trials = group['trial_nr'].shape[0]
+                for col in TRIAL_COLUMNS:
+                    columns[col].append(group[col][()])
+                for key in RUN_KEYS:
+                    columns[key].append(np.repeat(group.attrs[key], n_trials))
+        if not columns['trial_nr']:
+            return pd.DataFrame(columns=RUN_KEYS + TRIAL_COLUMNS)
+        trials = pd.DataFrame({col: np.concatenate(values) for col, values in columns.items()})
+        trials['color'] = trials['color'].str.decode('utf8')
+        return trials
+
+
+def response_counts(trials, by=RUN_KEYS):
+    """ Counts correct and total responses per group and staircase value
+
+    Returns
+    -------
+    groups : pd.DataFrame
+        The group keys, one row per group.
+    intensities : np.ndarray
+        The staircase values that occur in `trials`.
+    n_correct, n_total : np.ndarray
+        Counts of shape (n_groups, n_intensities).
+    """
+    intensities, intensity_idx = np.unique(trials['staircase_value'].to_numpy(), return_inverse=True)
+    group_idx = trials.groupby(by, sort=True).ngroup().to_numpy()
+    groups = trials[by].drop_duplicates().sort_values(by).reset_index(drop=True)
+    shape = (len(groups), len(intensities))
+    flat = np.ravel_multi_index((group_idx, intensity_idx), shape)
+    size = shape[0] * shape[1]
+    n_total = np.bincount(flat, minlength=size).reshape(shape)
+    n_correct = np.bincount(flat, weights=trials['response_correct'].to_numpy(),
+                            minlength=size).reshape(shape)
+    return groups, intensities, n_correct, n_total
+
+
+def fit_psychometric(intensities, n_correct, n_total, quest_plus_s):
+    """ Grid-fits a Weibull function to many response count tables at once.
+
+    The log likelihood of every parameter combination of the questplus
+    grid (thresholdVals x slopeVals x lowerAsymptoteVals x lapseRateVals)
+    is computed for all groups in one pair of einsums over the counts,
+    and summarized under a flat prior.
+
+    Parameters
+    ----------
+    intensities : np.ndarray
+        Staircase values, shape (n_intensities,).
+    n_correct, n_total : np.ndarray
+        Response counts, shape (n_groups, n_intensities).
+    quest_plus_s : dict
+        The questplus settings block.
+
+    Returns
+    -------
+    fits : pd.DataFrame
+        Per group: the maximum a posteriori estimate and the posterior mean
+        and sd of every parameter.
+    """
+    params = {'threshold': np.asarray(quest_plus_s['thresholdVals'], dtype=float),
+              'slope': np.asarray(quest_plus_s['slopeVals'], dtype=float),
+              'lower_asymptote': np.asarray(quest_plus_s['lowerAsymptoteVals'], dtype=float),
+              'lapse_rate': np.asarray(quest_plus_s['lapseRateVals'], dtype=float)}
+    t, s, g, la = np.meshgrid(*params.values(), indexing='ij')
+    p = weibull(np.asarray(intensities)[:, np.newaxis, np.newaxis, np.newaxis, np.newaxis],
+                t, s, g, la, scale=quest_plus_s.get('stimScale', 'linear'))
+    p = np.clip(p, 1e-12, 1 - 1e-12)
+
+    log_lik = np.einsum('ri,itsgl->rtsgl', n_correct, np.log(p), optimize=True) + \
+        np.einsum('ri,itsgl->rtsgl', n_total - n_correct, np.log(1 - p), optimize=True)
+    flat = log_lik.reshape(len(log_lik), -1)
+    posterior = np.exp(flat - flat.max(axis=1, keepdims=True))
+    posterior /= posterior.sum(axis=1, keepdims=True)
+    best = flat.argmax(axis=1)
+
+    fits = {}
+    for name, grid in zip(params, [t, s, g, la]):
+        values = grid.ravel()
+        mean = posterior @ values
+        fits[f'{name}_map'] = values[best]
+        fits[f'{name}_mean'] = mean
+        fits[f'{name}_sd'] = np.sqrt(np.maximum(posterior @ values**2 - mean**2, 0))
+    return pd.DataFrame(fits)
+
+
+def cohort_summary(log_dir, settings_file='defaults.yml', by=RUN_KEYS, index_fn=None):
+    """ Scans the logs and fits every group of runs, returns one row per group """
+    with open(settings_file, 'r', encoding='utf8') as f_in:
+        quest_plus_s = yaml.safe_load(f_in)['questplus']
+
+    index = LogIndex(log_dir, index_fn)
+    index.scan()
+    trials = index.trials()
+    if len(trials) == 0:
+        return pd.DataFrame(columns=list(by))
+
+    groups, intensities, n_correct, n_total = response_counts(trials, by)
+    summary = groups.copy()
+    summary['n_trials'] = n_total.sum(axis=1)
+    summary['p_correct'] = n_correct.sum(axis=1) / summary['n_trials']
+    summary['mean_staircase_value'] = (n_total @ intensities) / summary['n_trials']
+    return pd.concat([summary, fit_psychometric(intensities, n_correct, n_total, quest_plus_s)], axis=1)
+
+
+@click.command()
+@click.option('--log_dir', default='logs', type=str, help='Directory with the _events logs')
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file with the questplus grid')
+@click.option('--by', default='sub,ses,task,run', type=str, help='Columns to fit separately, e.g. sub,task')
+@click.option('--out', default=None, type=str, help='Also write the summary to this tsv')
+def main_api(log_dir, settings, by, out):
+    """ Indexes all events logs and prints a per-run psychometric summary """
+    summary = cohort_summary(log_dir, settings, by.split(','))
+    print(summary.round(3).to_string(index=False))
+    if out is not None:
+        summary.to_csv(out, sep='\t', index=False, na_rep='NA')
+
+
+if __name__ == '__main__':
+    main_api()
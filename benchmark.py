@@ -0,0 +1,290 @@
+import os
+import shutil
+import tempfile
+import time
+
+import click
+import numpy as np
+import pandas as pd
+import yaml
+
+
+def load_settings(settings_file):
+    """ Loads a settings file the same way the session does """
+    with open(settings_file, 'r', encoding='utf8') as f_in:
+        return yaml.safe_load(f_in)
+
+
+def report(name, durations):
+    """ Prints the median and spread of a list of durations (in s) """
+    durations = np.asarray(durations) * 1000
+    print(f'{name:<24s} median {np.median(durations):9.2f} ms  '
+          f'min {durations.min():9.2f} ms  max {durations.max():9.2f} ms  '
+          f'(n={len(durations)})')
+
+
+@click.group()
+def cli():
+    """ Micro-benchmarks for the orientation mapper """
+
+
+@cli.command()
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file')
+@click.option('--n_reps', default=5, type=int, help='Repetitions per condition')
+def staircase(settings, n_reps):
+    """ Cold vs. warm construction of the session's QUEST+ staircase """
+    from staircase import CachedQuestPlusHandler
+
+    quest_plus_s = load_settings(settings)['questplus']
+    cache_dir = tempfile.mkdtemp(prefix='qp_cache_')
+    try:
+        cold, warm = [], []
+        for _ in range(n_reps):
+            shutil.rmtree(cache_dir)
+            os.makedirs(cache_dir)
+            t = time.perf_counter()
+            CachedQuestPlusHandler(nTrials=115, cache_dir=cache_dir, **quest_plus_s)
+            cold.append(time.perf_counter() - t)
+        for _ in range(n_reps):
+            t = time.perf_counter()
+            handler = CachedQuestPlusHandler(nTrials=115, cache_dir=cache_dir, **quest_plus_s)
+            warm.append(time.perf_counter() - t)
+            assert handler.cache_hit
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report('cold (compute + store)', cold)
+    report('warm (memory-mapped)', warm)
+
+
+@cli.command()
+@click.option('--sub', default=1, type=int, help='Subject nr (e.g., 1)')
+@click.option('--run_id', default=1, type=int, help='Run nr')
+@click.option('--ses', default=1, type=int, help='Session nr')
+@click.option('--task', default='train', type=str, help='Type of run (train, test)')
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file')
+def startup(sub, run_id, ses, task, settings):
+    """ Import, construction and first-flip latency of a session """
+    t_start = time.perf_counter()
+    from exporimapper import ExpOriMapperSession
+    t_import = time.perf_counter()
+    session = ExpOriMapperSession(
+        sub=sub, run_id=run_id, ses=ses, task=task,
+        output_str=f'benchmark_startup_sub-{str(sub).zfill(2)}',
+        settings_file=settings, eyetracker_on=False)
+    t_construct = time.perf_counter()
+    session.win.flip()
+    t_flip = time.perf_counter()
+    session.close()
+
+    report('import', [t_import - t_start])
+    report('construction', [t_construct - t_import])
+    report('first flip', [t_flip - t_construct])
+    report('total to first flip', [t_flip - t_start])
+
+
+@cli.command()
+@click.argument('tsv_path', type=str)
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file')
+@click.option('--n_reps', default=20, type=int, help='Repetitions per condition')
+def bundle(tsv_path, settings, n_reps):
+    """ Loading a run design: pandas + dicts vs. cold and warm run bundles """
+    from runbundle import load_run_bundle, record_to_dict
+
+    settings = load_settings(settings)
+    constants = dict(settings['experiment'])
+    constants.update(settings['stim_position_info'])
+    cache_dir = tempfile.mkdtemp(prefix='run_bundles_')
+    try:
+        legacy, cold, warm = [], [], []
+        for _ in range(n_reps):
+            t = time.perf_counter()
+            trial_df = pd.read_csv(tsv_path, sep='\t', index_col=0, na_values='NA')
+            for i in range(len(trial_df)):
+                parameters = trial_df.iloc[i].to_dict()
+                parameters.update(constants)
+            legacy.append(time.perf_counter() - t)
+
+            shutil.rmtree(cache_dir)
+            for timings in [cold, warm]:
+                t = time.perf_counter()
+                records, bundle_constants = load_run_bundle(tsv_path, settings, cache_dir)
+                for record in records:
+                    parameters = record_to_dict(record)
+                    parameters.update(bundle_constants)
+                timings.append(time.perf_counter() - t)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report('pandas + iloc.to_dict', legacy)
+    report('bundle (compile)', cold)
+    report('bundle (mapped)', warm)
+
+
+@cli.command()
+@click.option('--sub', default=1, type=int, help='Subject nr (e.g., 1)')
+@click.option('--task', default='test', type=str, help='Type of run (train, test)')
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file')
+@click.option('--n_runs', default=3, type=int, help='Runs to simulate')
+def simulation(sub, task, settings, n_runs):
+    """ Per-trial CPU cost and staircase latency of headless simulated runs """
+    from simulation import simulate_run
+
+    out_dir = tempfile.mkdtemp(prefix='simulation_')
+    try:
+        summaries = pd.DataFrame([simulate_run(sub=sub, run_id=run_id, task=task, settings_file=settings,
+                                               output_dir=out_dir)
+                                  for run_id in range(1, n_runs+1)])
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    report('run (wall time)', summaries['wall_time'])
+    report('trial cpu (median)', summaries['trial_cpu_median'])
+    report('trial cpu (max)', summaries['trial_cpu_max'])
+    report('staircase (median)', summaries['staircase_latency_median'])
+    report('staircase (max)', summaries['staircase_latency_max'])
+    print(f'{summaries["virtual_duration"].sum() / summaries["wall_time"].sum():.0f}x faster than real time, '
+          f'{summaries["deadline_misses"].sum()} staircase deadline misses')
+
+
+@cli.command()
+@click.option('--duration', default=5.0, type=float, help='Seconds of simulated gaze')
+@click.option('--rate', default=1000, type=int, help='Sampling rate (Hz)')
+@click.option('--window', default=0.15, type=float, help='Fixation check window (s)')
+def gaze(duration, rate, window):
+    """ Fixation checks and sample lag of a gaze stream on a simulated source """
+    from psychopy.core import Clock
+    from gaze import GazeStream, SimulatedGazeSource
+
+    clock = Clock()
+    stream = GazeStream(SimulatedGazeSource(clock, rate=rate, seed=0))
+    stream.start()
+    checks, lags = [], []
+    t_end = time.perf_counter() + duration
+    # a 60 Hz render loop checking fixation every frame
+    while time.perf_counter() < t_end:
+        time.sleep(1 / 60)
+        now = clock.getTime()
+        t = time.perf_counter()
+        stream.fixation_break(now - window, now, (0, 0), radius=1.0, min_duration=0.02)
+        checks.append(time.perf_counter() - t)
+        lags.append(now - stream.buffer[(stream.n_samples - 1) % len(stream.buffer)]['t'])
+    stream.stop()
+
+    report('fixation check', checks)
+    report('newest sample age', lags)
+    print(f'{stream.n_samples} samples ({stream.n_samples / duration:.0f} Hz)')
+
+
+@cli.command()
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file')
+@click.option('--n_observers', default=10, type=int, help='Simulated observers per engine and grid')
+@click.option('--n_trials', default=100, type=int, help='Trials per observer')
+@click.option('--step', default=0.05, type=float, help='Step of the fine grid')
+@click.option('--max_value', default=10.0, type=float, help='Largest intensity and threshold of the fine grid')
+@click.option('--max_full', default=2e7, type=float, help='Largest likelihood tensor the questplus engine is run on')
+def engines(settings, n_observers, n_trials, step, max_value, max_full):
+    """ Estimates and per-trial latency of the questplus and pruned staircase engines """
+    from prunedquest import PrunedQuestPlusHandler
+    from psychometric import weibull
+    from staircase import CachedQuestPlusHandler
+
+    settings = load_settings(settings)
+    quest_plus_s = dict(settings['questplus'])
+    fine_s = dict(quest_plus_s)
+    fine_grid = list(np.round(np.arange(step, max_value + step / 2, step), 6))
+    fine_s.update(intensityVals=fine_grid, thresholdVals=fine_grid,
+                  slopeVals=list(np.round(np.arange(0.2, 7.2 + step / 2, step), 6)))
+
+    cache_dir = tempfile.mkdtemp(prefix='qp_cache_')
+    try:
+        for grid_name, grid_s in [('settings', quest_plus_s), (f'fine ({step})', fine_s)]:
+            n_full = 2 * np.prod([len(np.atleast_1d(grid_s[key])) for key in
+                                  ['intensityVals', 'thresholdVals', 'slopeVals',
+                                   'lowerAsymptoteVals', 'lapseRateVals']])
+            for engine in ['questplus', 'pruned']:
+                if engine == 'questplus' and n_full > max_full:
+                    print(f'{engine} on {grid_name} grid: skipped, likelihood tensor of {n_full:.0f} values')
+                    continue
+                latencies, errors = [], []
+                for i in range(n_observers):
+                    rng = np.random.default_rng(i)
+                    threshold, slope = rng.uniform(1, 6), rng.uniform(1, 4)
+                    if engine == 'questplus':
+                        handler = CachedQuestPlusHandler(nTrials=n_trials, cache_dir=cache_dir, **grid_s)
+                    else:
+                        handler = PrunedQuestPlusHandler(nTrials=n_trials, **settings['staircase']['pruned'],
+                                                         **grid_s)
+                    response = None
+                    for _ in range(n_trials):
+                        # one response update plus one selection, as the staircase worker does
+                        t = time.perf_counter()
+                        if response is not None:
+                            handler.addResponse(response)
+                        intensity = handler.next()
+                        latencies.append(time.perf_counter() - t)
+                        response = bool(rng.random() < weibull(intensity, threshold, slope))
+                    handler.addResponse(response)
+                    errors.append(handler.paramEstimate['threshold'] - threshold)
+                report(f'{engine} ({grid_name})', latencies)
+                print(f'{"":<24s} threshold error: median abs {np.median(np.abs(errors)):.3f}, '
+                      f'mean {np.mean(errors):+.3f}')
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+@cli.command()
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file')
+@click.option('--n_trials', default=20, type=int, help='Trials per condition')
+def stimstate(settings, n_trials):
+    """ Per-frame update and draw cost of the grating and fixation dots, raw vs. state-tracked """
+    from exporimapper import ExpOriMapperSession
+    from stimstate import StimState, UpdateCounter
+
+    session = ExpOriMapperSession(
+        sub=1, run_id=1, ses=1, task='train', output_str='benchmark_stimstate_sub-01',
+        settings_file=settings, eyetracker_on=False)
+    exp_s = session.settings['experiment']
+    stims = [getattr(session, name) for name in ['grating', 'center_fixation_dot', 'surround_fixation_dot']]
+    stims = [getattr(stim, 'stim', stim) for stim in stims]
+    n_warn = int(round(exp_s['warn_duration'] * session.refresh_rate))
+    n_rest = int(round((exp_s['total_trial_duration'] - exp_s['warn_duration']) * session.refresh_rate))
+    rng = np.random.default_rng(0)
+    trials = [(rng.random(), rng.choice(['red', 'green', 'blue']), rng.uniform(0, 180))
+              for _ in range(n_trials)]
+
+    def run_frames(grating, center, surround):
+        # the updates and draws of ExpOriMapperTrial.draw, flips not timed
+        durations = []
+        for phase, color, ori in trials:
+            for frame in range(n_warn + n_rest):
+                t = time.perf_counter()
+                if frame < n_warn:
+                    center.setColor(color)
+                    grating.phase = phase
+                    grating.contrast = exp_s['grating_contrast']
+                else:
+                    center.setColor(exp_s['fixation_center_color'])
+                    grating.ori = ori
+                    grating.draw()
+                surround.draw()
+                center.draw()
+                durations.append(time.perf_counter() - t)
+                session.win.flip()
+        return durations
+
+    raw = run_frames(*stims)
+    counter = UpdateCounter()
+    counter.install(session.win)
+    tracked = run_frames(*[StimState(stim, counter) for stim in stims])
+    updates = counter.summary()
+    session.close()
+
+    report('raw', raw)
+    report('state-tracked', tracked)
+    print(f'{sum(raw) / sum(tracked):.2f}x less time per frame, {updates["real_per_frame"]:.2f} real and '
+          f'{updates["redundant_per_frame"]:.2f} redundant updates per frame')
+
+
+if __name__ == '__main__':
+    cli()
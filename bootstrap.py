@@ -0,0 +1,141 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+import pandas as pd
+import yaml
+
+from analysis import RUN_KEYS, LogIndex, fit_psychometric
+
+
+def bootstrap_group(seed_seq, staircase_value, response_correct, quest_plus_s,
+                    n_boot=2000, ci=95, chunk_size=250):
+    """ Bootstraps the psychometric fit of the trials of one group.
+
+    Every resample draws as many trials as the group has, with
+    replacement, and is reduced to correct/total counts per staircase
+    value, so a chunk of resamples is fit in a single call to
+    analysis.fit_psychometric.
+
+    Parameters
+    ----------
+    seed_seq : np.random.SeedSequence
+        Seed of this group's resamples.
+    staircase_value, response_correct : np.ndarray
+        The trials of the group.
+    quest_plus_s : dict
+        The questplus settings block (grid of the fit).
+    n_boot : int
+        Number of resamples.
+    ci : float
+        Width of the percentile confidence interval (in %).
+    chunk_size : int
+        Number of resamples fit at once.
+
+    Returns
+    -------
+    result : dict
+        Threshold estimate of the data, its bootstrap sd and confidence
+        bounds, and the same for the slope.
+    """
+    rng = np.random.default_rng(seed_seq)
+    intensities, intensity_idx = np.unique(staircase_value, return_inverse=True)
+    n_trials, n_intensities = len(staircase_value), len(intensities)
+    correct = np.asarray(response_correct, dtype=float)
+
+    def counts(trial_idx):
+        # trial_idx: (n_resamples, n_trials) indices into the group's trials
+        flat = (np.arange(len(trial_idx))[:, np.newaxis] * n_intensities + intensity_idx[trial_idx]).ravel()
+        size = len(trial_idx) * n_intensities
+        n_total = np.bincount(flat, minlength=size).reshape(-1, n_intensities)
+        n_correct = np.bincount(flat, weights=correct[trial_idx].ravel(),
+                                minlength=size).reshape(-1, n_intensities)
+        return n_correct, n_total
+
+    estimate = fit_psychometric(intensities, *counts(np.arange(n_trials)[np.newaxis]), quest_plus_s)
+    resampled = pd.concat([fit_psychometric(intensities,
+                                            *counts(rng.integers(0, n_trials, size=(n, n_trials))),
+                                            quest_plus_s)
+                           for n in np.diff(np.r_[np.arange(0, n_boot, chunk_size), n_boot])],
+                          ignore_index=True)
+
+    result = {'n_trials': n_trials}
+    for param in ['threshold', 'slope']:
+        values = resampled[f'{param}_mean'].to_numpy()
+        result[param] = estimate[f'{param}_mean'].iloc[0]
+        result[f'{param}_sd'] = values.std(ddof=1)
+        result[f'{param}_lo'], result[f'{param}_hi'] = np.percentile(
+            values, [(100 - ci) / 2, 100 - (100 - ci) / 2])
+    return result
+
+
+def bootstrap_thresholds(trials, quest_plus_s, by=RUN_KEYS + ['color'], n_boot=2000, ci=95,
+                         seed=0, n_jobs=None, chunk_size=250):
+    """ Bootstrap confidence intervals of the thresholds of every group of trials.
+
+    Groups (by default every color condition of every run) are spread over
+    a process pool. Each group gets its own child of SeedSequence(seed),
+    so the intervals do not depend on `n_jobs` or on the order in which
+    the workers finish.
+
+    Parameters
+    ----------
+    trials : pd.DataFrame
+        Answered trials, with `staircase_value` and `response_correct`
+        columns (see analysis.LogIndex.trials).
+    quest_plus_s : dict
+        The questplus settings block (grid of the fit).
+    by : list of str
+        Columns that define the groups.
+    n_boot, ci, chunk_size
+        See bootstrap_group.
+    seed : int
+        Base seed of the bootstrap.
+    n_jobs : int
+        Worker processes (default: all cores, 1: no pool).
+
+    Returns
+    -------
+    intervals : pd.DataFrame
+        One row per group.
+    """
+    groups = list(trials.groupby(by, sort=True))
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(groups))
+    args = (seed_seqs,
+            [group['staircase_value'].to_numpy() for _, group in groups],
+            [group['response_correct'].to_numpy() for _, group in groups],
+            [quest_plus_s]*len(groups), [n_boot]*len(groups),
+            [ci]*len(groups), [chunk_size]*len(groups))
+    if n_jobs == 1:
+        results = list(map(bootstrap_group, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(bootstrap_group, *args))
+
+    keys = pd.DataFrame([key if isinstance(key, tuple) else (key,) for key, _ in groups], columns=by)
+    return pd.concat([keys, pd.DataFrame(results)], axis=1)
+
+
+@click.command()
+@click.option('--log_dir', default='logs', type=str, help='Directory with the _events logs')
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file with the questplus grid')
+@click.option('--by', default='sub,ses,task,run,color', type=str, help='Columns that define the groups')
+@click.option('--n_boot', default=2000, type=int, help='Resamples per group')
+@click.option('--ci', default=95, type=float, help='Confidence interval (%)')
+@click.option('--seed', default=0, type=int, help='Base seed of the bootstrap')
+@click.option('--n_jobs', default=None, type=int, help='Worker processes (default: all cores)')
+@click.option('--out', default=None, type=str, help='Also write the intervals to this tsv')
+def main_api(log_dir, settings, by, n_boot, ci, seed, n_jobs, out):
+    """ Prints bootstrap confidence intervals of the threshold of every run and color """
+    with open(settings, 'r', encoding='utf8') as f_in:
+        quest_plus_s = yaml.safe_load(f_in)['questplus']
+    index = LogIndex(log_dir)
+    index.scan()
+    intervals = bootstrap_thresholds(index.trials(), quest_plus_s, by.split(','), n_boot, ci, seed, n_jobs)
+    print(intervals.round(3).to_string(index=False))
+    if out is not None:
+        intervals.to_csv(out, sep='\t', index=False, na_rep='NA')
+
+
+if __name__ == '__main__':
+    main_api()
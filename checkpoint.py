@@ -0,0 +1,154 @@
+import json
+import os
+
+import numpy as np
+
+HEADER_DTYPE = np.dtype([('generation', 'u8'),
+                         ('n_responses', 'u8')])
+HISTORY_DTYPE = np.dtype([('intensity', 'f8'),
+                          ('response', 'i1')])
+
+
+def checkpoint_prefix(checkpoint_dir, sub, ses, task, run):
+    """ Returns the path prefix of the staircase checkpoint of a run """
+    return os.path.join(checkpoint_dir, f'sub-{str(sub).zfill(2)}_ses-{str(ses).zfill(2)}'
+                                        f'_task-{task}_run-{str(run).zfill(2)}_staircase')
+
+
+class StaircaseCheckpoint:
+
+    def __init__(self, prefix, posterior_shape, response_vals, settings_key, capacity=1024):
+        """ Double-buffered, memory-mapped checkpoint of a QUEST+ staircase.
+
+        The checkpoint consists of four files next to each other:
+
+        - {prefix}_posterior.npy: two slots of the posterior,
+        - {prefix}_history.npy: the (intensity, response index) of every
+          response, appended in place,
+        - {prefix}_header.npy: per slot the generation and the number of
+          responses its posterior includes,
+        - {prefix}.json: the settings hash, grid shape and response values
+          the checkpoint belongs to.
+
+        A write fills the slot that is *not* current and flushes it before
+        its header entry is bumped, n_responses before generation, so a
+        crash at any point leaves the previous slot (and the history up to
+        its n_responses) intact. Reading takes the slot with the highest
+        generation, with no replay of the responses.
+
+        Parameters
+        ----------
+        prefix : str
+            Path prefix of the files (see checkpoint_prefix).
+        posterior_shape : tuple
+            Shape of the posterior tensor.
+        response_vals : list
+            The questplus responseVals; responses are stored as indices.
+        settings_key : str
+            Hash of the questplus settings (see staircase.settings_hash).
+        capacity : int
+            Initial number of responses the history has room for; it is
+            doubled when full.
+        """
+        self.prefix = prefix
+        self.posterior_shape = tuple(posterior_shape)
+        self.response_vals = list(response_vals)
+        self.settings_key = settings_key
+        self.capacity = capacity
+        self.posterior = self.history = self.header = None
+
+    @property
+    def meta_path(self):
+        return self.prefix + '.json'
+
+    def _path(self, name):
+        return f'{self.prefix}_{name}.npy'
+
+    def exists(self):
+        return all(os.path.isfile(fn) for fn in
+                   [self.meta_path, self._path('posterior'), self._path('history'), self._path('header')])
+
+    def create(self, overwrite=False):
+        """ Starts an empty checkpoint
+
+        An existing checkpoint holds the posterior of an earlier (possibly
+        crashed) run, so it is only replaced with `overwrite`.
+        """
+        if self.exists() and not overwrite:
+            raise FileExistsError(
+                f'staircase checkpoint {self.prefix} exists: resume from it (main.py --resume True) '
+                f'or start over (main.py --overwrite_checkpoint True)')
+        os.makedirs(os.path.dirname(self.prefix) or '.', exist_ok=True)
+        with open(self.meta_path + '.tmp', 'w') as f:
+            json.dump({'settings_key': self.settings_key,
+                       'posterior_shape': list(self.posterior_shape),
+                       'response_vals': self.response_vals}, f)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+        self.posterior = np.lib.format.open_memmap(
+            self._path('posterior'), mode='w+', dtype='f8', shape=(2,) + self.posterior_shape)
+        self.history = np.lib.format.open_memmap(
+            self._path('history'), mode='w+', dtype=HISTORY_DTYPE, shape=(self.capacity,))
+        self.header = np.lib.format.open_memmap(
+            self._path('header'), mode='w+', dtype=HEADER_DTYPE, shape=(2,))
+        self.header.flush()
+
+    def open(self):
+        """ Maps an existing checkpoint for reading and further writes """
+        with open(self.meta_path, 'r', encoding='utf8') as f_in:
+            meta = json.load(f_in)
+        if meta['settings_key'] != self.settings_key or \
+                tuple(meta['posterior_shape']) != self.posterior_shape:
+            raise ValueError(f'checkpoint {self.prefix} was written with other questplus settings')
+        self.posterior = np.load(self._path('posterior'), mmap_mode='r+')
+        self.history = np.load(self._path('history'), mmap_mode='r+')
+        self.header = np.load(self._path('header'), mmap_mode='r+')
+        self.capacity = len(self.history)
+
+    def _grow(self):
+        """ Doubles the history, swapping in the larger file atomically """
+        tmp_path = self._path('history') + '.tmp.npy'
+        history = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=HISTORY_DTYPE,
+                                            shape=(2 * self.capacity,))
+        history[:self.capacity] = self.history
+        history.flush()
+        del history
+        os.replace(tmp_path, self._path('history'))
+        self.history = np.load(self._path('history'), mmap_mode='r+')
+        self.capacity = len(self.history)
+
+    def write(self, posterior, intensities, responses):
+        """ Stores the posterior after len(responses) responses
+
+        Only the responses not yet in the history are copied, so a write
+        costs one posterior copy plus a few bytes.
+        """
+        current = int(np.argmax(self.header['generation']))
+        slot = 1 - current
+        n_stored = int(self.header[current]['n_responses'])
+        n = len(responses)
+        while n > self.capacity:
+            self._grow()
+        new = slice(n_stored, n)
+        self.history['intensity'][new] = intensities[new]
+        self.history['response'][new] = [self.response_vals.index(r) for r in responses[new]]
+        self.history.flush()
+
+        self.posterior[slot] = posterior
+        self.posterior.flush()
+        self.header[slot]['n_responses'] = n
+        self.header[slot]['generation'] = self.header[current]['generation'] + 1
+        self.header.flush()
+
+    def read(self):
+        """ Returns the posterior, intensities and responses of the current slot
+
+        Returns None when nothing has been written yet.
+        """
+        current = int(np.argmax(self.header['generation']))
+        if self.header[current]['generation'] == 0:
+            return None
+        n = int(self.header[current]['n_responses'])
+        history = np.array(self.history[:n])
+        return {'posterior': np.array(self.posterior[current]),
+                'intensities': history['intensity'],
+                'responses': [self.response_vals[i] for i in history['response']]}
@@ -0,0 +1,26 @@
+import click
+
+
+def parse_int_list(spec):
+    """ Parses a specification like '1-20,25' into a list of ints """
+    values = []
+    for part in spec.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            values.extend(range(int(first), int(last)+1))
+        else:
+            values.append(int(part))
+    return values
+
+
+class IntList(click.ParamType):
+    """ click type of a list of ints given as e.g. 1-4 or 1,3,5, see parse_int_list """
+    name = 'int_list'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, list):
+            return value
+        try:
+            return parse_int_list(value)
+        except ValueError:
+            self.fail(f'{value!r} is not a list of numbers like 1-4 or 1,3,5', param, ctx)
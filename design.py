@@ -0,0 +1,242 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+import pandas as pd
+
+from cliutils import IntList
+from kappas import optimal_kappas
+from design_search import DEFAULT_WEIGHTS, search_test_design
+
+TASK_CODES = {'train': 0, 'test': 1}
+
+
+def run_seed_sequence(seed, sub, task, run_id):
+    """ Returns the seed of a single subject/task/run """
+    return np.random.SeedSequence([seed, sub, TASK_CODES[task], run_id])
+
+
+def design_path(out_dir, sub, task, run_id, ext='tsv'):
+    """ Returns the path of a run design, in the layout create_trials expects """
+    sub_str = f'sub-{str(sub).zfill(2)}'
+    return os.path.join(out_dir, sub_str,
+                        f'{sub_str}_task-{task}_run-{str(run_id).zfill(2)}.{ext}')
+
+
+def empty_trial_positions(rng, total_n_trials, n_empty_trials, low, high):
+    """ Evenly spaced empty trials, jittered by an integer in [low, high) """
+    empty_stride_f = total_n_trials/(n_empty_trials+1)
+    empty_trials = np.cumsum(np.ones(n_empty_trials)*empty_stride_f).astype(int)
+    return empty_trials + rng.integers(low, high, size=n_empty_trials)
+
+
+def train_run_orientations(rng,
+                           total_n_trials=90,
+                           n_empty_trials=10,
+                           n_ori_distribution_blocks=4,
+                           empty_trial_slack=2,
+                           orientation_offset=0):
+    """
+    Returns a DataFrame with the orientation of each trial of a train run,
+    uniformly distributed across the circle.
+    """
+    basic_orientations = np.linspace(-np.pi, np.pi, total_n_trials-n_empty_trials,
+                                     endpoint=False) + orientation_offset
+    empty_trials = empty_trial_positions(rng, total_n_trials, n_empty_trials,
+                                         -empty_trial_slack, empty_trial_slack)
+    random_orientations = np.concatenate(
+        [rng.permutation(basic_orientations[i::n_ori_distribution_blocks])
+         for i in range(n_ori_distribution_blocks)])
+
+    is_empty = np.isin(np.arange(total_n_trials), empty_trials)
+    radians = np.full(total_n_trials, np.nan)
+    radians[~is_empty] = random_orientations[:(~is_empty).sum()]
+
+    data_df = pd.DataFrame({'block': np.zeros(total_n_trials),
+                            'block_mean': np.nan,
+                            'block_kappa': np.nan,
+                            'radians': radians})
+    data_df['color'] = np.where(np.isnan(radians), 'black', 'blue')
+    data_df['rounded_orientation_degrees'] = np.degrees(data_df['radians']/2)
+    data_df['grating_phase'] = rng.random(total_n_trials)
+    data_df['grating_contrast_multiplier'] = (~np.isnan(radians)).astype(float)
+    return data_df
+
+
+def color_blocks(rng, n_blocks, n_trials, block_duration_slack):
+    """ Splits the trials of one color into n_blocks jittered blocks
+
+    Returns
+    -------
+    block_nr : np.ndarray
+        Block index (0-based) of each of the `n_trials` trials.
+    block_means : np.ndarray
+        Mean orientation (in radians, -pi to pi) of each block.
+    """
+    n_trials_per_block = n_trials / n_blocks
+    bounds = np.cumsum(np.ones(n_blocks)*n_trials_per_block).astype(int)
+    jitter = int(block_duration_slack // n_trials_per_block)
+    bounds += rng.integers(-jitter, jitter+1, size=n_blocks)
+    bounds = np.r_[0, bounds]
+    bounds[-1] = n_trials
+    block_nr = np.repeat(np.arange(n_blocks), np.diff(bounds))
+    block_means = rng.permutation(
+        np.fmod(rng.random() + np.linspace(0, 1, n_blocks, endpoint=False), 1) * np.pi * 2 - np.pi)
+    return block_nr, block_means
+
+
+def test_run_orientations(rng,
+                          kappas,
+                          total_n_trials=90,
+                          n_empty_trials=10,
+                          min_n_blocks=2,
+                          max_n_blocks=6,
+                          empty_trial_slack=2,
+                          block_duration_slack=10):
+    """
+    Returns a DataFrame with the orientation of each trial of a test run.
+    Red and green trials are interleaved, and each color is split into
+    blocks with their own von Mises distribution of orientations, whose
+    kappa is looked up by number of blocks in `kappas`.
+    """
+    empty_trials = empty_trial_positions(rng, total_n_trials, n_empty_trials,
+                                         -empty_trial_slack, empty_trial_slack+1)
+    n_trials_each_color = (total_n_trials - n_empty_trials)//2
+
+    colors = {}
+    for n_blocks, color in zip(rng.integers(min_n_blocks, max_n_blocks, 2), ['red', 'green']):
+        block_nr, block_means = color_blocks(
+            rng, n_blocks, n_trials_each_color, block_duration_slack)
+        block_kappas = np.ones(n_blocks) * kappas[n_blocks]
+        radians = rng.vonmises(block_means[block_nr], block_kappas[block_nr])
+        colors[color] = np.c_[block_nr+1, block_means[block_nr],
+                              block_kappas[block_nr], radians]
+
+    is_red = rng.permutation(np.r_[np.zeros(n_trials_each_color),
+                                   np.ones(n_trials_each_color)]).astype(bool)
+    data = np.zeros((2*n_trials_each_color, 4))
+    data[is_red] = colors['red']
+    data[~is_red] = colors['green']
+    color = np.where(is_red, 'red', 'green')
+
+    # empty trials go in front of the trial at their position
+    empty_data = np.tile([0, np.nan, np.nan, np.nan], (n_empty_trials, 1))
+    order = np.argsort(np.r_[np.arange(len(data)), empty_trials - 0.5], kind='stable')
+    data = np.r_[data, empty_data][order]
+    color = np.r_[color, ['black'] * n_empty_trials][order]
+
+    all_color_df = pd.DataFrame(data, columns=['block', 'block_mean', 'block_kappa', 'radians'])
+    all_color_df['color'] = color
+    all_color_df['grating_contrast_multiplier'] = (color != 'black').astype(float)
+    all_color_df['rounded_orientation_degrees'] = np.round(np.degrees(all_color_df['radians']) / 10) * 5
+    all_color_df['grating_phase'] = rng.random(len(all_color_df))
+    return all_color_df
+
+
+def write_run_design(sub, task, run_id, out_dir, seed, test_kwargs, n_candidates=1, weights=DEFAULT_WEIGHTS):
+    """ Generates and writes the design of a single run, returns its path
+
+    Test runs are the best of `n_candidates` random designs when
+    `n_candidates` > 1 (see design_search.search_test_design).
+    """
+    seed_seq = run_seed_sequence(seed, sub, task, run_id)
+    if task == 'train':
+        df = train_run_orientations(np.random.default_rng(seed_seq))
+    elif n_candidates > 1:
+        df, _, _ = search_test_design(seed_seq, n_candidates, weights=weights, **test_kwargs)
+    else:
+        df = test_run_orientations(np.random.default_rng(seed_seq), **test_kwargs)
+    fn = design_path(out_dir, sub, task, run_id)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    df.to_csv(fn, sep='\t', index=True, na_rep='NA')
+    return fn
+
+
+def plot_run_design(fn):
+    """ Renders the pdf overview of a run design tsv """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.style.use('dark_background')
+
+    df = pd.read_csv(fn, sep='\t', index_col=0, na_values='NA')
+    if '_task-train_' in fn:
+        f, axs = plt.subplots(1, 3, figsize=(20, 8))
+        axs[0].plot(df['radians'], 'wo')
+        axs[0].set_title('Orientations in radians')
+        axs[0].set_xlabel('Trials')
+        axs[0].set_ylabel('Orientation in radians')
+        axs[1].plot(df['rounded_orientation_degrees'], 'ro')
+        axs[1].set_title('Orientations in degrees')
+        axs[1].set_xlabel('Trials')
+        axs[1].set_ylabel('Orientation in degrees')
+        axs[2].hist(df['rounded_orientation_degrees'], bins=np.arange(-90, 90, 0.5))
+        axs[2].set_title(f'Histogram of rounded orientations ({len(np.unique(df["rounded_orientation_degrees"]))} unique orientations)')
+        axs[2].set_xlabel('Orientation in degrees')
+        axs[2].set_ylabel('Count')
+    else:
+        f, axs = plt.subplots(2, 2, figsize=(20, 8))
+        for color, c in [('red', 'r'), ('green', 'g')]:
+            sel = df['color'] == color
+            axs[0][0].plot(df.index[sel], df['radians'][sel], f'{c}o')
+            axs[0][0].plot(df.index[sel], df['block_mean'][sel], f'{c}-', lw=4)
+            axs[0][1].hist(df['radians'][sel], bins=np.linspace(-np.pi, np.pi, 8), color=c, alpha=0.5)
+            axs[1][0].plot(df.index[sel], df['rounded_orientation_degrees'][sel], f'{c}o')
+            axs[1][1].hist(df['rounded_orientation_degrees'][sel], bins=np.linspace(-90, 90, 80), color=c, alpha=0.5)
+    pdf_fn = fn.replace('.tsv', '.pdf')
+    plt.savefig(pdf_fn)
+    plt.close(f)
+    return pdf_fn
+
+
+def parse_weights(weights):
+    """ Parses a weight specification like 'coverage=2,color_balance=1' """
+    parsed = dict(DEFAULT_WEIGHTS)
+    for part in filter(None, weights.split(',')):
+        criterion, weight = part.split('=')
+        if criterion not in DEFAULT_WEIGHTS:
+            raise click.BadParameter(f'unknown criterion {criterion}, choose from {list(DEFAULT_WEIGHTS)}')
+        parsed[criterion] = float(weight)
+    return parsed
+
+
+@click.command()
+@click.option('--subs', default='1', type=IntList(), help='Subjects, e.g. 1-60 or 1,3,5')
+@click.option('--n_train_runs', default=4, type=int, help='Train runs per subject')
+@click.option('--n_test_runs', default=12, type=int, help='Test runs per subject')
+@click.option('--seed', default=0, type=int, help='Base seed of the cohort')
+@click.option('--overlap', default=2.2, type=float, help='Overlap between neighbouring test blocks')
+@click.option('--min_n_blocks', default=2, type=int, help='Smallest number of blocks per color in test runs')
+@click.option('--max_n_blocks', default=6, type=int, help='Number of blocks per color in test runs stays below this')
+@click.option('--n_candidates', default=1, type=int, help='Candidate designs scored per test run (1: no search)')
+@click.option('--weights', default='', type=str, help='Score weights, e.g. coverage=2,empty_unpredictability=0.5')
+@click.option('--n_jobs', default=None, type=int, help='Worker processes (default: all cores)')
+@click.option('--out_dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exp_designs', 'run_designs'),
+              type=str, help='Output directory')
+@click.option('--plot', is_flag=True, default=False, help='Also render a pdf per run, after all tsvs are written')
+def main_api(subs, n_train_runs, n_test_runs, seed, overlap, min_n_blocks, max_n_blocks,
+             n_candidates, weights, n_jobs, out_dir, plot):
+    # solved (or looked up) once here, so workers never touch the table
+    test_kwargs = {'kappas': optimal_kappas(range(min_n_blocks, max_n_blocks), overlap),
+                   'min_n_blocks': min_n_blocks,
+                   'max_n_blocks': max_n_blocks}
+    jobs = [(sub, task, run_id)
+            for sub in subs
+            for task, n_runs in [('train', n_train_runs), ('test', n_test_runs)]
+            for run_id in range(1, n_runs+1)]
+
+    subs_, tasks, run_ids = zip(*jobs)
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        fns = list(pool.map(write_run_design, subs_, tasks, run_ids,
+                            [out_dir]*len(jobs), [seed]*len(jobs),
+                            [test_kwargs]*len(jobs), [n_candidates]*len(jobs),
+                            [parse_weights(weights)]*len(jobs), chunksize=16))
+        print(f'wrote {len(fns)} run designs to {out_dir}')
+        if plot:
+            list(pool.map(plot_run_design, fns, chunksize=4))
+            print(f'rendered {len(fns)} pdfs')
+
+
+if __name__ == '__main__':
+    main_api()
@@ -0,0 +1,209 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+COLOR_NAMES = np.array(['black', 'red', 'green'])
+
+DEFAULT_WEIGHTS = {'coverage': 1.0,
+                   'color_balance': 1.0,
+                   'empty_unpredictability': 1.0}
+
+
+def _color_blocks(rng, n_blocks, n_trials, kappas, block_duration_slack):
+    """ Block number, mean and kappa of every trial of one color, for all candidates """
+    n_candidates = len(n_blocks)
+    block_nr = np.zeros((n_candidates, n_trials), dtype=int)
+    means = np.zeros((n_candidates, n_trials))
+    kappa = np.zeros((n_candidates, n_trials))
+    trial_idx = np.arange(n_trials)
+
+    for n in np.unique(n_blocks):
+        rows = np.flatnonzero(n_blocks == n)
+        n_trials_per_block = n_trials / n
+        bounds = np.tile(np.cumsum(np.ones(n)*n_trials_per_block).astype(int), (len(rows), 1))
+        jitter = int(block_duration_slack // n_trials_per_block)
+        bounds += rng.integers(-jitter, jitter+1, size=bounds.shape)
+        # a trial's block is the number of inner block bounds at or before it
+        nr = (trial_idx[np.newaxis, :, np.newaxis] >=
+              bounds[:, np.newaxis, :-1]).sum(axis=-1)
+        block_means = rng.permuted(
+            np.fmod(rng.random((len(rows), 1)) + np.linspace(0, 1, n, endpoint=False), 1) * np.pi * 2 - np.pi,
+            axis=1)
+        block_nr[rows] = nr
+        means[rows] = np.take_along_axis(block_means, nr, axis=1)
+        kappa[rows] = kappas[n]
+    return block_nr, means, kappa
+
+
+def sample_test_designs(rng, n_candidates, kappas,
+                        total_n_trials=90,
+                        n_empty_trials=10,
+                        min_n_blocks=2,
+                        max_n_blocks=6,
+                        empty_trial_slack=2,
+                        block_duration_slack=10):
+    """ Draws many test run designs at once.
+
+    Follows the same recipe as design.test_run_orientations, with every
+    quantity carrying a leading candidate axis.
+
+    Returns
+    -------
+    designs : dict of np.ndarray
+        Arrays of shape (n_candidates, total_n_trials): 'block' (1-based,
+        0 for empty trials), 'block_mean', 'block_kappa', 'radians' and
+        'color' (0: black, 1: red, 2: green); and 'empty_trials', the sorted
+        positions of the empty trials, of shape (n_candidates, n_empty_trials).
+    """
+    empty_stride_f = total_n_trials/(n_empty_trials+1)
+    empty_trials = np.cumsum(np.ones(n_empty_trials)*empty_stride_f).astype(int) + \
+        rng.integers(-empty_trial_slack, empty_trial_slack+1, size=(n_candidates, n_empty_trials))
+    n_trials_each_color = (total_n_trials - n_empty_trials)//2
+
+    per_color = []
+    for _ in ['red', 'green']:
+        n_blocks = rng.integers(min_n_blocks, max_n_blocks, size=n_candidates)
+        block_nr, means, kappa = _color_blocks(
+            rng, n_blocks, n_trials_each_color, kappas, block_duration_slack)
+        radians = rng.vonmises(means, kappa)
+        per_color.append(np.stack([block_nr+1, means, kappa, radians]))
+
+    # interleave: the k-th red trial takes the k-th red value, same for green
+    is_red = rng.permuted(np.tile(np.r_[np.zeros(n_trials_each_color), np.ones(n_trials_each_color)],
+                                  (n_candidates, 1)), axis=1).astype(bool)
+    rank = np.where(is_red, np.cumsum(is_red, axis=1), np.cumsum(~is_red, axis=1)) - 1
+    values = np.where(is_red[np.newaxis],
+                      np.take_along_axis(per_color[0], rank[np.newaxis].repeat(4, 0), axis=2),
+                      np.take_along_axis(per_color[1], rank[np.newaxis].repeat(4, 0), axis=2))
+    color = np.where(is_red, 1, 2)
+
+    # empty trials go in front of the trial at their position
+    keys = np.c_[np.tile(np.arange(2*n_trials_each_color), (n_candidates, 1)), empty_trials - 0.5]
+    order = np.argsort(keys, axis=1, kind='stable')
+    empty_values = np.zeros((4, n_candidates, n_empty_trials))
+    empty_values[1:] = np.nan
+    values = np.take_along_axis(np.concatenate([values, empty_values], axis=2),
+                                order[np.newaxis].repeat(4, 0), axis=2)
+    color = np.take_along_axis(np.c_[color, np.zeros((n_candidates, n_empty_trials), dtype=int)],
+                               order, axis=1)
+    empty_positions = np.sort(np.argsort(order, axis=1)[:, 2*n_trials_each_color:], axis=1)
+
+    return {'block': values[0], 'block_mean': values[1], 'block_kappa': values[2],
+            'radians': values[3], 'color': color, 'empty_trials': empty_positions}
+
+
+def score_designs(designs, weights=DEFAULT_WEIGHTS, n_orientation_bins=12, n_segments=4):
+    """ Scores candidate designs; every criterion is higher-is-better.
+
+    coverage
+        Normalized entropy of the histogram of presented orientations
+        (1: all orientation bins used equally often).
+    color_balance
+        One minus the largest deviation from a 50/50 red/green split in any
+        of `n_segments` equal parts of the run, scaled to [0, 1].
+    empty_unpredictability
+        Coefficient of variation of the spacing between empty trials
+        (0: perfectly regular, hence predictable, spacing).
+
+    Returns
+    -------
+    total : np.ndarray
+        Weighted sum of the criteria, one value per candidate.
+    scores : dict of np.ndarray
+        The individual criteria.
+    """
+    color = designs['color']
+    n_candidates, n_trials = color.shape
+    scores = {}
+
+    # orientation modulo 180 degrees, as presented on screen
+    stim = color > 0
+    orientation = np.mod(np.where(stim, designs['radians'], 0) / 2, np.pi)
+    bins = np.minimum((orientation / np.pi * n_orientation_bins).astype(int), n_orientation_bins-1)
+    flat = (np.arange(n_candidates)[:, np.newaxis] * n_orientation_bins + bins)[stim]
+    counts = np.bincount(flat, minlength=n_candidates*n_orientation_bins).reshape(
+        n_candidates, n_orientation_bins)
+    p = counts / counts.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores['coverage'] = -np.nansum(p * np.log(p), axis=1) / np.log(n_orientation_bins)
+
+    segment = np.arange(n_trials) * n_segments // n_trials
+    red_frac = np.stack([(color[:, segment == s] == 1).sum(axis=1) /
+                         np.maximum(stim[:, segment == s].sum(axis=1), 1)
+                         for s in range(n_segments)], axis=1)
+    scores['color_balance'] = 1 - 2 * np.abs(red_frac - 0.5).max(axis=1)
+
+    gaps = np.diff(np.c_[np.zeros(n_candidates), designs['empty_trials'],
+                         np.full(n_candidates, n_trials)], axis=1)
+    scores['empty_unpredictability'] = gaps.std(axis=1) / gaps.mean(axis=1)
+
+    total = np.zeros(n_candidates)
+    for criterion, weight in weights.items():
+        total += weight * scores[criterion]
+    return total, scores
+
+
+def designs_to_df(designs, i, rng):
+    """ Converts candidate i into the DataFrame layout of a test run tsv """
+    df = pd.DataFrame({col: designs[col][i] for col in ['block', 'block_mean', 'block_kappa', 'radians']})
+    df['color'] = COLOR_NAMES[designs['color'][i]]
+    df['grating_contrast_multiplier'] = (designs['color'][i] > 0).astype(float)
+    df['rounded_orientation_degrees'] = np.round(np.degrees(df['radians']) / 10) * 5
+    df['grating_phase'] = rng.random(len(df))
+    return df
+
+
+def _best_of_chunk(seed_seq, n_candidates, kappas, weights, design_kwargs):
+    rng = np.random.default_rng(seed_seq)
+    designs = sample_test_designs(rng, n_candidates, kappas, **design_kwargs)
+    total, scores = score_designs(designs, weights)
+    best = int(np.argmax(total))
+    return total[best], {k: v[best] for k, v in scores.items()}, designs_to_df(designs, best, rng)
+
+
+def search_test_design(seed_seq, n_candidates, kappas, weights=DEFAULT_WEIGHTS,
+                       chunk_size=5000, n_jobs=1, **design_kwargs):
+    """ Returns the best of `n_candidates` random test designs.
+
+    Candidates are drawn and scored in chunks of `chunk_size`, each with
+    its own child of `seed_seq`, so the result does not depend on `n_jobs`.
+
+    Parameters
+    ----------
+    seed_seq : np.random.SeedSequence
+        Seed of this run's search.
+    n_candidates : int
+        Number of candidate designs to draw.
+    kappas : dict
+        Kappa per number of blocks (see kappas.optimal_kappas).
+    weights : dict
+        Weight of each criterion of `score_designs`.
+    chunk_size : int
+        Number of candidates drawn and scored at once.
+    n_jobs : int
+        Number of worker processes; 1 searches in the calling process.
+    design_kwargs : dict
+        Passed on to `sample_test_designs`.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        The best design, in the layout of a test run tsv.
+    score : float
+        Its weighted score.
+    scores : dict
+        Its individual criteria.
+    """
+    n_chunks = int(np.ceil(n_candidates / chunk_size))
+    sizes = [min(chunk_size, n_candidates - i*chunk_size) for i in range(n_chunks)]
+    args = (seed_seq.spawn(n_chunks), sizes, [kappas]*n_chunks,
+            [weights]*n_chunks, [design_kwargs]*n_chunks)
+    if n_jobs == 1:
+        results = list(map(_best_of_chunk, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_best_of_chunk, *args))
+
+    score, scores, df = max(results, key=lambda result: result[0])
+    return df, score, scores
@@ -0,0 +1,285 @@
+import glob
+import json
+import os
+
+import click
+import h5py
+import numpy as np
+import pandas as pd
+
+
+# columns exptools2 logs for every event
+EVENT_SCHEMA = {'trial_nr': 'numeric', 'onset': 'numeric', 'event_type': 'text',
+                'phase': 'numeric', 'response': 'text', 'nr_frames': 'numeric'}
+
+
+def records_schema(dtype):
+    """ Returns the event log schema of the fields of a structured dtype """
+    return {name: 'text' if dtype[name].kind in 'USO' else 'numeric' for name in dtype.names}
+
+
+class ColumnarEventLog:
+
+    def __init__(self, fn, constants, run_info, schema=None):
+        """ Typed, columnar event log stored in an HDF5 file.
+
+        Every column of the events log becomes its own resizable dataset
+        under /events: numeric columns are stored as float64, text columns
+        as int16 codes into a list of categories kept in the dataset's
+        attributes. Run-level constants (the settings that used to be
+        repeated on every row) are stored once, as JSON, in the file's
+        attributes.
+
+        The kind of every column comes from `schema`, not from the values
+        that happen to be logged, so that e.g. a response key '1' stays
+        text. Columns missing from the schema are stored as text, which
+        the _events.tsv converter writes back unchanged.
+
+        The file stays open until close() and is flushed after every
+        append.
+
+        Parameters
+        ----------
+        fn : str
+            Path of the HDF5 file.
+        constants : dict
+            Settings that are the same for every event of the run.
+        run_info : dict
+            Run identifiers (sub, ses, task, run) stored as file attributes.
+        schema : dict
+            Kind ('numeric' or 'text') per column, see EVENT_SCHEMA and
+            records_schema.
+        """
+        self.fn = fn
+        self.schema = dict(EVENT_SCHEMA if schema is None else schema)
+        self.n_rows = 0
+        self.columns = []
+        self.categories = {}
+
+        os.makedirs(os.path.dirname(self.fn) or '.', exist_ok=True)
+        self.h5 = h5py.File(self.fn, 'w')
+        self.h5.attrs['constants'] = json.dumps(constants, default=str)
+        for key, value in run_info.items():
+            self.h5.attrs[key] = value
+        self.group = self.h5.create_group('events')
+        self.group.attrs['columns'] = json.dumps([])
+
+    def _create(self, name, n_rows):
+        kind = self.schema.get(name, 'text')
+        if kind == 'numeric':
+            ds = self.group.create_dataset(name, shape=(n_rows,), maxshape=(None,),
+                                           dtype='f8', fillvalue=np.nan, chunks=(1024,),
+                                           compression='gzip', shuffle=True)
+        else:
+            ds = self.group.create_dataset(name, shape=(n_rows,), maxshape=(None,),
+                                           dtype='i2', fillvalue=-1, chunks=(1024,),
+                                           compression='gzip', shuffle=True)
+            ds.attrs['categories'] = json.dumps([])
+            self.categories[name] = {}
+        ds.attrs['kind'] = kind
+        self.columns.append(name)
+        return ds
+
+    def _encode(self, ds, values):
+        lookup = self.categories[ds.name.split('/')[-1]]
+        n_categories = len(lookup)
+        codes = np.full(len(values), -1, dtype='i2')
+        for i, value in enumerate(values):
+            if pd.isna(value):
+                continue
+            value = str(value)
+            if value not in lookup:
+                lookup[value] = len(lookup)
+            codes[i] = lookup[value]
+        if len(lookup) > n_categories:
+            ds.attrs['categories'] = json.dumps(list(lookup))
+        return codes
+
+    def append(self, events):
+        """ Appends the rows of an events DataFrame """
+        if len(events) == 0:
+            return
+        n_total = self.n_rows + len(events)
+
+        for col in events.columns:
+            ds = self.group[col] if col in self.group else self._create(col, self.n_rows)
+            values = events[col].to_numpy()
+            ds.resize((n_total,))
+            if ds.attrs['kind'] == 'numeric':
+                ds[self.n_rows:] = pd.to_numeric(values).astype('f8')
+            else:
+                ds[self.n_rows:] = self._encode(ds, values)
+
+        # columns absent from these rows keep their fill value
+        for col in self.group:
+            if self.group[col].shape[0] < n_total:
+                self.group[col].resize((n_total,))
+        self.group.attrs['columns'] = json.dumps(self.columns)
+        self.n_rows = n_total
+        self.h5.flush()
+
+    def close(self, exp_start=None, t_stop=None, nr_frames=None):
+        """ Closes the file, at the end of the run
+
+        `exp_start`, `t_stop` and `nr_frames` (see format_events) are
+        stored as file attributes, so the converter can write the
+        _events.tsv the session writes.
+        """
+        if self.h5 is not None:
+            for key, value in [('exp_start', exp_start), ('t_stop', t_stop), ('nr_frames', nr_frames)]:
+                if value is not None:
+                    self.h5.attrs[key] = value
+            self.h5.close()
+            self.h5 = self.group = None
+
+
+def read_events(fn, with_constants=False):
+    """ Reads a columnar event log into a DataFrame
+
+    Parameters
+    ----------
+    fn : str
+        Path of the HDF5 event log.
+    with_constants : bool
+        Whether to broadcast the run-level constants into columns, as in the
+        original events tsv.
+
+    Returns
+    -------
+    events : pd.DataFrame
+        The events, with the run identifiers and constants in `events.attrs`.
+    """
+    with h5py.File(fn, 'r') as h5:
+        group = h5['events']
+        data = {}
+        for col in json.loads(group.attrs['columns']):
+            ds = group[col]
+            if ds.attrs['kind'] == 'numeric':
+                data[col] = ds[:]
+            else:
+                categories = json.loads(ds.attrs['categories'])
+                data[col] = pd.Categorical.from_codes(ds[:], categories=categories)
+        constants = json.loads(h5.attrs['constants'])
+        run_info = {k: v for k, v in h5.attrs.items() if k != 'constants'}
+
+    events = pd.DataFrame(data)
+    if with_constants:
+        for key, value in constants.items():
+            if key not in events.columns:
+                events[key] = [value] * len(events)
+    events.attrs.update(run_info)
+    events.attrs['constants'] = constants
+    return events
+
+
+def read_study(log_dir, pattern='sub-*_events.h5'):
+    """ Reads all columnar event logs in a directory into one DataFrame """
+    frames = []
+    for fn in sorted(glob.glob(os.path.join(log_dir, pattern))):
+        events = read_events(fn)
+        for key in ['sub', 'ses', 'task', 'run']:
+            events[key] = events.attrs.get(key)
+        frames.append(events)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+# events that are not phases, and so have no duration
+NON_PHASE_EVENTS = ['response', 'trigger', 'pulse', 'non_response_keypress']
+
+
+def add_durations(events, t_stop=np.nan):
+    """ Adds durations as computed by exptools2 when closing a session
+
+    A phase lasts until the next phase onset, the last one until `t_stop`;
+    responses and pulses have none.
+    """
+    events['duration'] = np.nan
+    phase_idx = ~events['event_type'].isin(NON_PHASE_EVENTS)
+    onsets = events.loc[phase_idx, 'onset'].to_numpy(dtype=float)
+    events.loc[phase_idx, 'duration'] = np.r_[np.diff(onsets), t_stop - onsets[-1:]]
+    return events
+
+
+# columns exptools2 writes as integers
+INTEGER_COLUMNS = ['trial_nr', 'phase']
+
+
+def format_events(global_log, exp_start, t_stop, nr_frames, constants=None):
+    """ Formats the global_log of a run as exptools2 writes it when closing a session
+
+    Parameters
+    ----------
+    global_log : pd.DataFrame
+        The events of the run, with onsets on the run's clock.
+    exp_start : float
+        Start of the run's clock, on the clock of the session (onset_abs).
+    t_stop : float
+        End of the last phase, on the run's clock.
+    nr_frames : int
+        Frames of the last phase; every phase logs the frames of the
+        previous one, so the column is shifted back by one phase. None if
+        unknown (a run that did not close).
+    constants : dict
+        Run-level settings to add as columns, as the trials log them when
+        they are not stored once (see ColumnarEventLog).
+
+    Returns
+    -------
+    events : pd.DataFrame
+        The events, indexed by trial_nr, ready to be written as _events.tsv.
+    """
+    events = global_log.copy()
+    for key, value in (constants or {}).items():
+        if key not in events.columns:
+            events[key] = [value] * len(events)
+    for col in INTEGER_COLUMNS:
+        if col in events.columns and events[col].notnull().all():
+            events[col] = events[col].astype(int)
+    events = events.set_index('trial_nr')
+    events['onset_abs'] = events['onset'] + exp_start
+    events = add_durations(events, t_stop=t_stop)
+    phase_idx = ~events['event_type'].isin(NON_PHASE_EVENTS)
+    if 'nr_frames' in events.columns and phase_idx.any():
+        shifted = np.append(events.loc[phase_idx, 'nr_frames'].to_numpy(dtype=float)[1:],
+                            np.nan if nr_frames is None else nr_frames)
+        events.loc[phase_idx, 'nr_frames'] = shifted
+    return events.round({'onset': 5, 'onset_abs': 5, 'duration': 5})
+
+
+def to_events_tsv(fn, tsv_fn=None, overwrite=False):
+    """ Converts a columnar event log into the original _events.tsv format
+
+    The events are formatted as the session writes them (see
+    format_events), with the run-level constants as columns. An existing
+    tsv, such as the one the session wrote itself, is only replaced with
+    `overwrite`.
+    """
+    events = read_events(fn)
+    for col in events.columns:
+        if isinstance(events[col].dtype, pd.CategoricalDtype):
+            events[col] = events[col].astype(object)
+
+    if tsv_fn is None:
+        tsv_fn = fn.replace('_events.h5', '_events.tsv')
+    if os.path.exists(tsv_fn) and not overwrite:
+        raise FileExistsError(f'{tsv_fn} exists, pass overwrite to replace it')
+    nr_frames = events.attrs.get('nr_frames')
+    format_events(events, events.attrs.get('exp_start', np.nan), t_stop=events.attrs.get('t_stop', np.nan),
+                  nr_frames=None if nr_frames is None else int(nr_frames),
+                  constants=events.attrs['constants']).to_csv(tsv_fn, sep='\t', index=True)
+    return tsv_fn
+
+
+@click.command()
+@click.argument('fns', nargs=-1, type=str)
+@click.option('--overwrite', is_flag=True, default=False, help='Replace existing _events.tsv files')
+def main_api(fns, overwrite):
+    """ Converts columnar _events.h5 logs into _events.tsv files """
+    for fn in fns:
+        print(to_events_tsv(fn, overwrite=overwrite))
+
+
+if __name__ == '__main__':
+    main_api()
@@ -1,35 +1,126 @@
-from genericpath import isfile
 from exptools2.core import PylinkEyetrackerSession
 import numpy as np
-import h5py
 import yaml
 import os
-import sys
-import time
 import pandas as pd
 from psychopy.visual import GratingStim, Circle
-from psychopy.data.staircase import QuestPlusHandler
+from staircase import CachedQuestPlusHandler, StaircaseWorker
+from prunedquest import PrunedQuestPlusHandler
+from checkpoint import StaircaseCheckpoint, checkpoint_prefix
+from schedule import compile_stim_plan, n_frames
+from frametiming import FlipRecorder, read_flips, summarize
+from eventlog import EVENT_SCHEMA, ColumnarEventLog, format_events, records_schema
+from runbundle import load_run_bundle, record_to_dict
+from inputs import InputPoller, response_table
+from gaze import GazeStream, PylinkSampleSource, SimulatedGazeSource
+from stimcache import StimulusCache
+from stimstate import StimState, UpdateCounter
+from triggers import SimulatedTriggers, TriggerClock
 from trial import InstructionTrial, \
     DummyWaiterTrial, OutroTrial, \
     ExpOriMapperTrial, PositioningTrial
 
 
+# columns the experimental trials fill in while they run
+TRIAL_SCHEMA = {'response_value': 'numeric',
+                'response_key': 'text',
+                'response_sign': 'numeric',
+                'response_time': 'numeric',
+                'response_correct': 'numeric',
+                'button_pressed': 'text',
+                'stim_value_p1': 'numeric',
+                'stim_value_p2': 'numeric',
+                'stim_onset_p1': 'numeric',
+                'stim_onset_p2': 'numeric',
+                'fixation_break': 'numeric',
+                'correct_response_sign': 'numeric',
+                'staircase_value': 'numeric'}
+
+
+def run_output_str(sub, ses, task, run_id):
+    """ Returns the output name of a run """
+    return f'sub-{str(sub).zfill(2)}_ses-{str(ses).zfill(1)}_task-{task}_run-{str(run_id).zfill(2)}'
+
+
 class ExpOriMapperSession(PylinkEyetrackerSession):
-    def __init__(self, sub, run_id, ses, task, output_str, settings_file, eyetracker_on):
-        super().__init__(output_str=output_str, output_dir=None, settings_file=settings_file, eyetracker_on=eyetracker_on)
+    def __init__(self, sub, run_id, ses, task, output_str, settings_file, eyetracker_on, output_dir=None,
+                 resume=False, overwrite_checkpoint=False):
+        super().__init__(output_str=output_str, output_dir=output_dir, settings_file=settings_file, eyetracker_on=eyetracker_on)
         self.sub = sub
         self.run_id = run_id
         self.ses = ses
         self.task = task
+        self.resume = resume
+        self.overwrite_checkpoint = overwrite_checkpoint
         self.create_stimuli()
+        self.create_frame_schedule()
+        self.create_flip_recorder()
+        self.create_input()
+        self.create_trigger_clock()
         self.create_trials()
+        self.create_gaze_stream()
         self.create_staircase()
 
     def create_staircase(self):
         """ Creates a staircase for the session """
         quest_plus_s = self.settings['questplus']
-        self.staircase = QuestPlusHandler(
-            nTrials=self.n_trials+25, **quest_plus_s)
+        staircase_s = self.settings['staircase']
+        engine = staircase_s.get('engine', 'questplus')
+        if engine == 'questplus':
+            self.staircase = CachedQuestPlusHandler(
+                nTrials=self.n_trials+25,
+                cache_dir=staircase_s['cache_dir'],
+                **quest_plus_s)
+        elif engine == 'pruned':
+            self.staircase = PrunedQuestPlusHandler(
+                nTrials=self.n_trials+25,
+                **staircase_s['pruned'],
+                **quest_plus_s)
+        else:
+            raise ValueError(f'unknown staircase engine {engine}, choose from questplus, pruned')
+        self.create_checkpoint(resume=self.resume)
+        # all updates go through the worker, off the frame loop
+        self.staircase_worker = StaircaseWorker(
+            self.staircase, deadline=self.settings['staircase']['deadline'],
+            checkpoint=self.checkpoint)
+        self.run_decisions_start = 0
+
+    def run_checkpoint(self, run_id):
+        """ Returns the staircase checkpoint of run `run_id` (not yet created or opened) """
+        return StaircaseCheckpoint(
+            checkpoint_prefix(self.settings['staircase']['checkpoint_dir'],
+                              self.sub, self.ses, self.task, run_id),
+            posterior_shape=self.staircase.posterior_shape,
+            response_vals=self.settings['questplus']['responseVals'],
+            settings_key=self.staircase.cache_key)
+
+    def create_checkpoint(self, resume=False):
+        """ Creates the staircase checkpoint of the current run
+
+        Checkpoints are kept per run, so every launch of main.py starts its
+        own. With `resume`, the staircase is first restored from the
+        run's existing checkpoint, which is then written on from there.
+        Without it, an existing checkpoint is only replaced with
+        `overwrite_checkpoint`. A staircase that goes on from an earlier
+        run of the session stores its state in the new checkpoint at once.
+        """
+        staircase_s = self.settings['staircase']
+        if not staircase_s.get('checkpoint', False):
+            if resume:
+                raise ValueError('cannot resume: staircase checkpoints are disabled in the settings')
+            self.checkpoint = None
+            return
+        self.checkpoint = self.run_checkpoint(self.run_id)
+        if not resume:
+            self.checkpoint.create(overwrite=self.overwrite_checkpoint)
+            return
+        if not self.checkpoint.exists():
+            raise FileNotFoundError(f'no staircase checkpoint to resume at {self.checkpoint.prefix}')
+        self.checkpoint.open()
+        state = self.checkpoint.read()
+        if state is not None:
+            self.staircase.set_state(**state)
+            print(f'resumed staircase after {len(state["responses"])} responses')
 
     def update_stimulus_position(self):
         """ Updates the stimulus position """
@@ -70,12 +161,192 @@ class ExpOriMapperSession(PylinkEyetrackerSession):
                                    mask='raisedCos',
                                    maskParams={'fringeWidth': exp_s['grating_fringewidth']},
                                    texRes=1024)
+        self.track_stim_state()
+
+        # instruction, waiter and outro stimuli, shared by the trials of all runs
+        self.stim_cache = StimulusCache(
+            self.win, max_size=self.settings['stim_cache']['max_size'])
+
+    def track_stim_state(self):
+        """ Wraps the grating and fixation dots so that only changed values reach them, if requested """
+        self.stim_updates = None
+        if not self.settings.get('stim_state', {}).get('track', False):
+            return
+        self.stim_updates = UpdateCounter()
+        self.stim_updates.install(self.win)
+        self.grating, self.center_fixation_dot, self.surround_fixation_dot = [
+            StimState(stim, self.stim_updates)
+            for stim in [self.grating, self.center_fixation_dot, self.surround_fixation_dot]]
+
+    def create_frame_schedule(self):
+        """ Compiles the stimulus presentation into a per-frame draw plan """
+        exp_s = self.settings['experiment']
+        self.refresh_rate = exp_s.get('refresh_rate')
+        if self.refresh_rate is None:
+            self.refresh_rate = self.win.getActualFrameRate()
+
+        self.frame_schedule = exp_s.get('frame_schedule', False)
+        if not self.frame_schedule:
+            self.stim_frame_plan = None
+            return
+
+        self.stim_frame_plan = compile_stim_plan(
+            exp_s['stim_duration'], exp_s['interstim_interval'], self.refresh_rate)
+        n_on = int((self.stim_frame_plan['interval'] == 1).sum())
+        print(f'frame schedule at {self.refresh_rate:.2f} Hz: '
+              f'{n_on} frames ({n_on / self.refresh_rate * 1000:.1f} ms) per presentation')
+
+    def create_flip_recorder(self):
+        """ Instruments the window's flips, if requested in the settings """
+        ft_s = self.settings.get('frame_timing', {})
+        self.flip_recorder = None
+        if not ft_s.get('enabled', False):
+            return
+
+        self.flip_recorder = FlipRecorder(
+            session=self,
+            fn=os.path.join(self.output_dir, self.output_str + '_frametimes.h5'),
+            expected_interval=1.0 / self.refresh_rate,
+            buffer_size=ft_s['buffer_size'],
+            late_factor=ft_s['late_factor'])
+        self.flip_recorder.install(self.win)
+
+    def create_input(self):
+        """ Sets up the response table and, if requested, the input polling thread """
+        input_s = self.settings.get('input', {})
+        self.response_table = response_table(self.settings['experiment'])
+        self.input_poller = None
+        if input_s.get('poller', False):
+            try:
+                self.input_poller = InputPoller(
+                    self.response_table, poll_interval=input_s['poll_interval'])
+            except RuntimeError as e:
+                print(f'not polling input on a thread: {e}')
+
+    def create_gaze_stream(self):
+        """ Sets up online fixation monitoring, if requested in the settings """
+        gaze_s = self.settings.get('gaze', {})
+        self.gaze_stream = None
+        if not gaze_s.get('enabled', False):
+            return
+
+        if gaze_s.get('simulate', False):
+            source = SimulatedGazeSource(
+                self.clock, center=(self.stim_position_info['x_offset'], self.stim_position_info['y_offset']))
+        elif self.eyetracker_on:
+            source = PylinkSampleSource(
+                self.tracker, self.clock, self.monitor, self.win.size,
+                eye=self.settings['eyetracker']['options']['active_eye'])
+        else:
+            return
+        self.gaze_stream = GazeStream(
+            source, buffer_size=gaze_s['buffer_size'], poll_interval=gaze_s['poll_interval'])
+
+    def _setup_mri_simulator(self):
+        # mri.simulate is served by create_trigger_clock instead of keyboard events
+        return None
+
+    def create_trigger_clock(self):
+        """ Sets up the trigger clock and, with mri.simulate, the simulated scanner """
+        trigger_s = self.settings['triggers']
+        self.trigger_clock = TriggerClock(
+            self.settings['mri']['TR'], max_triggers=trigger_s['max_triggers'])
+        self.trigger_simulator = None
+        if self.settings['mri'].get('simulate', False):
+            self.trigger_simulator = SimulatedTriggers(
+                self.settings['mri']['TR'], delay=trigger_s['simulate_delay'],
+                drift=trigger_s['simulate_drift'], jitter=trigger_s['simulate_jitter'],
+                p_drop=trigger_s['simulate_p_drop'])
+
+    def start_scan(self):
+        """ Called when the run starts waiting for the scanner: triggers from now on belong to this run """
+        self.trigger_clock.arm()
+        if self.trigger_simulator is not None:
+            self.trigger_simulator.start(self.clock.getTime())
+
+    def collect_triggers(self, trial, events):
+        """ Adds the simulated triggers to a trial's events and timestamps all triggers """
+        events = list(events or [])
+        if self.trigger_simulator is not None:
+            for t in self.trigger_simulator.poll(self.clock.getTime()):
+                # logged like the pulses exptools2 reads from the keyboard
+                idx = self.global_log.shape[0]
+                self.global_log.loc[idx, ['trial_nr', 'onset', 'event_type', 'phase', 'response']] = \
+                    [trial.trial_nr, t, 'pulse', trial.phase, self.mri_trigger]
+                events.append((self.mri_trigger, t))
+        for key, t in events:
+            if key == self.mri_trigger:
+                self.trigger_clock.add(t)
+        return events
+
+    def warn_volume(self, trial_nr):
+        """ Volume on whose trigger the warning of experimental trial `trial_nr` starts """
+        return self.lead_in_volumes + trial_nr * self.volumes_per_trial
+
+    def schedule_trial(self, trial_nr):
+        """ Phase durations of experimental trial `trial_nr`, locked to predicted triggers
+
+        The warning of trial k starts on the trigger of volume
+        lead_in_volumes + k * volumes_per_trial, counted from the trigger
+        that started the run. The fixation phase lasts up to that
+        predicted time, or ends on the trigger of that volume when it comes
+        in first, the response phase up to `fixation_lead` before the next
+        trial's warning, so timing errors and drift between the scanner and
+        this computer never add up over the run. No other trigger ends a
+        phase.
+        """
+        durations = list(self.trial_phase_durations)
+        if not self.settings['triggers']['locked'] or self.trigger_clock.n_triggers == 0:
+            return durations
+
+        volume = self.warn_volume(trial_nr)
+        warn_onset = self.trigger_clock.predict(volume)
+        next_warn_onset = self.trigger_clock.predict(volume + self.volumes_per_trial)
+        response_end = next_warn_onset - self.settings['triggers']['fixation_lead']
+        if self.trial_timing == 'frames':
+            stim_end = warn_onset + (durations[1] + durations[2]) / self.refresh_rate
+            durations[0] = max(n_frames(warn_onset - self.clock.getTime(), self.refresh_rate), 1)
+            durations[3] = max(n_frames(response_end - stim_end, self.refresh_rate), 1)
+        else:
+            # the exptools2 timer counts from the scheduled end of the last phase
+            phase_start = self.clock.getTime() - self.timer.getTime()
+            durations[0] = max(warn_onset - phase_start, 0)
+            durations[3] = max(response_end - (warn_onset + durations[1] + durations[2]), 0)
+        return durations
 
     def create_trial(self, trial_nr):
-        pass
+        """ Creates experimental trial `trial_nr` from the run bundle """
+        # add task settings to parameters of the trial
+        parameters = record_to_dict(self.trial_bundle[trial_nr])
+        if self.event_log is None:
+            # the columnar log stores these once, as run-level constants
+            parameters.update(self.run_constants)
+        # add task placeholders to parameters of the trial
+        parameters.update({'response_value': np.nan,
+                           'response_key': np.nan,
+                           'response_sign': np.nan,
+                           'response_time': np.nan,
+                           'response_correct': np.nan,
+                           'button_pressed': np.nan,
+                           'stim_value_p1': np.nan,
+                           'stim_value_p2': np.nan,
+                           'stim_onset_p1': np.nan,
+                           'stim_onset_p2': np.nan,
+                           'fixation_break': np.nan,
+                           'correct_response_sign': np.random.choice([-1, 1])})
+        return ExpOriMapperTrial(
+            session=self,
+            trial_nr=trial_nr,
+            phase_durations=self.trial_phase_durations,
+            phase_names=['fix', 'warning', 'stim', 'response'],
+            parameters=parameters,
+            timing=self.trial_timing,
+            load_next_during_phase=None,
+            verbose=True,
+            condition=self.task)
 
     def create_trials(self):
-        """ Creates trials before running the session"""
+        """ Sets up the trials of the run; experimental trials are created lazily """
         exp_s = self.settings['experiment']
 
         instruction_trial = InstructionTrial(session=self,
@@ -85,98 +356,220 @@ class ExpOriMapperSession(PylinkEyetrackerSession):
                                              keys=['space'],
                                              draw_each_frame=False)
 
+        # the lead-in ends `fixation_lead` before the first warning, see schedule_trial
+        fixation_lead = self.settings['triggers']['fixation_lead']
         dummy_trial = DummyWaiterTrial(session=self,
                                        trial_nr=1,
                                        phase_durations=[
-                                           np.inf, exp_s['start_end_period']],
+                                           np.inf, exp_s['start_end_period'] - fixation_lead],
                                        txt=exp_s['pretrigger_text'],
                                        draw_each_frame=False)
 
         # paths
-        default_settings_path = os.path.join(os.path.dirname(__file__),
-                                             'defaults.yml')
         tsv_path = os.path.join(os.path.dirname(__file__),
                                 f'exp_designs/run_designs/sub-{str(self.sub).zfill(2)}/sub-{str(self.sub).zfill(2)}_task-{str(self.task)}_run-{str(self.run_id).zfill(2)}.tsv')
 
-        with open(default_settings_path, 'r', encoding='utf8') as f_in:
-            self.default_settings = yaml.safe_load(f_in)
-        self.trial_df = pd.read_csv(
-            tsv_path, sep='\t', index_col=0, na_values='NA')
-        self.n_trials = len(self.trial_df)
+        # the design and the run-level settings, compiled once per design
+        self.trial_bundle, self.run_constants = load_run_bundle(
+            tsv_path, self.settings, self.settings['run_bundle']['cache_dir'])
+        self.n_trials = len(self.trial_bundle)
+        self.create_event_log()
 
         # read in or set up stimulus positioning
         self.stim_position_settings_file = f'data/sub-{str(self.sub).zfill(2)}_ses-{str(self.ses).zfill(2)}.yml'
         if os.path.isfile(self.stim_position_settings_file):
             with open(self.stim_position_settings_file, 'r', encoding='utf8') as f_in:
                 self.stim_position_info = yaml.safe_load(f_in)
-            self.trials = [instruction_trial, dummy_trial]
+            self.start_trials = [instruction_trial, dummy_trial]
         else:
-            self.stim_position_info = self.default_settings['stim_position_info']
+            self.stim_position_info = self.settings['stim_position_info']
             if self.stim_position_info['repositioning_required']:
                 position_trial = PositioningTrial(session=self)
-                self.trials = [position_trial, instruction_trial, dummy_trial]
+                self.start_trials = [position_trial, instruction_trial, dummy_trial]
             else:
-                self.trials = [instruction_trial, dummy_trial]
+                self.start_trials = [instruction_trial, dummy_trial]
 
         stim_pres_duration = 2 * \
             exp_s['stim_duration']+exp_s['interstim_interval']
         # remainder makes sure we flip to the next trial in time for the next trial
-        # stim presentation in the scanner should be triggered by the scanner
-        remainder_trial_duration = -0.1 + \
+        # stim presentation in the scanner should be triggered by the scanner;
+        # with locked triggers, schedule_trial sets it per trial
+        remainder_trial_duration = -fixation_lead + \
             exp_s['total_trial_duration'] - \
             (stim_pres_duration + exp_s['warn_duration'])
+        self.lead_in_volumes = int(round(exp_s['start_end_period'] / self.settings['mri']['TR']))
+        self.volumes_per_trial = int(round(exp_s['total_trial_duration'] / self.settings['mri']['TR']))
+
+        self.trial_phase_durations = [
+            1.0,
+            exp_s['warn_duration'],
+            stim_pres_duration,
+            remainder_trial_duration
+        ]
+        self.trial_timing = 'seconds'
+        if self.frame_schedule:
+            # every phase becomes a fixed number of frames, the stim
+            # phase lasting exactly as long as its draw plan
+            self.trial_phase_durations = [
+                n_frames(d, self.refresh_rate) for d in self.trial_phase_durations]
+            self.trial_phase_durations[2] = len(self.stim_frame_plan)
+            self.trial_timing = 'frames'
 
-        trial_counter = len(self.trials)
+        self.outro_trial = OutroTrial(session=self,
+                                      trial_nr=len(self.start_trials) + self.n_trials,
+                                      phase_durations=[
+                                          exp_s['start_end_period']],
+                                      txt='',
+                                      draw_each_frame=False)
+
+    def iter_trials(self):
+        """ Yields all trials of the run, creating each experimental trial when it is due
+
+        Creating a trial only copies a row of the run bundle into its
+        parameters, so it is done between trials rather than ahead.
+        """
+        yield from self.start_trials
         for i in range(self.n_trials):
-            # add task settings to parameters of the trial
-            parameters = self.trial_df.iloc[i].to_dict()
-            parameters.update(self.default_settings['experiment'])
-            parameters.update(self.default_settings['stim_position_info'])
-            # add task placeholders to parameters of the trial
-            parameters.update({'response_value': np.nan,
-                               'response_key': np.nan,
-                               'response_sign': np.nan,
-                               'response_time': np.nan,
-                               'response_correct': np.nan,
-                               'button_pressed': np.nan,
-                               'stim_value_p1': np.nan,
-                               'stim_value_p2': np.nan,
-                               'correct_response_sign': np.random.choice([-1, 1])})
-            self.trials.append(ExpOriMapperTrial(
-                session=self,
-                trial_nr=i,
-                phase_durations=[
-                    1.0,
-                    exp_s['warn_duration'],
-                    stim_pres_duration,
-                    remainder_trial_duration
-                ],
-                phase_names=['fix', 'warning', 'stim', 'response'],
-                parameters=parameters,
-                timing='seconds',
-                load_next_during_phase=None,
-                verbose=True,
-                condition=self.task)
-            )
-            trial_counter += 1
-
-        outro_trial = OutroTrial(session=self,
-                                 trial_nr=trial_counter,
-                                 phase_durations=[
-                                     exp_s['start_end_period']],
-                                 txt='',
-                                 draw_each_frame=False)
-
-        self.trials.append(outro_trial)
-
-    def run(self):
-        """ Loops over trials and runs them! """
+            yield self.create_trial(i)
+        yield self.outro_trial
+
+    def create_event_log(self):
+        """ Sets up the columnar event log, if requested in the settings """
+        self.event_log, self.n_logged_events = None, 0
+        if self.settings.get('event_log', {}).get('backend', 'tsv') != 'hdf5':
+            return
+
+        self.event_log = ColumnarEventLog(
+            fn=os.path.join(self.output_dir, self.output_str + '_events.h5'),
+            constants=self.run_constants,
+            run_info={'sub': self.sub, 'ses': self.ses,
+                      'task': self.task, 'run': self.run_id},
+            schema={**EVENT_SCHEMA, **records_schema(self.trial_bundle.dtype), **TRIAL_SCHEMA})
+
+    def log_events(self):
+        """ Appends the events logged since the last call to the columnar log """
+        if self.event_log is None:
+            return
+        new_events = self.global_log.iloc[self.n_logged_events:]
+        # durations are only filled in on close, the converter recomputes them
+        self.event_log.append(new_events.drop(columns='duration', errors='ignore'))
+        self.n_logged_events = len(self.global_log)
+
+    def load_run(self, run_id):
+        """ Switches the session to another run of the same subject, session and task
+
+        The window, stimuli, input and gaze threads and the staircase (with
+        its posterior) are kept; the design, trials and output files are
+        those of the new run.
+        """
+        self.run_id = run_id
+        self.output_str = run_output_str(self.sub, self.ses, self.task, run_id)
+        self.global_log = self.global_log.iloc[0:0]
+        if self.flip_recorder is not None:
+            self.flip_recorder.restart(
+                os.path.join(self.output_dir, self.output_str + '_frametimes.h5'))
+        self.create_trials()
+        # the staircase goes on from its posterior, it only needs room for this run
+        self.staircase.nTrials += self.n_trials + 25
+        self.create_checkpoint()
+        self.staircase_worker.set_checkpoint(self.checkpoint)
+        # onsets restart at 0, onset_abs goes on from the start of the first run
+        self.exp_start += self.clock.getTime()
+        self.clock.reset()
+        self.timer.reset()
+
+    def run_trials(self):
+        """ Runs all trials of the current run """
+        for trial in self.iter_trials():
+            trial.parameters['staircase_value'] = self.staircase_worker.next()
+            self.current_trial = trial
+            trial.run()
+            self.log_events()
+            if self.flip_recorder is not None:
+                self.flip_recorder.flush()
+
+    def run(self, run_ids=None):
+        """ Loops over trials and runs them!
+
+        With `run_ids`, the runs are done one after the other in this
+        session (see load_run), each writing its own output files.
+        """
+        run_ids = [self.run_id] if run_ids is None else run_ids
+        if self.checkpoint is not None and not self.overwrite_checkpoint:
+            # rather now than between runs
+            for run_id in run_ids[1:]:
+                if self.run_checkpoint(run_id).exists():
+                    raise FileExistsError(f'run {run_id} already has a staircase checkpoint, '
+                                          f'start over with main.py --overwrite_checkpoint True')
 
         self.start_experiment()
+        if self.input_poller is not None:
+            self.input_poller.start()
+        if self.gaze_stream is not None:
+            self.gaze_stream.start()
         print('running eomapper experiment')
 
-        for trial in self.trials:
-            trial.parameters['staircase_value'] = self.staircase.next()
-            trial.run()
+        for i, run_id in enumerate(run_ids):
+            if i > 0:
+                self.load_run(run_id)
+            self.run_trials()
+            if i < len(run_ids) - 1:
+                self._finish_run()
 
         self.close()
+
+    def _finish_run(self, events=None, t_stop=None):
+        """ Writes the outputs of the current run
+
+        Every run's events tsv is written here, in the format exptools2
+        uses on close; `events` and `t_stop` default to the global_log and
+        the current time.
+        """
+        if events is None:
+            self.log_events()
+            events = self.global_log
+        if t_stop is None:
+            t_stop = self.clock.getTime()
+        constants = None
+        if self.event_log is not None:
+            self.event_log.close(exp_start=self.exp_start, t_stop=t_stop, nr_frames=self.nr_frames)
+            # the trials left the run constants to the columnar log
+            constants = self.run_constants
+        format_events(events, self.exp_start, t_stop=t_stop, nr_frames=self.nr_frames,
+                      constants=constants).to_csv(
+            os.path.join(self.output_dir, self.output_str + '_events.tsv'), sep='\t', index=True)
+        self.staircase_worker.save_decisions(
+            os.path.join(self.output_dir, self.output_str + '_staircase.tsv'),
+            start=self.run_decisions_start)
+        self.run_decisions_start = len(self.staircase_worker.decisions)
+        if self.trigger_clock.n_triggers:
+            self.trigger_clock.save(os.path.join(self.output_dir, self.output_str + '_triggers.tsv'))
+            print(f'{self.trigger_clock.n_triggers} triggers, TR {self.trigger_clock.tr:.5f} s '
+                  f'(drift {self.trigger_clock.drift * 1e6:+.0f} ppm), {self.trigger_clock.n_spurious} ignored')
+        if self.gaze_stream is not None:
+            self.gaze_stream.save_breaks(
+                os.path.join(self.output_dir, self.output_str + '_fixation.tsv'))
+            self.gaze_stream.breaks = []
+        if self.stim_updates is not None:
+            updates = self.stim_updates.summary()
+            print(f'{updates["real"]} stimulus updates, {updates["redundant"]} skipped as redundant '
+                  f'({updates["real_per_frame"]:.2f} vs {updates["redundant_per_frame"]:.2f} per frame '
+                  f'over {updates["n_frames"]} frames)')
+            self.stim_updates.reset()
+        if self.flip_recorder is not None:
+            self.flip_recorder.close()
+            print(summarize(read_flips(self.flip_recorder.fn)).round(3).to_string())
+
+    def close(self):
+        """ Closes the session and saves the outputs of the last run next to the events log """
+        self.staircase_worker.shutdown()
+        if self.input_poller is not None:
+            self.input_poller.stop()
+        if self.gaze_stream is not None:
+            self.gaze_stream.stop()
+        self.log_events()
+        events = self.global_log.copy()
+        super().close()
+        # exptools2 writes the events of the last run on close; they are
+        # rewritten through the same writer as those of the earlier runs
+        self._finish_run(events=events, t_stop=self.exp_stop)
@@ -0,0 +1,174 @@
+import json
+import os
+
+import click
+import h5py
+import numpy as np
+import pandas as pd
+from psychopy import logging
+
+FLIP_DTYPE = np.dtype([('t', 'f8'),
+                       ('interval', 'f4'),
+                       ('trial_nr', 'i4'),
+                       ('phase', 'i2'),
+                       ('label', 'i2'),
+                       ('late', '?'),
+                       ('n_dropped', 'i4')])
+
+
+class FlipRecorder:
+
+    def __init__(self, session, fn, expected_interval, buffer_size=16384, late_factor=1.5):
+        """ Records the timing of every window flip of a session.
+
+        Each flip is timestamped with the time win.flip returns, converted
+        to the session clock, and written into a preallocated ring buffer
+        together with the current trial and phase.
+        Flips that come later than `late_factor` times the expected refresh
+        interval are flagged as late. The buffer is appended to an HDF5 file
+        whenever `flush` is called, and automatically when it fills up; the
+        file is opened on the first write and kept open until `close`, so a
+        flush between trials does not reopen it.
+
+        Parameters
+        ----------
+        session : exptools Session object
+            The session whose window flips are recorded.
+        fn : str
+            Path of the HDF5 file the flips are written to.
+        expected_interval : float
+            Expected time (in s) between two flips (1 / refresh rate).
+        buffer_size : int
+            Number of flips that fit in the ring buffer.
+        late_factor : float
+            A flip is late if its interval exceeds this multiple of the
+            expected interval.
+        """
+        self.session = session
+        self.fn = fn
+        self.expected_interval = expected_interval
+        self.late_interval = late_factor * expected_interval
+        self.buffer = np.zeros(buffer_size, dtype=FLIP_DTYPE)
+        self.n_recorded, self.n_flushed = 0, 0
+        self.last_t = np.nan
+        self.labels = {}
+        self.h5 = None
+        self._win_flip = None
+
+    def install(self, win):
+        """ Wraps the flip method of a window """
+        self._win_flip = win.flip
+        win.flip = self.flip
+
+    def flip(self, *args, **kwargs):
+        flip_time = self._win_flip(*args, **kwargs)
+        if flip_time is None:
+            # no timestamp without waitBlanking
+            self.record(self.session.clock.getTime())
+        else:
+            # win.flip returns the flip time on psychopy's logging clock
+            self.record(flip_time + logging.defaultClock.getLastResetTime()
+                        - self.session.clock.getLastResetTime())
+        return flip_time
+
+    def restart(self, fn):
+        """ Closes the file and goes on recording into a new one """
+        self.close()
+        self.fn = fn
+        self.n_recorded, self.n_flushed = 0, 0
+        self.last_t = np.nan
+        self.labels = {}
+
+    def _label(self, trial):
+        if trial is None:
+            name = 'none'
+        else:
+            phase = min(trial.phase, len(trial.phase_names) - 1)
+            name = f'{type(trial).__name__}.{trial.phase_names[phase]}'
+        if name not in self.labels:
+            self.labels[name] = len(self.labels)
+        return self.labels[name]
+
+    def record(self, t):
+        """ Stores a single flip timestamp """
+        trial = getattr(self.session, 'current_trial', None)
+        interval = t - self.last_t
+        late = interval > self.late_interval
+        self.buffer[self.n_recorded % len(self.buffer)] = (
+            t, interval,
+            -1 if trial is None else trial.trial_nr,
+            -1 if trial is None else trial.phase,
+            self._label(trial),
+            late,
+            int(round(interval / self.expected_interval)) - 1 if late else 0)
+        self.last_t = t
+        self.n_recorded += 1
+        if self.n_recorded - self.n_flushed == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """ Appends all flips recorded since the last flush to the HDF5 file """
+        n_new = self.n_recorded - self.n_flushed
+        if n_new == 0:
+            return
+        idx = np.arange(self.n_flushed, self.n_recorded) % len(self.buffer)
+
+        if self.h5 is None:
+            os.makedirs(os.path.dirname(self.fn) or '.', exist_ok=True)
+            # reopened after a close only for flips that came in since
+            self.h5 = h5py.File(self.fn, 'w' if self.n_flushed == 0 else 'a')
+            if 'flips' not in self.h5:
+                flips = self.h5.create_dataset('flips', shape=(0,), maxshape=(None,),
+                                               dtype=FLIP_DTYPE, chunks=(4096,))
+                flips.attrs['expected_interval'] = self.expected_interval
+                flips.attrs['late_interval'] = self.late_interval
+        flips = self.h5['flips']
+        flips.resize((self.n_recorded,))
+        flips[self.n_flushed:self.n_recorded] = self.buffer[idx]
+        flips.attrs['labels'] = json.dumps(self.labels)
+        self.n_flushed = self.n_recorded
+
+    def close(self):
+        """ Flushes the recorded flips and closes the HDF5 file """
+        self.flush()
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+
+
+def read_flips(fn):
+    """ Reads the flips of a run into a DataFrame, with decoded phase labels """
+    with h5py.File(fn, 'r') as h5:
+        flips = pd.DataFrame(h5['flips'][:])
+        labels = json.loads(h5['flips'].attrs['labels'])
+        expected_interval = h5['flips'].attrs['expected_interval']
+    names = {code: name for name, code in labels.items()}
+    flips['label'] = flips['label'].map(names)
+    flips.attrs['expected_interval'] = expected_interval
+    return flips
+
+
+def summarize(flips, percentiles=(50, 95, 99)):
+    """ Returns per-phase frame-time percentiles (in ms) and late-frame counts """
+    flips = flips.loc[np.isfinite(flips['interval'])]
+    groups = flips.groupby('label')
+    summary = pd.DataFrame({'n_flips': groups.size(),
+                            'n_late': groups['late'].sum(),
+                            'n_dropped': groups['n_dropped'].sum()})
+    for p in percentiles:
+        summary[f'p{p}_ms'] = groups['interval'].quantile(p / 100) * 1000
+    summary['max_ms'] = groups['interval'].max() * 1000
+    return summary
+
+
+@click.command()
+@click.argument('fn', type=str)
+def main_api(fn):
+    """ Prints the frame-timing summary of a _frametimes.h5 file """
+    flips = read_flips(fn)
+    print(f'expected interval: {flips.attrs["expected_interval"] * 1000:.3f} ms')
+    print(summarize(flips).round(3).to_string())
+
+
+if __name__ == '__main__':
+    main_api()
@@ -0,0 +1,250 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+GAZE_DTYPE = np.dtype([('t', 'f8'),
+                       ('x', 'f4'),
+                       ('y', 'f4'),
+                       ('pupil', 'f4')])
+
+
+class SimulatedGazeSource:
+
+    def __init__(self, clock, center=(0, 0), rate=1000, noise_sd=0.05,
+                 break_rate=0.1, break_duration=0.2, break_amplitude=2.0, seed=None):
+        """ Stand-in for the eyetracker link: fixation with noise and occasional breaks.
+
+        Samples are generated on demand, `rate` per second of `clock` time,
+        so a GazeStream reading this source behaves as it would on the link.
+
+        Parameters
+        ----------
+        clock : psychopy Clock
+            Clock the sample times are on (the session clock).
+        center : tuple
+            Fixated position (in deg).
+        rate : float
+            Sampling rate (in Hz).
+        noise_sd : float
+            Sd of the fixational noise (in deg).
+        break_rate : float
+            Fixation breaks per second.
+        break_duration : float
+            Duration of a fixation break (in s).
+        break_amplitude : float
+            Distance from `center` during a break (in deg).
+        seed : int
+            Seed of the simulated samples.
+        """
+        self.clock = clock
+        self.center = np.asarray(center, dtype=float)
+        self.interval = 1.0 / rate
+        self.noise_sd = noise_sd
+        self.break_rate = break_rate
+        self.break_duration = break_duration
+        self.break_amplitude = break_amplitude
+        self.rng = np.random.default_rng(seed)
+        self.next_t = clock.getTime()
+        self.break_until = -np.inf
+        self.break_offset = np.zeros(2)
+
+    def get_samples(self):
+        """ Returns the samples up to now as a GAZE_DTYPE array """
+        now = self.clock.getTime()
+        t = np.arange(self.next_t, now, self.interval)
+        if len(t) == 0:
+            return np.zeros(0, dtype=GAZE_DTYPE)
+        self.next_t = t[-1] + self.interval
+
+        samples = np.zeros(len(t), dtype=GAZE_DTYPE)
+        samples['t'] = t
+        offset = np.zeros((len(t), 2))
+        # breaks start as a Poisson process, and hold for break_duration
+        starts = np.flatnonzero(self.rng.random(len(t)) < self.break_rate * self.interval)
+        for i in range(len(t)):
+            if len(starts) and i == starts[0]:
+                starts = starts[1:]
+                if t[i] >= self.break_until:
+                    angle = self.rng.uniform(0, 2 * np.pi)
+                    self.break_offset = self.break_amplitude * np.array([np.cos(angle), np.sin(angle)])
+                    self.break_until = t[i] + self.break_duration
+            if t[i] < self.break_until:
+                offset[i] = self.break_offset
+        xy = self.center + offset + self.rng.normal(0, self.noise_sd, size=(len(t), 2))
+        samples['x'], samples['y'] = xy[:, 0], xy[:, 1]
+        samples['pupil'] = 1000 + self.rng.normal(0, 10, size=len(t))
+        return samples
+
+
+class PylinkSampleSource:
+
+    def __init__(self, tracker, clock, monitor, win_size, eye='left'):
+        """ Reads all link samples of an EyeLink tracker.
+
+        Every call drains the link's data queue (getNextData/getFloatData),
+        so no sample is lost between two polls; events in the queue are
+        skipped. Gaze positions (screen pixels, origin top left) are
+        converted to deg from the screen center, tracker times (ms) to
+        `clock` time through the tracker's current time. Samples without
+        gaze (blinks) get NaN positions.
+
+        Parameters
+        ----------
+        tracker : pylink.EyeLink
+            The connected tracker (PylinkEyetrackerSession.tracker), recording
+            with link samples enabled.
+        clock : psychopy Clock
+            Clock the sample times are converted to.
+        monitor : psychopy Monitor
+            Monitor used to convert pixels to deg.
+        win_size : tuple
+            Window size in pixels.
+        eye : str
+            Eye whose samples are read ('left' or 'right').
+        """
+        import pylink
+        from psychopy.tools.monitorunittools import pix2deg
+
+        self.tracker = tracker
+        self.clock = clock
+        self.monitor = monitor
+        self.half_size = np.asarray(win_size, dtype=float) / 2
+        self.eye = eye
+        self.pix2deg = pix2deg
+        self.sample_type = pylink.SAMPLE_TYPE
+        self.missing = pylink.MISSING_DATA
+
+    def get_samples(self):
+        """ Returns the samples that came in since the last call as a GAZE_DTYPE array """
+        rows = []
+        while True:
+            data_type = self.tracker.getNextData()
+            if not data_type:
+                break
+            if data_type != self.sample_type:
+                continue
+            sample = self.tracker.getFloatData()
+            eye = sample.getLeftEye() if self.eye == 'left' else sample.getRightEye()
+            if eye is None:
+                continue
+            rows.append((sample.getTime(), *eye.getGaze(), eye.getPupilSize()))
+        if not rows:
+            return np.zeros(0, dtype=GAZE_DTYPE)
+
+        rows = np.array(rows, dtype=float)
+        age = (self.tracker.trackerTime() - rows[:, 0]) / 1000
+        x, y = rows[:, 1], rows[:, 2]
+        missing = (x == self.missing) | (y == self.missing)
+        samples = np.zeros(len(rows), dtype=GAZE_DTYPE)
+        samples['t'] = self.clock.getTime() - age
+        samples['x'] = np.where(missing, np.nan, self.pix2deg(x - self.half_size[0], self.monitor))
+        samples['y'] = np.where(missing, np.nan, self.pix2deg(self.half_size[1] - y, self.monitor))
+        samples['pupil'] = rows[:, 3]
+        return samples
+
+
+class GazeStream:
+
+    def __init__(self, source, buffer_size=60000, poll_interval=0.001):
+        """ Pulls gaze samples on a background thread into a ring buffer.
+
+        The render thread never touches the tracker: it only reads recent
+        samples from the buffer, e.g. to check fixation over the stimulus
+        phase of a trial.
+
+        Parameters
+        ----------
+        source : SimulatedGazeSource or PylinkSampleSource
+            Anything with a get_samples() method returning GAZE_DTYPE arrays.
+        buffer_size : int
+            Number of samples kept (60000 is one minute at 1000 Hz).
+        poll_interval : float
+            Time (in s) between two reads of the source.
+        """
+        self.source = source
+        self.buffer = np.zeros(buffer_size, dtype=GAZE_DTYPE)
+        self.poll_interval = poll_interval
+        self.n_samples = 0
+        self.breaks = []
+        # the poller may wrap around onto samples the frame loop is reading
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name='GazeStream', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            self.push(self.source.get_samples())
+
+    def push(self, samples):
+        """ Appends samples to the ring buffer """
+        if len(samples) == 0:
+            return
+        samples = samples[-len(self.buffer):]
+        with self._lock:
+            idx = np.arange(self.n_samples, self.n_samples + len(samples)) % len(self.buffer)
+            self.buffer[idx] = samples
+            self.n_samples += len(samples)
+
+    def _bisect(self, t, lo, hi):
+        """ First sample (as a count since the start) at or after time t """
+        t_buffer, size = self.buffer['t'], len(self.buffer)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if t_buffer[mid % size] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def window(self, t0, t1):
+        """ Returns the buffered samples with t0 <= t < t1, in time order """
+        with self._lock:
+            n = self.n_samples
+            first = max(n - len(self.buffer), 0)
+            start = self._bisect(t0, first, n)
+            stop = self._bisect(t1, start, n)
+            return self.buffer[np.arange(start, stop) % len(self.buffer)]
+
+    def fixation_break(self, t0, t1, center, radius, min_duration=0.0):
+        """ Checks fixation between t0 and t1.
+
+        A break is a stretch of consecutive samples farther than `radius`
+        (in deg) from `center` that lasts at least `min_duration` seconds.
+
+        Returns
+        -------
+        result : dict
+            n_samples, the number of breaks, the longest break duration and
+            the largest distance from `center`.
+        """
+        samples = self.window(t0, t1)
+        distance = np.hypot(samples['x'] - center[0], samples['y'] - center[1])
+        outside = np.r_[False, distance > radius, False]
+        edges = np.flatnonzero(np.diff(outside.astype(np.int8)))
+        starts, ends = edges[::2], edges[1::2] - 1
+        durations = samples['t'][ends] - samples['t'][starts] if len(starts) else np.zeros(0)
+        durations = durations[durations >= min_duration]
+        return {'n_samples': len(samples),
+                'n_breaks': len(durations),
+                'break_duration': durations.max() if len(durations) else 0.0,
+                'max_distance': distance.max() if len(distance) else np.nan}
+
+    def log_break(self, trial_nr, t0, t1, result):
+        """ Keeps the fixation check of a trial for the _fixation.tsv """
+        self.breaks.append({'trial_nr': trial_nr, 'start': t0, 'end': t1, **result})
+
+    def save_breaks(self, fn):
+        """ Writes all fixation checks to a tsv """
+        pd.DataFrame(self.breaks, columns=['trial_nr', 'start', 'end', 'n_samples', 'n_breaks',
+                                           'break_duration', 'max_distance']).to_csv(
+            fn, sep='\t', index=False, na_rep='NA')
+
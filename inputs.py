@@ -0,0 +1,86 @@
+import queue
+import threading
+
+from psychopy import core
+
+
+def response_table(exp_s):
+    """ Returns {key: (sign, confidence)} for the response buttons
+
+    The sign is 1 for the cw_buttons and -1 for the ccw_buttons, the
+    confidence is the position of the key in its list (0: most sure), as
+    logged in response_value.
+    """
+    table = {}
+    for sign, buttons in [(1, exp_s['cw_buttons']), (-1, exp_s['ccw_buttons'])]:
+        for confidence, key in enumerate(buttons):
+            table[key] = (sign, confidence)
+    return table
+
+
+class InputPoller:
+
+    def __init__(self, table, poll_interval=0.001, keyboard=None):
+        """ Polls the response buttons on a separate thread.
+
+        A psychopy Keyboard on the psychtoolbox backend, which timestamps
+        key presses in its own event buffer, is read every `poll_interval`
+        seconds, independently of the frame loop, and every press of a key
+        in `table` is put on a queue.SimpleQueue as
+        (key, t, sign, confidence). Times are on psychopy's monotonic
+        clock, which is never reset, and are converted to a session clock
+        when the responses are collected.
+
+        The other keyboard backends read the window's event queue, which
+        is not safe from a second thread, so a RuntimeError is raised when
+        psychtoolbox is not available.
+
+        Parameters
+        ----------
+        table : dict
+            {key: (sign, confidence)}, see response_table.
+        poll_interval : float
+            Time (in s) between two reads of the keyboard buffer.
+        keyboard : psychopy Keyboard
+            The keyboard to read, timed on psychopy's monotonic clock; by
+            default one on the psychtoolbox backend.
+        """
+        self.table = table
+        self.poll_interval = poll_interval
+        self.monotonic_clock = core.monotonicClock
+        if keyboard is None:
+            from psychopy.hardware.keyboard import Keyboard
+            keyboard = Keyboard(clock=self.monotonic_clock, backend='ptb')
+        self.keyboard = keyboard
+        if self.keyboard.getBackend() != 'ptb':
+            raise RuntimeError(f'polling the keyboard on a thread needs the psychtoolbox '
+                               f'backend, not {self.keyboard.getBackend()!r}')
+        self.responses = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name='InputPoller', daemon=True)
+
+    def start(self):
+        self.keyboard.clearEvents()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _poll(self):
+        key_list = list(self.table)
+        while not self._stop.wait(self.poll_interval):
+            for key in self.keyboard.getKeys(keyList=key_list, waitRelease=False, clear=True):
+                self.responses.put((key.name, key.rt) + self.table[key.name])
+
+    def get_responses(self, clock):
+        """ Returns the responses since the last call, timed on `clock` """
+        offset = self.monotonic_clock.getTime() - clock.getTime()
+        responses = []
+        while True:
+            try:
+                key, t, sign, confidence = self.responses.get_nowait()
+            except queue.Empty:
+                return responses
+            responses.append((key, t - offset, sign, confidence))
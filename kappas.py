@@ -0,0 +1,112 @@
+import os
+
+import click
+import numpy as np
+import pandas as pd
+from scipy.optimize import brentq
+from scipy.special import i0e
+
+KAPPA_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'exp_designs', 'optimal_kappas.tsv')
+
+
+def vonmises_pdf(x, kappa, loc=0):
+    """ Von Mises densities of x (last axis) for an array of kappas (first axis) """
+    kappa = np.asarray(kappa, dtype=float)[..., np.newaxis]
+    # exp(k cos(d)) / I0(k) == exp(k (cos(d) - 1)) / i0e(k), without overflow
+    return np.exp(kappa * (np.cos(x - loc) - 1)) / (2 * np.pi * i0e(kappa))
+
+
+def overlap_vm(n_blocks, kappas, resolution=100):
+    """ Overlap of two neighbouring von Mises blocks, for an array of kappas.
+
+    The overlap is the dot product of the densities of two blocks whose
+    means are 2 pi / n_blocks apart, sampled at `resolution` points
+    between -pi and pi, as in exp_designs/exp_design.ipynb.
+    """
+    x = np.linspace(-np.pi, np.pi, resolution)
+    return (vonmises_pdf(x, kappas, loc=0) *
+            vonmises_pdf(x, kappas, loc=2*np.pi/n_blocks)).sum(axis=-1)
+
+
+def solve_kappa(n_blocks, overlap=2.2, resolution=100, kappa_range=(1e-3, 1e3)):
+    """ Finds the kappa at which neighbouring blocks overlap by `overlap`.
+
+    The overlap is evaluated on a log-spaced kappa grid in one batch, after
+    which the crossing at the largest kappa (where blocks become too
+    narrow to overlap further) is refined with Brent's method.
+    The kappas hardcoded in exp_designs/exp_design.ipynb are the closest
+    points of a 10000-point kappa grid (np.logspace(-0.5, 1.5, 10000)) at
+    the same `resolution` of 100 samples, so they differ from the root
+    found here by less than one grid step (0.05 %), e.g. 0.535578 for
+    0.535634 with 2 blocks.
+
+    Raises
+    ------
+    ValueError
+        If the overlap never crosses the requested value in `kappa_range`.
+    """
+    grid = np.logspace(np.log10(kappa_range[0]), np.log10(kappa_range[1]), 512)
+    diff = overlap_vm(n_blocks, grid, resolution) - overlap
+    crossings = np.flatnonzero((diff[:-1] > 0) & (diff[1:] <= 0))
+    if len(crossings) == 0:
+        raise ValueError(f'the overlap of {n_blocks} blocks never drops to {overlap} '
+                         f'for kappas in {kappa_range} (resolution {resolution})')
+    i = crossings[-1]
+    return brentq(lambda k: overlap_vm(n_blocks, k, resolution) - overlap,
+                  grid[i], grid[i+1], xtol=1e-9)
+
+
+def optimal_kappas(n_blocks, overlap=2.2, resolution=100, table_fn=KAPPA_TABLE):
+    """ Returns {n_blocks: kappa}, memoized in an on-disk table.
+
+    Parameters
+    ----------
+    n_blocks : iterable of int
+        Numbers of blocks to return kappas for.
+    overlap : float
+        Desired overlap between neighbouring blocks.
+    resolution : int
+        Number of samples of the overlap computation.
+    table_fn : str
+        Tsv file in which solved kappas are stored.
+    """
+    if os.path.isfile(table_fn):
+        table = pd.read_csv(table_fn, sep='\t')
+    else:
+        table = pd.DataFrame(columns=['n_blocks', 'overlap', 'resolution', 'kappa'])
+
+    kappas, new_rows = {}, []
+    for n in n_blocks:
+        match = table.loc[(table['n_blocks'] == n) &
+                          np.isclose(table['overlap'].astype(float), overlap) &
+                          (table['resolution'] == resolution), 'kappa']
+        if len(match):
+            kappas[n] = float(match.iloc[0])
+        else:
+            kappas[n] = solve_kappa(n, overlap, resolution)
+            new_rows.append({'n_blocks': n, 'overlap': overlap,
+                             'resolution': resolution, 'kappa': kappas[n]})
+
+    if new_rows:
+        table = pd.concat([table, pd.DataFrame(new_rows)], ignore_index=True)
+        table = table.sort_values(['overlap', 'resolution', 'n_blocks'])
+        os.makedirs(os.path.dirname(table_fn) or '.', exist_ok=True)
+        table.to_csv(table_fn + '.tmp', sep='\t', index=False)
+        os.replace(table_fn + '.tmp', table_fn)
+    return kappas
+
+
+@click.command()
+@click.option('--min_n_blocks', default=2, type=int, help='Smallest number of blocks')
+@click.option('--max_n_blocks', default=10, type=int, help='Largest number of blocks')
+@click.option('--overlap', default=2.2, type=float, help='Desired overlap between neighbouring blocks')
+@click.option('--resolution', default=100, type=int, help='Samples of the overlap computation')
+def main_api(min_n_blocks, max_n_blocks, overlap, resolution):
+    """ Prints (and stores) the optimal kappas for a range of block counts """
+    kappas = optimal_kappas(range(min_n_blocks, max_n_blocks+1), overlap, resolution)
+    print(pd.Series(kappas, name='kappa').rename_axis('n blocks').to_string())
+
+
+if __name__ == '__main__':
+    main_api()
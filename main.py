@@ -1,5 +1,6 @@
 import click
-from exporimapper import ExpOriMapperSession
+from cliutils import IntList
+from exporimapper import ExpOriMapperSession, run_output_str
 
 
 @click.command()
@@ -9,18 +10,24 @@ from exporimapper import ExpOriMapperSession
 @click.option('--settings', default='defaults.yml', type=str, help='Settings file')
 @click.option('--task', default='train', type=str, help='Type of run (train, test)')
 @click.option('--eyetracker', default=False, type=bool, help='Whether to try to connect to the eyetracker')
+@click.option('--runs', default=None, type=IntList(), help='Several runs in one session, e.g. 1-4 (instead of --run_id)')
+@click.option('--resume', default=False, type=bool, help='Whether to restore the staircase from the checkpoint of this run (the first of --runs)')
+@click.option('--overwrite_checkpoint', default=False, type=bool, help='Whether to start a new staircase over existing checkpoints of these runs')
 
-def main_api(sub, run_id, ses, task, settings, eyetracker):
+def main_api(sub, run_id, ses, task, settings, eyetracker, runs, resume, overwrite_checkpoint):
+    run_ids = runs if runs is not None else [run_id]
     eomapper_session = ExpOriMapperSession(
         sub=sub,
-        run_id=run_id,
+        run_id=run_ids[0],
         ses=ses,
         task=task,
-        output_str=f'sub-{str(sub).zfill(2)}_ses-{str(ses).zfill(1)}_task-{task}_run-{str(run_id).zfill(2)}',
+        output_str=run_output_str(sub, ses, task, run_ids[0]),
         settings_file=settings,
-        eyetracker_on=eyetracker
+        eyetracker_on=eyetracker,
+        resume=resume,
+        overwrite_checkpoint=overwrite_checkpoint
     )
-    eomapper_session.run()
+    eomapper_session.run(run_ids)
     eomapper_session.quit()
 
 
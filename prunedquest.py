@@ -0,0 +1,256 @@
+import numpy as np
+
+from psychometric import grid_prior, start_intensity, weibull
+from staircase import settings_hash
+
+
+class PrunedQuestPlusHandler:
+
+    def __init__(self, nTrials, intensityVals, thresholdVals, slopeVals,
+                 lowerAsymptoteVals, lapseRateVals, responseVals=('Yes', 'No'),
+                 prior=None, startIntensity=None, stimScale='log10',
+                 stimSelectionMethod='minEntropy', prune_mass=1e-6,
+                 max_particles=8000, max_candidates=64, **kwargs):
+        """ QUEST+ on a pruned posterior, with a bounded cost per trial.
+
+        Drop-in replacement for (Cached)QuestPlusHandler in the session
+        (see the staircase.engine setting) for parameter grids that are
+        too fine for the full likelihood tensor:
+
+        - the posterior is kept only on its live grid points; after every
+          update the least likely points, holding together less than
+          `prune_mass` of the posterior, are dropped and the rest is
+          thinned to at most `max_particles` points, so every update but
+          the first costs at most max_particles Weibull evaluations;
+        - the next intensity minimizes the expected posterior entropy, as
+          in minEntropy, but evaluated on the live points and at most
+          `max_candidates` intensities (a coarse pass over the intensity
+          grid refined around its best value). Selection therefore costs
+          at most max_particles x max_candidates evaluations, whatever
+          the size of the grids.
+
+        Everything is deterministic, so a run can be reproduced and
+        restored from a checkpoint (see get_state/set_state).
+
+        Parameters
+        ----------
+        nTrials : int
+            Number of trials to run.
+        intensityVals, thresholdVals, slopeVals, lowerAsymptoteVals, lapseRateVals : list
+            The grids, as in the questplus settings block.
+        responseVals : tuple
+            The (correct, incorrect) response values.
+        prior : dict
+            Prior per parameter (threshold, slope, lowerAsymptote,
+            lapseRate), each an array over its grid or a single value (see
+            psychometric.grid_prior); flat if not given.
+        startIntensity : float
+            Intensity of the first trial, one of the intensityVals.
+        stimScale : str
+            Scale of the intensities ('linear', 'log10' or 'dB').
+        stimSelectionMethod : str
+            Only 'minEntropy' is supported.
+        prune_mass : float
+            Posterior mass that may be pruned after every update.
+        max_particles : int
+            Maximum number of live posterior points after an update.
+        max_candidates : int
+            Maximum number of intensities evaluated for selection.
+        """
+        if stimSelectionMethod != 'minEntropy':
+            raise ValueError(f'unsupported stimSelectionMethod {stimSelectionMethod}, only minEntropy')
+        self.nTrials = nTrials
+        self.startVal = start_intensity({'intensityVals': intensityVals, 'startIntensity': startIntensity})
+        self.responseVals = list(responseVals)
+        self.stimScale = stimScale
+        self.prune_mass = prune_mass
+        self.max_particles = max_particles
+        self.max_candidates = max_candidates
+        self.cache_key = settings_hash({
+            'intensityVals': intensityVals, 'thresholdVals': thresholdVals, 'slopeVals': slopeVals,
+            'lowerAsymptoteVals': lowerAsymptoteVals, 'lapseRateVals': lapseRateVals,
+            'responseVals': responseVals, 'prior': prior, 'startIntensity': startIntensity,
+            'stimScale': stimScale, 'stimSelectionMethod': stimSelectionMethod, **kwargs})
+
+        self.intensity_vals = np.asarray(intensityVals, dtype=float)
+        self.grids = [np.atleast_1d(np.asarray(vals, dtype=float))
+                      for vals in [thresholdVals, slopeVals, lowerAsymptoteVals, lapseRateVals]]
+        self.posterior_shape = tuple(len(grid) for grid in self.grids)
+
+        prior = grid_prior({'prior': prior, 'thresholdVals': thresholdVals, 'slopeVals': slopeVals,
+                            'lowerAsymptoteVals': lowerAsymptoteVals, 'lapseRateVals': lapseRateVals})
+        log_prior = np.zeros(self.posterior_shape)
+        for axis, values in enumerate((prior or {}).values()):
+            shape = [1] * len(self.posterior_shape)
+            shape[axis] = -1
+            with np.errstate(divide='ignore'):
+                log_prior = log_prior + np.log(values).reshape(shape)
+        self._set_posterior(log_prior.ravel())
+
+        self.intensities = []
+        self.data = []
+        # the intensity every response was attributed to, see get_state
+        self.response_intensities = []
+        self.thisTrialN = -1
+        self.finished = False
+
+    @property
+    def startIntensity(self):
+        return self.startVal
+
+    def _set_posterior(self, log_posterior):
+        """ Keeps the grid points with a nonzero posterior as the live set """
+        live = np.flatnonzero(np.isfinite(log_posterior))
+        self.live = live
+        self.live_params = [grid[idx] for grid, idx in
+                            zip(self.grids, np.unravel_index(live, self.posterior_shape))]
+        log_w = log_posterior[live]
+        w = np.exp(log_w - log_w.max())
+        self.weights = w / w.sum()
+
+    def _p_correct(self, intensity, params):
+        return weibull(intensity, *params, scale=self.stimScale)
+
+    def _prune(self):
+        """ Drops the least likely live points, then thins them to max_particles
+
+        Points are dropped from the least likely up as long as together
+        they hold less than prune_mass of the posterior. When more than
+        max_particles points are left, the likely ones keep their weight
+        and the unlikely tail is thinned by a systematic resample (see
+        _thin), so that every later update costs at most max_particles
+        evaluations.
+        """
+        # only points below prune_mass can be part of the dropped mass
+        candidates = np.flatnonzero(self.weights < self.prune_mass)
+        order = candidates[np.argsort(self.weights[candidates])]
+        n_drop = np.searchsorted(np.cumsum(self.weights[order]), self.prune_mass, side='left')
+        if n_drop:
+            keep = np.ones(len(self.weights), dtype=bool)
+            keep[order[:n_drop]] = False
+            self._keep(np.flatnonzero(keep), self.weights[keep])
+        if len(self.weights) > self.max_particles:
+            self._keep(*self._thin())
+
+    def _keep(self, idx, weights):
+        """ Keeps the live points idx, with the given weights """
+        self.live = self.live[idx]
+        self.live_params = [p[idx] for p in self.live_params]
+        self.weights = weights / weights.sum()
+
+    def _thin(self):
+        """ Returns the indices and weights of at most max_particles of the live points
+
+        The k most likely points are kept as they are, the others are
+        resampled systematically, each survivor getting the same weight c,
+        with k and c such that the k-th point is the last one above c
+        (optimal resampling, Fearnhead & Clifford 2003). The thinned
+        posterior has the same expectation as the full one.
+        """
+        n = self.max_particles
+        order = np.argsort(self.weights)[::-1]
+        w = self.weights[order]
+        tail = w.sum() - np.r_[0, np.cumsum(w[:n - 1])]
+        k = int(np.argmax(w[:n] < tail / (n - np.arange(n))))
+        c = tail[k] / (n - k)
+        positions = (np.arange(n - k) + 0.5) * c
+        resampled = k + np.minimum(np.searchsorted(np.cumsum(w[k:]), positions), len(w) - k - 1)
+        idx = np.r_[order[:k], order[np.unique(resampled)]]
+        weights = np.r_[w[:k], np.full(len(idx) - k, c)]
+        sort = np.argsort(idx)
+        return idx[sort], weights[sort]
+
+    def addResponse(self, response, intensity=None):
+        """ Updates the posterior with the response to the last (or the given) intensity """
+        self.data.append(response)
+        if intensity is not None:
+            if self.intensities:
+                self.intensities.pop()
+            self.intensities.append(intensity)
+        self.response_intensities.append(self.intensities[-1])
+        p = self._p_correct(self.intensities[-1], self.live_params)
+        self.weights = self.weights * (p if response == self.responseVals[0] else 1 - p)
+        self.weights /= self.weights.sum()
+        self._prune()
+
+    def _particles(self):
+        """ Returns (params, weights) of at most max_particles posterior points """
+        if len(self.weights) <= self.max_particles:
+            return self.live_params, self.weights
+        idx, weights = self._thin()
+        return [p[idx] for p in self.live_params], weights / weights.sum()
+
+    @staticmethod
+    def _expected_entropy(p, w):
+        """ Expected posterior entropy per candidate, p: (n_particles, n_candidates) """
+        expected = 0
+        for p_outcome in [p, 1 - p]:
+            joint = w[:, np.newaxis] * p_outcome
+            marginal = joint.sum(axis=0)
+            post = joint / marginal
+            with np.errstate(divide='ignore', invalid='ignore'):
+                entropy = -np.nansum(post * np.log(post), axis=0)
+            expected = expected + marginal * entropy
+        return expected
+
+    def _select(self):
+        """ Returns the intensity with the lowest expected entropy """
+        params, w = self._particles()
+        params = [x[:, np.newaxis] for x in params]
+        n = len(self.intensity_vals)
+
+        def best_of(candidates):
+            entropy = self._expected_entropy(self._p_correct(self.intensity_vals[candidates], params), w)
+            return candidates[np.argmin(entropy)]
+
+        if n <= self.max_candidates:
+            return self.intensity_vals[best_of(np.arange(n))]
+        # coarse pass with half of the candidates, then the neighbourhood of its best
+        stride = int(np.ceil(n / (self.max_candidates // 2)))
+        best = best_of(np.arange(0, n, stride))
+        return self.intensity_vals[best_of(np.arange(max(best - stride + 1, 0), min(best + stride, n)))]
+
+    def next(self):
+        """ Returns the intensity of the next trial """
+        self.finished = self.nTrials is not None and len(self.intensities) >= self.nTrials
+        if self.finished:
+            raise StopIteration
+        self.thisTrialN += 1
+        if self.thisTrialN == 0 and self.startIntensity is not None:
+            self.intensities.append(self.startVal)
+        else:
+            self.intensities.append(self._select())
+        return self.intensities[-1]
+
+    __next__ = next
+
+    def __iter__(self):
+        return self
+
+    def posterior_values(self):
+        """ Returns the posterior on the full grid (0 where pruned) """
+        posterior = np.zeros(np.prod(self.posterior_shape))
+        posterior[self.live] = self.weights
+        return posterior.reshape(self.posterior_shape)
+
+    @property
+    def paramEstimate(self):
+        """ Posterior mean of every parameter, keyed as in QuestPlusHandler """
+        mean = [float(self.weights @ p) for p in self.live_params]
+        return dict(zip(['threshold', 'slope', 'lowerAsymptote', 'lapseRate'], mean))
+
+    def get_state(self):
+        """ Returns the posterior and the (intensity, response) pairs it was updated with """
+        return {'posterior': self.posterior_values(),
+                'intensities': list(self.response_intensities),
+                'responses': list(self.data)}
+
+    def set_state(self, posterior, intensities, responses):
+        """ Restores a state from get_state, see CachedQuestPlusHandler.set_state """
+        with np.errstate(divide='ignore'):
+            self._set_posterior(np.log(np.asarray(posterior, dtype=float).ravel()))
+        self.intensities = list(intensities)
+        self.response_intensities = list(intensities)
+        self.data = list(responses)
+        self.thisTrialN = len(self.data) - 1
+        self.nTrials += len(self.data)
@@ -0,0 +1,92 @@
+import numpy as np
+
+
+def weibull(intensity, threshold, slope, lower_asymptote=0.5, lapse_rate=0.01, scale='linear'):
+    """ Weibull psychometric function, parametrized as in questplus.
+
+    Broadcasts like any NumPy expression, so it evaluates a single
+    observer as well as a whole parameter grid at once.
+
+    Parameters
+    ----------
+    intensity : float or np.ndarray
+        Stimulus intensities.
+    threshold, slope, lower_asymptote, lapse_rate : float or np.ndarray
+        Parameters of the function.
+    scale : str
+        Scale of the intensities and thresholds ('linear', 'log10' or 'dB').
+
+    Returns
+    -------
+    p : float or np.ndarray
+        Probability of a correct response.
+    """
+    if scale == 'linear':
+        p = np.exp(-(intensity / threshold) ** slope)
+    elif scale == 'log10':
+        p = np.exp(-10 ** (slope * (intensity - threshold)))
+    elif scale == 'dB':
+        p = np.exp(-10 ** (slope * (intensity - threshold) / 20))
+    else:
+        raise ValueError(f'unknown scale {scale}, choose from linear, log10, dB')
+    return 1 - lapse_rate - (1 - lower_asymptote - lapse_rate) * p
+
+
+PRIOR_GRIDS = {'threshold': 'thresholdVals', 'slope': 'slopeVals',
+               'lowerAsymptote': 'lowerAsymptoteVals', 'lapseRate': 'lapseRateVals'}
+
+
+def grid_prior(quest_plus_s):
+    """ Returns the prior of a questplus settings block as one array per grid.
+
+    A parameter whose prior is a single value (as in defaults.yml) gets a
+    normal distribution over its grid, centred on that value, with a
+    standard deviation of a quarter of the grid's range; a grid of a
+    single value gets all the mass. Priors that already hold one value per
+    grid point are passed on, parameters without a prior get a flat one.
+
+    Parameters
+    ----------
+    quest_plus_s : dict
+        The questplus settings block.
+
+    Returns
+    -------
+    prior : dict or None
+        Prior per parameter (threshold, slope, lowerAsymptote, lapseRate),
+        each a list over its grid, or None if the block has no prior.
+    """
+    if not quest_plus_s.get('prior'):
+        return None
+    unknown = set(quest_plus_s['prior']) - set(PRIOR_GRIDS)
+    if unknown:
+        raise ValueError(f'prior of unknown parameters {sorted(unknown)}, choose from {list(PRIOR_GRIDS)}')
+    prior = {}
+    for name, grid_key in PRIOR_GRIDS.items():
+        grid = np.atleast_1d(np.asarray(quest_plus_s[grid_key], dtype=float))
+        values = np.asarray(quest_plus_s['prior'].get(name, np.ones(len(grid))), dtype=float)
+        if values.ndim == 0:
+            sd = np.ptp(grid) / 4
+            values = np.exp(-0.5 * ((grid - values) / sd) ** 2) if sd > 0 else np.ones(len(grid))
+        elif values.shape != grid.shape:
+            raise ValueError(f'prior of {name} must be a single value or have one value per grid point')
+        prior[name] = (values / values.sum()).tolist()
+    return prior
+
+
+def start_intensity(quest_plus_s):
+    """ Returns the startIntensity of a questplus settings block, or None.
+
+    The first intensity is shown and answered like any other, so it has to
+    be one of the intensityVals; anything else is rejected here rather
+    than when its response comes in.
+    """
+    start = quest_plus_s.get('startIntensity')
+    if start is None:
+        return None
+    intensity_vals = np.sort(np.asarray(quest_plus_s['intensityVals'], dtype=float))
+    if not np.isclose(intensity_vals, start).any():
+        nearest = intensity_vals[np.argsort(np.abs(intensity_vals - start))[:2]]
+        raise ValueError(f'startIntensity {start} is not one of the intensityVals, '
+                         f'the nearest are {", ".join(f"{v:g}" for v in sorted(nearest))}')
+    return start
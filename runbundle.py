@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+MISSING_TEXT = ''
+# bumped when the layout of the bundles changes, so old ones are recompiled
+BUNDLE_VERSION = 2
+
+
+def constants_hash(constants):
+    """ Returns a short, stable hash of the run-level constants """
+    payload = json.dumps(constants, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf8')).hexdigest()[:16]
+
+
+def design_to_records(trial_df):
+    """ Converts a run design DataFrame into a NumPy structured array
+
+    Missing values of text columns are stored as MISSING_TEXT (the tsv
+    reader turns empty fields into NaN, so no design holds that string),
+    and turned back into NaN by record_to_dict.
+    """
+    fields = []
+    for col in trial_df.columns:
+        if pd.api.types.is_integer_dtype(trial_df[col]):
+            fields.append((col, 'i8'))
+        elif pd.api.types.is_numeric_dtype(trial_df[col]):
+            fields.append((col, 'f8'))
+        else:
+            lengths = trial_df[col].dropna().astype(str).str.len()
+            width = max(int(lengths.max()) if len(lengths) else 0, 1)
+            fields.append((col, f'U{width}'))
+
+    records = np.zeros(len(trial_df), dtype=fields)
+    for col, dtype in fields:
+        values = trial_df[col]
+        records[col] = values.astype(str).where(values.notna(), MISSING_TEXT).to_numpy() \
+            if dtype.startswith('U') else values.to_numpy(dtype=dtype)
+    return records
+
+
+def bundle_paths(tsv_path, cache_dir):
+    """ Returns the .npy and .json paths of the bundle for a run design """
+    stem = os.path.splitext(os.path.basename(tsv_path))[0]
+    return (os.path.join(cache_dir, stem + '.npy'),
+            os.path.join(cache_dir, stem + '.json'))
+
+
+def compile_run_bundle(tsv_path, settings, cache_dir):
+    """ Compiles a run design tsv and the run-level settings into a bundle.
+
+    The per-trial design is stored as a structured array in a .npy file
+    that later sessions memory-map; the merged run-level constants and the
+    information needed to tell whether the bundle is stale are stored in a
+    .json sidecar.
+
+    Parameters
+    ----------
+    tsv_path : str
+        Path of the run design tsv (as written by design generation).
+    settings : dict
+        The session settings.
+    cache_dir : str
+        Directory in which bundles are stored.
+
+    Returns
+    -------
+    npy_path, json_path : str
+        Paths of the compiled bundle.
+    """
+    trial_df = pd.read_csv(tsv_path, sep='\t', index_col=0, na_values='NA')
+    records = design_to_records(trial_df)
+    constants = dict(settings['experiment'])
+    constants.update(settings['stim_position_info'])
+
+    npy_path, json_path = bundle_paths(tsv_path, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(npy_path + '.tmp.npy', records)
+    with open(json_path + '.tmp', 'w') as f:
+        json.dump({'version': BUNDLE_VERSION,
+                   'source': os.path.abspath(tsv_path),
+                   'source_mtime': os.stat(tsv_path).st_mtime,
+                   'source_size': os.stat(tsv_path).st_size,
+                   'settings_hash': constants_hash(constants),
+                   'constants': constants}, f, default=str)
+    os.replace(npy_path + '.tmp.npy', npy_path)
+    os.replace(json_path + '.tmp', json_path)
+    return npy_path, json_path
+
+
+def load_run_bundle(tsv_path, settings, cache_dir):
+    """ Maps the bundle of a run design, (re)compiling it when stale
+
+    Returns
+    -------
+    records : np.ndarray
+        Read-only, memory-mapped structured array with one row per trial.
+    constants : dict
+        The run-level constants (experiment and stim_position_info settings).
+    """
+    npy_path, json_path = bundle_paths(tsv_path, cache_dir)
+    constants = dict(settings['experiment'])
+    constants.update(settings['stim_position_info'])
+
+    fresh = False
+    if os.path.isfile(npy_path) and os.path.isfile(json_path):
+        with open(json_path, 'r', encoding='utf8') as f_in:
+            meta = json.load(f_in)
+        stat = os.stat(tsv_path)
+        fresh = meta.get('version') == BUNDLE_VERSION and \
+            meta['source_mtime'] == stat.st_mtime and \
+            meta['source_size'] == stat.st_size and \
+            meta['settings_hash'] == constants_hash(constants)
+    if not fresh:
+        compile_run_bundle(tsv_path, settings, cache_dir)
+
+    return np.load(npy_path, mmap_mode='r'), constants
+
+
+def record_to_dict(record):
+    """ Converts one row of a bundle into a plain parameters dict """
+    parameters = {name: record[name].item() for name in record.dtype.names}
+    for name in record.dtype.names:
+        if record.dtype[name].kind == 'U' and parameters[name] == MISSING_TEXT:
+            parameters[name] = np.nan
+    return parameters
@@ -0,0 +1,54 @@
+import numpy as np
+
+# one row per frame of the 'stim' phase
+FRAME_PLAN_DTYPE = np.dtype([('frame', 'i4'),
+                             ('grating_on', '?'),
+                             ('interval', 'i1'),
+                             ('orientation', 'f8')])
+
+
+def n_frames(duration, refresh_rate):
+    """ Returns the whole number of frames closest to a duration (in s) """
+    return max(int(round(duration * refresh_rate)), 0)
+
+
+def compile_stim_plan(stim_duration, interstim_interval, refresh_rate):
+    """ Compiles the two-interval stimulus presentation into a per-frame plan.
+
+    Parameters
+    ----------
+    stim_duration : float
+        Duration (in s) of each of the two grating presentations.
+    interstim_interval : float
+        Duration (in s) of the blank between the two presentations.
+    refresh_rate : float
+        Refresh rate of the monitor (in Hz).
+
+    Returns
+    -------
+    plan : np.ndarray of FRAME_PLAN_DTYPE
+        One row per frame, with the grating on during both intervals
+        (interval 1 and 2) and off in between (interval 0). Orientations are
+        NaN until filled in per trial with `fill_orientations`.
+    """
+    n_on = n_frames(stim_duration, refresh_rate)
+    n_off = n_frames(interstim_interval, refresh_rate)
+    if n_on == 0:
+        raise ValueError(
+            f'stim_duration of {stim_duration} s is shorter than half a frame at {refresh_rate} Hz')
+
+    plan = np.zeros(2 * n_on + n_off, dtype=FRAME_PLAN_DTYPE)
+    plan['frame'] = np.arange(plan.shape[0])
+    plan['interval'][:n_on] = 1
+    plan['interval'][n_on + n_off:] = 2
+    plan['grating_on'] = plan['interval'] > 0
+    plan['orientation'] = np.nan
+    return plan
+
+
+def fill_orientations(plan, orientation_p1, orientation_p2):
+    """ Returns a copy of a stimulus plan with the orientations of both intervals """
+    plan = plan.copy()
+    plan['orientation'][plan['interval'] == 1] = orientation_p1
+    plan['orientation'][plan['interval'] == 2] = orientation_p2
+    return plan
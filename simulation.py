@@ -0,0 +1,446 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import click
+import numpy as np
+import pandas as pd
+from psychopy import logging
+
+from checkpoint import checkpoint_prefix
+from cliutils import IntList
+from inputs import response_table
+from psychometric import weibull
+
+
+class VirtualTime:
+    """ Simulated time (in s), advanced by the flips of a HeadlessWindow """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def advance(self, dt):
+        self.now += dt
+
+
+class VirtualClock:
+    """ Stand-in for psychopy.core.Clock that runs on VirtualClock.time """
+    time = VirtualTime()
+
+    def __init__(self):
+        self._time_at_last_reset = self.time.now
+
+    def getTime(self, applyZero=True):
+        return self.time.now - self._time_at_last_reset
+
+    def getLastResetTime(self):
+        return self._time_at_last_reset
+
+    def reset(self, newT=0.0):
+        self._time_at_last_reset = self.time.now + newT
+
+    def addTime(self, t):
+        self._time_at_last_reset -= t
+
+    add = addTime
+
+
+class HeadlessWindow:
+
+    def __init__(self, vtime, refresh_rate=60.0, size=(1920, 1080), units='deg', **kwargs):
+        """ Stand-in for psychopy.visual.Window that draws nothing.
+
+        Every flip advances virtual time by one refresh interval, so trial
+        phases elapse as fast as the Python code between flips runs. The
+        real (perf_counter) time spent between flips is kept in
+        `frame_costs`, labelled with the type and number of the trial that
+        was running.
+
+        Parameters
+        ----------
+        vtime : VirtualTime
+            The simulated time this window advances.
+        refresh_rate : float
+            Simulated refresh rate (in Hz).
+        size : tuple
+            Window size in pixels, as reported to the stimuli.
+        units : str
+            Default units of the stimuli.
+        """
+        self.vtime = vtime
+        self.refresh_rate = refresh_rate
+        self.size = np.array(size)
+        self.units = units
+        self.color = kwargs.get('color', (0, 0, 0))
+        self.monitor = kwargs.get('monitor')
+        self.fullscr = False
+        self.mouseVisible = False
+        self.recordFrameIntervals = False
+        self.frameIntervals = []
+        self.nDroppedFrames = 0
+        self.session = None
+        self.frame_costs, self.frame_trial_types, self.frame_trial_nrs = [], [], []
+        self._on_flip = []
+        self._last_flip = time.perf_counter()
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._on_flip.append((function, args, kwargs))
+
+    def flip(self, clearBuffer=True):
+        now = time.perf_counter()
+        trial = getattr(self.session, 'current_trial', None)
+        self.frame_costs.append(now - self._last_flip)
+        self.frame_trial_types.append(type(trial).__name__)
+        self.frame_trial_nrs.append(-1 if trial is None else trial.trial_nr)
+
+        self.vtime.advance(1.0 / self.refresh_rate)
+        if self.recordFrameIntervals:
+            self.frameIntervals.append(1.0 / self.refresh_rate)
+        on_flip, self._on_flip = self._on_flip, []
+        for function, args, kwargs in on_flip:
+            function(*args, **kwargs)
+        self._last_flip = time.perf_counter()
+        # on the logging clock, as psychopy's flip
+        return self.vtime.now - logging.defaultClock.getLastResetTime()
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return self.refresh_rate
+
+    def setMouseVisible(self, visible):
+        self.mouseVisible = visible
+
+    def close(self):
+        pass
+
+
+class HeadlessStim:
+
+    def __init__(self, win=None, *args, **kwargs):
+        """ Stand-in for any psychopy stimulus (and the mouse).
+
+        Keyword arguments become attributes, setX(value) methods set
+        attribute x, and draw() only counts.
+        """
+        self.win = win
+        self.args = args
+        self.n_draws = 0
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def draw(self, win=None):
+        self.n_draws += 1
+
+    def __getattr__(self, name):
+        if name.startswith('set') and len(name) > 3:
+            attr = name[3].lower() + name[4:]
+            return lambda value, *args, **kwargs: setattr(self, attr, value)
+        raise AttributeError(name)
+
+
+class ContinueKeys:
+    """ Presses `key` as soon as a trial of one of `trial_types` is waiting for it """
+
+    def __init__(self, key='space', trial_types=('InstructionTrial',)):
+        self.key = key
+        self.trial_types = trial_types
+
+    def poll(self, session, now):
+        trial = getattr(session, 'current_trial', None)
+        if trial is not None and type(trial).__name__ in self.trial_types:
+            return [(self.key, now)]
+        return []
+
+
+class ScannerTriggers:
+
+    def __init__(self, tr, key='t', delay=1.0, start_trial_type='DummyWaiterTrial'):
+        """ Scripted scanner: sends `key` every `tr` seconds.
+
+        The scanner is started `delay` seconds after the first trial of
+        type `start_trial_type` (the one waiting for triggers) comes up.
+        """
+        self.tr = tr
+        self.key = key
+        self.delay = delay
+        self.start_trial_type = start_trial_type
+        self.next_t = None
+
+    def poll(self, session, now):
+        if self.next_t is None:
+            trial = getattr(session, 'current_trial', None)
+            if trial is None or type(trial).__name__ != self.start_trial_type:
+                return []
+            self.next_t = now + self.delay
+        events = []
+        while self.next_t <= now:
+            events.append((self.key, self.next_t))
+            self.next_t += self.tr
+        return events
+
+
+class SimulatedObserver:
+
+    def __init__(self, threshold=2.0, slope=3.0, lower_asymptote=0.5, lapse_rate=0.025,
+                 scale='linear', rt_median=0.6, rt_sigma=0.3, seed=None):
+        """ Answers experimental trials like a Weibull observer.
+
+        During the response phase of every experimental trial, the observer
+        rotates in the correct direction with the probability given by
+        psychometric.weibull at the trial's staircase value, pressing one of
+        the configured `cw_buttons`/`ccw_buttons` after a log-normally
+        distributed response time (from the start of the response phase).
+
+        Parameters
+        ----------
+        threshold, slope, lower_asymptote, lapse_rate : float
+            True parameters of the observer's psychometric function.
+        scale : str
+            Scale of the staircase values (see psychometric.weibull).
+        rt_median : float
+            Median response time (in s).
+        rt_sigma : float
+            Spread of the log response times.
+        seed : int or np.random.SeedSequence
+            Seed of the observer's responses.
+        """
+        self.params = {'threshold': threshold, 'slope': slope,
+                       'lower_asymptote': lower_asymptote, 'lapse_rate': lapse_rate,
+                       'scale': scale}
+        self.rt_median = rt_median
+        self.rt_sigma = rt_sigma
+        self.rng = np.random.default_rng(seed)
+        self.answered = set()
+        self.pending = []
+
+    def respond(self, trial, now, exp_s):
+        """ Decides on a key press for `trial`, returns (key, time) """
+        p_correct = weibull(trial.parameters['staircase_value'], **self.params)
+        sign = trial.parameters['correct_response_sign']
+        if self.rng.random() >= p_correct:
+            sign = -sign
+        buttons = exp_s['cw_buttons'] if sign == 1 else exp_s['ccw_buttons']
+        key = buttons[self.rng.integers(len(buttons))]
+        rt = self.rt_median * np.exp(self.rt_sigma * self.rng.standard_normal())
+        return key, now + rt
+
+    def poll(self, session, now):
+        trial = getattr(session, 'current_trial', None)
+        if trial is not None and type(trial).__name__ == 'ExpOriMapperTrial' and \
+                trial.phase == 3 and trial.trial_nr not in self.answered:
+            self.answered.add(trial.trial_nr)
+            self.pending.append(self.respond(trial, now, session.settings['experiment']))
+
+        events = [event for event in self.pending if event[1] <= now]
+        self.pending = [event for event in self.pending if event[1] > now]
+        return events
+
+
+class SimulatedKeyboard:
+
+    def __init__(self, session, vtime, sources):
+        """ Stand-in for psychopy.event.getKeys, fed by simulated sources.
+
+        Every source has a poll(session, now) method that returns the
+        (key, virtual time) events it produced up to `now`.
+        """
+        self.session = session
+        self.vtime = vtime
+        self.sources = sources
+
+    def getKeys(self, keyList=None, modifiers=False, timeStamped=False):
+        now = self.vtime.now
+        events = sorted((event for source in self.sources
+                         for event in source.poll(self.session, now)),
+                        key=lambda event: event[1])
+        if keyList is not None:
+            events = [event for event in events if event[0] in keyList]
+        if timeStamped is False:
+            return [key for key, _ in events]
+        if timeStamped is True:
+            return [(key, t) for key, t in events]
+        # a clock: express the event times on that clock
+        return [(key, timeStamped.getTime() - (now - t)) for key, t in events]
+
+
+@contextmanager
+def _patched(targets):
+    """ Sets (object, attribute, value) targets, restoring them on exit """
+    originals = [(obj, name, getattr(obj, name, None), hasattr(obj, name))
+                 for obj, name, _ in targets]
+    for obj, name, value in targets:
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for obj, name, value, existed in originals:
+            if existed:
+                setattr(obj, name, value)
+            else:
+                delattr(obj, name)
+
+
+def _class_targets(modules):
+    """ Every psychopy stimulus, Mouse and Clock class imported by `modules` """
+    targets = []
+    for module in modules:
+        for name, obj in list(vars(module).items()):
+            if not isinstance(obj, type):
+                continue
+            if obj.__module__.startswith('psychopy.visual') or \
+                    (obj.__module__ == 'psychopy.event' and name == 'Mouse'):
+                targets.append((module, name, HeadlessStim))
+            elif obj.__module__ == 'psychopy.clock' and name == 'Clock':
+                targets.append((module, name, VirtualClock))
+    return targets
+
+
+@contextmanager
+def headless(refresh_rate=60.0, sources=()):
+    """ Runs the session and trial classes without a display, in virtual time.
+
+    Within this context psychopy's Clock runs on virtual time, the session
+    opens a HeadlessWindow, all stimuli are HeadlessStims and key presses
+    come from the simulated `sources` (the input polling thread is not
+    started, responses are read in the frame loop). Staircase checkpoints
+    are written to the session's output_dir instead of the data directory.
+
+    Yields
+    ------
+    harness : dict
+        'vtime' (the VirtualTime), 'keyboard' (the SimulatedKeyboard, to
+        which more sources can be added) and 'windows' (all windows opened
+        in the context, each bound to its session).
+    """
+    import psychopy.clock
+    import psychopy.core
+    import psychopy.event
+    import exptools2.core.session
+    import exptools2.core.trial
+    import exporimapper
+    import stimcache
+    import trial
+
+    vtime = VirtualTime()
+    keyboard = SimulatedKeyboard(None, vtime, list(sources))
+    windows = []
+
+    def _create_input(session):
+        # simulated key presses only reach psychopy.event.getKeys
+        session.response_table = response_table(session.settings['experiment'])
+        session.input_poller = None
+
+    def _create_window(session):
+        win = HeadlessWindow(vtime, refresh_rate, monitor=getattr(session, 'monitor', None),
+                             **session.settings['window'])
+        win.session = session
+        windows.append(win)
+        keyboard.session = session
+        return win
+
+    def _checkpoint_prefix(checkpoint_dir, sub, ses, task, run):
+        # simulated staircases never overwrite the checkpoints of real sessions
+        return checkpoint_prefix(keyboard.session.output_dir, sub, ses, task, run)
+
+    targets = [(VirtualClock, 'time', vtime),
+               (psychopy.event, 'getKeys', keyboard.getKeys),
+               (psychopy.event, 'clearEvents', lambda *args, **kwargs: None),
+               (exptools2.core.session.Session, '_create_monitor', lambda session: None),
+               (exptools2.core.session.Session, '_create_window', _create_window),
+               (exporimapper.ExpOriMapperSession, 'create_input', _create_input),
+               (exporimapper, 'checkpoint_prefix', _checkpoint_prefix)]
+    targets += _class_targets([psychopy.core, psychopy.clock, exptools2.core.session,
+                               exptools2.core.trial, exporimapper, stimcache, trial])
+
+    with _patched(targets):
+        yield {'vtime': vtime, 'keyboard': keyboard, 'windows': windows}
+
+
+def simulate_run(sub, run_id, ses=1, task='test', settings_file='defaults.yml', output_dir='logs/simulation',
+                 refresh_rate=60.0, trigger_delay=1.0, seed=0, observer_kwargs=None):
+    """ Runs one full run headless with a simulated observer and scanner.
+
+    All outputs of the run (events, staircase decisions, frame times) are
+    written to `output_dir` under the regular output names.
+
+    Returns
+    -------
+    summary : dict
+        Wall time, virtual duration, per-trial CPU cost, staircase latency
+        and the observer's performance.
+    """
+    from exporimapper import ExpOriMapperSession, run_output_str
+
+    seed_seq = np.random.SeedSequence([seed, sub, ses, run_id])
+    observer = SimulatedObserver(seed=seed_seq, **(observer_kwargs or {}))
+    # correct_response_sign is drawn from the global generator
+    np.random.seed(seed_seq.generate_state(1))
+
+    output_str = run_output_str(sub, ses, task, run_id)
+    t_start = time.perf_counter()
+    with headless(refresh_rate, sources=[ContinueKeys(), observer]) as harness:
+        session = ExpOriMapperSession(sub=sub, run_id=run_id, ses=ses, task=task,
+                                      output_str=output_str, output_dir=output_dir,
+                                      settings_file=settings_file, eyetracker_on=False,
+                                      overwrite_checkpoint=True)
+        harness['keyboard'].sources.append(
+            ScannerTriggers(session.settings['mri']['TR'], session.mri_trigger, trigger_delay))
+        session.run()
+    wall_time = time.perf_counter() - t_start
+
+    win = harness['windows'][0]
+    frames = pd.DataFrame({'cost': win.frame_costs, 'type': win.frame_trial_types,
+                           'trial_nr': win.frame_trial_nrs})
+    trial_costs = frames.loc[frames['type'] == 'ExpOriMapperTrial'].groupby('trial_nr')['cost'].sum()
+    decisions = pd.DataFrame(session.staircase_worker.decisions)
+    responses = decisions['response'].dropna()
+    return {'sub': sub, 'ses': ses, 'task': task, 'run': run_id,
+            'wall_time': wall_time,
+            'virtual_duration': harness['vtime'].now,
+            'n_flips': len(win.frame_costs),
+            'trial_cpu_median': trial_costs.median(),
+            'trial_cpu_max': trial_costs.max(),
+            'staircase_latency_median': decisions['compute_latency'].median(),
+            'staircase_latency_max': decisions['compute_latency'].max(),
+            'deadline_misses': int(decisions['deadline_missed'].sum()),
+            'n_responses': len(responses),
+            'p_correct': responses.mean(),
+            'final_intensity': decisions['intensity'].iloc[-1]}
+
+
+def _simulate_run(kwargs):
+    return simulate_run(**kwargs)
+
+
+@click.command()
+@click.option('--subs', default='1', type=IntList(), help='Subjects, e.g. 1-60 or 1,3,5')
+@click.option('--runs', default='1', type=IntList(), help='Runs, e.g. 1-12')
+@click.option('--ses', default=1, type=int, help='Session nr')
+@click.option('--task', default='test', type=str, help='Type of run (train, test)')
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file')
+@click.option('--out_dir', default='logs/simulation', type=str, help='Output directory of the simulated runs')
+@click.option('--refresh_rate', default=60.0, type=float, help='Simulated refresh rate (Hz)')
+@click.option('--threshold', default=2.0, type=float, help='Threshold of the simulated observer')
+@click.option('--slope', default=3.0, type=float, help='Slope of the simulated observer')
+@click.option('--lapse_rate', default=0.025, type=float, help='Lapse rate of the simulated observer')
+@click.option('--seed', default=0, type=int, help='Base seed of the simulation')
+@click.option('--n_jobs', default=1, type=int, help='Worker processes')
+def main_api(subs, runs, ses, task, settings, out_dir, refresh_rate, threshold, slope, lapse_rate, seed, n_jobs):
+    """ Simulates runs headless and prints their timing and performance """
+    jobs = [{'sub': sub, 'run_id': run_id, 'ses': ses, 'task': task, 'settings_file': settings,
+             'output_dir': out_dir, 'refresh_rate': refresh_rate, 'seed': seed,
+             'observer_kwargs': {'threshold': threshold, 'slope': slope, 'lapse_rate': lapse_rate}}
+            for sub in subs for run_id in runs]
+    t_start = time.perf_counter()
+    if n_jobs == 1:
+        summaries = [simulate_run(**job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            summaries = list(pool.map(_simulate_run, jobs))
+    duration = time.perf_counter() - t_start
+
+    print(pd.DataFrame(summaries).round(4).to_string(index=False))
+    print(f'{len(jobs)} runs in {duration:.1f} s ({len(jobs) / duration * 60:.0f} runs per minute)')
+
+
+if __name__ == '__main__':
+    main_api()
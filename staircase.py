@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import questplus
+from psychopy import logging
+from psychopy.data.staircase import QuestPlusHandler
+
+from psychometric import grid_prior, start_intensity
+
+
+def settings_hash(quest_plus_s):
+    """ Returns a short, stable hash of a questplus settings block """
+    payload = json.dumps({'questplus': quest_plus_s,
+                          'questplus_version': questplus.__version__},
+                         sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf8')).hexdigest()[:16]
+
+
+# the handler whose likelihoods the current thread is constructing, if any
+_constructing = threading.local()
+_gen_likelihoods = questplus.qp.QuestPlus._gen_likelihoods
+
+
+def _dispatch_gen_likelihoods(qp_self):
+    """ QuestPlus._gen_likelihoods, through the cache of the handler this thread constructs
+
+    psychopy creates the QuestPlus object (which generates the likelihoods)
+    inside QuestPlusHandler.__init__, so the method is replaced once, at
+    import, and looks up its handler per thread; QuestPlus objects created
+    outside a CachedQuestPlusHandler, or in other threads, are unaffected.
+    """
+    handler = getattr(_constructing, 'handler', None)
+    if handler is None:
+        return _gen_likelihoods(qp_self)
+    return handler._load_likelihoods(qp_self, _gen_likelihoods)
+
+
+questplus.qp.QuestPlus._gen_likelihoods = _dispatch_gen_likelihoods
+
+
+class CachedQuestPlusHandler(QuestPlusHandler):
+
+    def __init__(self, nTrials, cache_dir, **quest_plus_s):
+        """ QuestPlusHandler that maps its likelihood tensor from disk.
+
+        The likelihood tensor only depends on the grids in the questplus
+        settings, so it is computed once per unique settings block and stored
+        as a .npy file (plus a .json sidecar with its dimension names) in
+        `cache_dir`. Later sessions memory-map that file instead of
+        recomputing it.
+
+        Parameters
+        ----------
+        nTrials : int
+            Number of trials to run.
+        cache_dir : str
+            Directory in which the likelihood tensors are stored.
+        quest_plus_s : dict
+            The questplus settings block, passed on to QuestPlusHandler;
+            its prior may hold a single value per parameter (see
+            psychometric.grid_prior).
+        """
+        self.cache_key = settings_hash(quest_plus_s)
+        self.cache_path = os.path.join(
+            cache_dir, f'likelihoods_{self.cache_key}.npy')
+        self.cache_hit = os.path.isfile(self.cache_path) and \
+            os.path.isfile(self.cache_path.replace('.npy', '.json'))
+
+        start_intensity(quest_plus_s)
+        prior = grid_prior(quest_plus_s)
+        with self._cached_likelihoods():
+            super().__init__(nTrials=nTrials, **{**quest_plus_s, 'prior': None})
+        if prior is not None:
+            # psychopy hands a prior of every parameter to questplus in
+            # another order than its dimensions, so it is set here instead
+            names = {'lower_asymptote': 'lowerAsymptote', 'lapse_rate': 'lapseRate'}
+            dims = self._qp.prior.dims
+            values = np.ones([1] * len(dims))
+            for axis, dim in enumerate(dims):
+                values = values * np.reshape(prior[names.get(dim, dim)],
+                                             [-1 if i == axis else 1 for i in range(len(dims))])
+            self._qp.prior = self._qp.prior.copy(data=values / values.sum())
+            self._qp.posterior = self._qp.prior.copy()
+
+    @contextmanager
+    def _cached_likelihoods(self):
+        """ Routes this thread's likelihood generation through the disk cache """
+        _constructing.handler = self
+        try:
+            yield
+        finally:
+            _constructing.handler = None
+
+    def _load_likelihoods(self, qp_self, gen_likelihoods):
+        """ Maps the cached likelihoods, computing and storing them on a miss """
+        meta_path = self.cache_path.replace('.npy', '.json')
+        if not self.cache_hit:
+            likelihoods = gen_likelihoods(qp_self)
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            # write to temporary files first so that a crashed write
+            # never leaves a half-written tensor behind, named per process
+            # and thread so that concurrent misses (e.g. a sweep) do not
+            # write into each other's files
+            tmp_suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+            tmp_path = self.cache_path + tmp_suffix + '.npy'
+            np.save(tmp_path, np.ascontiguousarray(likelihoods.values))
+            with open(meta_path + tmp_suffix, 'w') as f:
+                json.dump({'dims': list(likelihoods.dims)}, f)
+            os.replace(tmp_path, self.cache_path)
+            os.replace(meta_path + tmp_suffix, meta_path)
+            return likelihoods
+
+        with open(meta_path, 'r', encoding='utf8') as f_in:
+            dims = json.load(f_in)['dims']
+        values = np.load(self.cache_path, mmap_mode='r')
+        domains = {**qp_self.stim_domain, **qp_self.param_domain,
+                   **qp_self.outcome_domain}
+        return xr.DataArray(values, dims=dims,
+                            coords={d: domains[d] for d in dims})
+
+    @property
+    def posterior_shape(self):
+        return self._qp.posterior.shape
+
+    def get_state(self):
+        """ Returns the posterior and the (intensity, response) pairs it was updated with """
+        return {'posterior': self._qp.posterior.values,
+                'intensities': [stim['intensity'] for stim in self._qp.stim_history],
+                'responses': [resp['response'] for resp in self._qp.resp_history]}
+
+    def set_state(self, posterior, intensities, responses):
+        """ Restores a state from get_state, without replaying the responses
+
+        The staircase continues as if it had just received the last
+        response; nTrials is extended by the restored responses.
+        """
+        self._qp.posterior = self._qp.posterior.copy(data=np.asarray(posterior))
+        self._qp.stim_history = [{'intensity': intensity} for intensity in intensities]
+        self._qp.resp_history = [{'response': response} for response in responses]
+        self.intensities = list(intensities)
+        self.data = list(responses)
+        self.thisTrialN = len(self.data) - 1
+        self.nTrials += len(self.data)
+
+
+class StaircaseWorker:
+
+    def __init__(self, staircase, deadline, checkpoint=None):
+        """ Runs staircase updates and intensity selection off the frame loop.
+
+        Responses are handed to a single background thread as soon as they
+        come in, so the posterior update and the selection of the next
+        intensity overlap with the rest of the 'response' phase. The session
+        collects the next intensity between trials; if it is not ready
+        within `deadline` seconds after the job was submitted, the last
+        intensity is reused and the miss is logged.
+
+        Parameters
+        ----------
+        staircase : QuestPlusHandler
+            The staircase to drive. Only this worker should touch it once the
+            worker has been created.
+        deadline : float
+            Hard deadline (in s) for a decision, counted from the moment the
+            job was submitted.
+        checkpoint : checkpoint.StaircaseCheckpoint
+            If given, the state of the staircase is written to it after
+            every response, on the worker thread.
+        """
+        self.staircase = staircase
+        self.deadline = deadline
+        self.checkpoint = checkpoint
+        self.last_intensity = staircase.intensities[-1] if staircase.intensities else staircase.startIntensity
+        self.decisions = []
+        # a single thread keeps the updates in order, even when a job
+        # overruns its deadline and the next one is queued behind it
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='staircase')
+        self._pending = None
+
+    def _update(self, response, intensity):
+        t_start = time.perf_counter()
+        if response is not None:
+            # the intensity that was shown, which is not the handler's last
+            # pick when that came too late
+            self.staircase.addResponse(response, intensity=intensity)
+        intensity = self.staircase.next()
+        latency = time.perf_counter() - t_start
+        if response is not None and self.checkpoint is not None:
+            self.checkpoint.write(**self.staircase.get_state())
+        return intensity, latency
+
+    def set_checkpoint(self, checkpoint):
+        """ Writes the state to `checkpoint` from now on, starting with the current one
+
+        The switch is queued behind a pending update, on the worker thread,
+        so no response is written to the wrong checkpoint or lost.
+        """
+        def _switch():
+            self.checkpoint = checkpoint
+            if checkpoint is not None and self.staircase.data:
+                checkpoint.write(**self.staircase.get_state())
+        self._executor.submit(_switch)
+
+    def add_response(self, response, intensity=None):
+        """ Queues a response; the update starts immediately in the background
+
+        The response is attributed to `intensity`, by default the last
+        intensity returned by next(), i.e. the one that was shown.
+        """
+        if intensity is None:
+            intensity = self.last_intensity
+        self._pending = (self._executor.submit(self._update, response, intensity),
+                         time.perf_counter(), response)
+
+    def next(self):
+        """ Returns the next intensity, or the last one if the deadline passed """
+        if self._pending is None:
+            self.add_response(None)
+        future, t_submit, response = self._pending
+        self._pending = None
+
+        decision = {'decision_nr': len(self.decisions),
+                    'response': response,
+                    'intensity': self.last_intensity,
+                    'compute_latency': np.nan,
+                    'wait_time': np.nan,
+                    'deadline_missed': False}
+        remaining = self.deadline - (time.perf_counter() - t_submit)
+        try:
+            decision['intensity'], decision['compute_latency'] = future.result(
+                timeout=max(remaining, 0))
+        except FutureTimeoutError:
+            decision['deadline_missed'] = True
+            logging.warning(
+                f'staircase missed its {self.deadline:.3f} s deadline, '
+                f'reusing last intensity {self.last_intensity}')
+
+            # the late update still lands in the posterior; record its
+            # latency once it finishes
+            def _record_latency(late_future):
+                if late_future.exception() is None:
+                    decision['compute_latency'] = late_future.result()[1]
+            future.add_done_callback(_record_latency)
+        decision['wait_time'] = time.perf_counter() - t_submit
+
+        self.decisions.append(decision)
+        self.last_intensity = decision['intensity']
+        return self.last_intensity
+
+    def save_decisions(self, fn, start=0):
+        """ Writes the decisions from decision `start` on, and their latencies, to a tsv file """
+        pd.DataFrame(self.decisions[start:]).to_csv(fn, sep='\t', na_rep='NA')
+
+    def shutdown(self):
+        """ Waits for a pending update and stops the background thread """
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from psychopy.visual import ImageStim, TextStim
+
+
+@lru_cache(maxsize=8)
+def gamma_pattern(size_pix, n_tiles=24, mid=0.5):
+    """ Returns the gamma test pattern of data/gamma.ipynb as an image array.
+
+    The pattern is an n_tiles x n_tiles grid of tiles. Every tile
+    alternates single pixel rows of a dark and a light value (the darks
+    from 0 to 0.45 down the rows of the grid, the lights from 0.55 to 1
+    across its columns) around a disc of `mid`. On a correctly linearized
+    display the disc matches the rows whose values add up to 1.
+
+    Parameters
+    ----------
+    size_pix : tuple
+        (width, height) of the image in pixels, so that one row of the
+        pattern is one row of the display. The image has exactly this
+        shape.
+    n_tiles : int
+        Tiles per side.
+    mid : float
+        Value of the discs.
+
+    Returns
+    -------
+    image : np.ndarray
+        Shape (height, width), in psychopy's -1..1 color range, read-only.
+    """
+    width, height = size_pix
+    mins, maxs = np.linspace(0, 0.45, n_tiles), np.linspace(1, 0.55, n_tiles)[::-1]
+    tile_w, tile_h = max(width // n_tiles, 1), max(height // n_tiles, 1)
+
+    # tile coordinates of every pixel; the pixels left over by the integer
+    # tile size widen the tiles at the edges
+    rows = np.arange(height) - (height - n_tiles * tile_h) // 2
+    cols = np.arange(width) - (width - n_tiles * tile_w) // 2
+    tile_i = np.clip(rows // tile_h, 0, n_tiles - 1)
+    tile_j = np.clip(cols // tile_w, 0, n_tiles - 1)
+    image = np.where((np.arange(height) % 2 == 0)[:, np.newaxis],
+                     maxs[tile_j][np.newaxis, :], mins[tile_i][:, np.newaxis])
+
+    y = (rows - tile_i * tile_h + 0.5 - tile_h / 2)[:, np.newaxis]
+    x = (cols - tile_j * tile_w + 0.5 - tile_w / 2)[np.newaxis, :]
+    image[x**2 / (tile_w / 3)**2 + y**2 / (tile_h / 3)**2 <= 1] = mid
+
+    # psychopy images run bottom to top, and from -1 to 1
+    image = np.ascontiguousarray(2 * image[::-1] - 1)
+    image.flags.writeable = False
+    return image
+
+
+def gamma_size_pix(size, monitor, n_tiles=24, tile_pix=24):
+    """ Returns the display size in pixels of a gamma pattern of `size` deg
+
+    Without a calibrated monitor (e.g. in headless simulations) the
+    pattern gets `tile_pix` pixels per tile, as in data/gamma.png.
+    """
+    if monitor is None:
+        return n_tiles * tile_pix, n_tiles * tile_pix
+    from psychopy.tools.monitorunittools import deg2pix
+    return tuple(int(round(deg2pix(s, monitor))) for s in size)
+
+
+class StimulusCache:
+
+    def __init__(self, win, max_size=16):
+        """ Session-level cache of image and text stimuli.
+
+        Creating an ImageStim decodes and uploads its texture, creating a
+        TextStim lays out its text; trials borrow the stimuli from here so
+        that this happens once per key instead of once per trial. The
+        least recently borrowed stimulus is dropped when more than
+        `max_size` are cached.
+
+        Stimuli are shared between the trials that borrow the same key, so
+        everything that differs between them (position, opacity) is part
+        of the key and must not be changed after borrowing.
+
+        Parameters
+        ----------
+        win : psychopy Window
+            Window the stimuli are created in.
+        max_size : int
+            Maximum number of cached stimuli.
+        """
+        self.win = win
+        self.max_size = max_size
+        self.stims = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _borrow(self, key, create):
+        """ Returns the stimulus of `key`, calling create() on a miss """
+        if key in self.stims:
+            self.hits += 1
+            self.stims.move_to_end(key)
+            return self.stims[key]
+        self.misses += 1
+        stim = self.stims[key] = create()
+        while len(self.stims) > self.max_size:
+            self.stims.popitem(last=False)
+        return stim
+
+    def image(self, image, size, **kwargs):
+        """ Returns an ImageStim of an image file """
+        key = ('image', image, tuple(size), tuple(sorted(kwargs.items())))
+        return self._borrow(key, lambda: ImageStim(self.win, image=image, size=size, **kwargs))
+
+    def text(self, text, font, height, wrap_width, pos=(0, 0), opacity=1.0, **kwargs):
+        """ Returns a TextStim, laid out once per text, font, height and wrap width """
+        key = ('text', text, font, height, wrap_width, tuple(pos), opacity, tuple(sorted(kwargs.items())))
+
+        def create():
+            stim = TextStim(self.win, text, height=height, wrapWidth=wrap_width, pos=pos,
+                            font=font, opacity=opacity, **kwargs)
+            stim.setSize(height)
+            return stim
+        return self._borrow(key, create)
+
+    def gamma(self, size, monitor, gamma):
+        """ Returns an ImageStim of the gamma test pattern at display resolution
+
+        The stimulus is sized in pixels, to the shape of the pattern, so
+        that its rows are never resampled. The pattern and its texture are
+        kept per monitor and gamma setting.
+        """
+        size_pix = gamma_size_pix(size, monitor)
+        monitor_name = getattr(monitor, 'name', None)
+        key = ('gamma', monitor_name, gamma, tuple(size), size_pix)
+        return self._borrow(key, lambda: ImageStim(self.win, image=gamma_pattern(size_pix),
+                                                   size=size_pix, units='pix'))
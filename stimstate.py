@@ -0,0 +1,139 @@
+import numpy as np
+
+
+def _same(a, b):
+    """ Whether two attribute values are equal, for strings, numbers and arrays alike """
+    if a is b:
+        return True
+    if isinstance(a, str) or isinstance(b, str):
+        return isinstance(a, str) and isinstance(b, str) and a == b
+    try:
+        return bool(np.array_equal(a, b))
+    except (TypeError, ValueError):
+        return False
+
+
+def _frozen(value):
+    """ A copy of value that the caller cannot change behind our back """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return np.array(value)
+    return value
+
+
+class UpdateCounter:
+
+    def __init__(self, capacity=16384):
+        """ Counts the real and redundant stimulus updates of every frame.
+
+        The counts of the current frame are closed at every window flip
+        (see install) and stored per frame, in arrays that are doubled
+        when full.
+
+        Parameters
+        ----------
+        capacity : int
+            Initial number of frames there is room for.
+        """
+        self.real = np.zeros(capacity, dtype=np.int32)
+        self.redundant = np.zeros(capacity, dtype=np.int32)
+        self._win_flip = None
+        self.reset()
+
+    def reset(self):
+        """ Forgets the counts, for the next run """
+        self.n_frames = 0
+        self.frame_real, self.frame_redundant = 0, 0
+
+    def install(self, win):
+        """ Wraps the flip method of a window, closing a frame at every flip """
+        self._win_flip = win.flip
+        win.flip = self.flip
+
+    def flip(self, *args, **kwargs):
+        flip_time = self._win_flip(*args, **kwargs)
+        self.end_frame()
+        return flip_time
+
+    def end_frame(self):
+        if self.n_frames == len(self.real):
+            self.real = np.concatenate([self.real, np.zeros_like(self.real)])
+            self.redundant = np.concatenate([self.redundant, np.zeros_like(self.redundant)])
+        self.real[self.n_frames], self.redundant[self.n_frames] = self.frame_real, self.frame_redundant
+        self.n_frames += 1
+        self.frame_real, self.frame_redundant = 0, 0
+
+    def summary(self):
+        """ Returns the total and per frame real and redundant updates """
+        real, redundant = self.real[:self.n_frames], self.redundant[:self.n_frames]
+        n = max(self.n_frames, 1)
+        return {'n_frames': self.n_frames,
+                'real': int(real.sum()), 'redundant': int(redundant.sum()),
+                'real_per_frame': float(real.sum() / n), 'redundant_per_frame': float(redundant.sum() / n),
+                'max_real_per_frame': int(real.max(initial=0))}
+
+
+class StimState:
+
+    def __init__(self, stim, counter=None):
+        """ Wraps a stimulus so that only changed values reach it.
+
+        Attribute assignments (grating.phase = x) and setX(value) calls
+        are compared with the last value set through the wrapper and
+        passed on to the stimulus only when they differ; psychopy would
+        otherwise recompute colors and vertices, or flag textures and
+        shaders for rebuilding, on every frame. Everything else (draw,
+        reading attributes) goes straight to the stimulus.
+
+        The first value of every attribute is always passed on, and setX
+        calls with further arguments (a color space, an operation) are
+        never skipped and make the wrapper forget the attribute. Changes
+        made to the stimulus directly, bypassing the wrapper, must be
+        followed by invalidate().
+
+        Parameters
+        ----------
+        stim : psychopy stimulus
+            The wrapped stimulus.
+        counter : UpdateCounter
+            Counts the real and redundant updates, if given.
+        """
+        object.__setattr__(self, 'stim', stim)
+        object.__setattr__(self, 'counter', counter)
+        object.__setattr__(self, 'values', {})
+
+    def _update(self, attr, value, push):
+        """ Calls push() unless value is the last value of attr, returns whether it did """
+        if attr in self.values and _same(self.values[attr], value):
+            if self.counter is not None:
+                self.counter.frame_redundant += 1
+            return False
+        push()
+        self.values[attr] = _frozen(value)
+        if self.counter is not None:
+            self.counter.frame_real += 1
+        return True
+
+    def invalidate(self, attr=None):
+        """ Forgets the last value of attr (of all attributes if None) """
+        if attr is None:
+            self.values.clear()
+        else:
+            self.values.pop(attr, None)
+
+    def __setattr__(self, name, value):
+        self._update(name, value, lambda: setattr(self.stim, name, value))
+
+    def __getattr__(self, name):
+        method = getattr(self.stim, name)
+        if not (name.startswith('set') and len(name) > 3):
+            return method
+        attr = name[3].lower() + name[4:]
+
+        def setter(value, *args, **kwargs):
+            if args or kwargs:
+                self.invalidate(attr)
+                if self.counter is not None:
+                    self.counter.frame_real += 1
+                return method(value, *args, **kwargs)
+            self._update(attr, value, lambda: method(value))
+        return setter
@@ -0,0 +1,324 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+import pandas as pd
+import yaml
+from scipy.special import xlogy
+
+from psychometric import grid_prior, start_intensity, weibull
+
+
+def load_configs(configs_file, settings):
+    """ Reads the candidate configurations of a sweep.
+
+    The configs file holds a list of configurations, each with a `name`
+    and optionally `questplus` (overrides of the questplus block of the
+    settings), `engine` ('questplus' or 'pruned') and `pruned` (overrides
+    of staircase.pruned), e.g.::
+
+        - name: settings
+        - name: fine
+          engine: pruned
+          questplus:
+            thresholdVals: [0.05, 0.1, ...]
+
+    Returns
+    -------
+    configs : list of dict
+        Complete configurations with name, engine, questplus and pruned.
+    """
+    with open(configs_file, 'r', encoding='utf8') as f_in:
+        candidates = yaml.safe_load(f_in)
+    configs = []
+    for candidate in candidates:
+        configs.append({'name': str(candidate['name']),
+                        'engine': candidate.get('engine', 'questplus'),
+                        'questplus': {**settings['questplus'], **candidate.get('questplus', {})},
+                        'pruned': {**settings['staircase']['pruned'], **candidate.get('pruned', {})}})
+    names = [config['name'] for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError('configuration names must be unique')
+    return configs
+
+
+class BatchedQuestPlus:
+
+    def __init__(self, quest_plus_s, n_runs, seed_seq=None):
+        """ QUEST+ for many simulated runs at once.
+
+        Follows QuestPlusHandler (prior, startIntensity, minEntropy and
+        minNEntropy selection, mean and mode estimates) for a whole batch
+        of runs in parallel. The expected entropy of every candidate
+        intensity is expanded into sums over the grid,
+
+            E[H] = sum_r Z_r log Z_r - sum_p w_p L_rp (log w_p + log L_rp),
+
+        with Z_r = sum_p w_p L_rp, so one selection for the whole batch is
+        a handful of (n_runs x n_params) @ (n_params x n_intensities)
+        matrix products.
+
+        Parameters
+        ----------
+        quest_plus_s : dict
+            The questplus settings block.
+        n_runs : int
+            Number of runs in the batch.
+        seed_seq : np.random.SeedSequence
+            Seed of the minNEntropy draws.
+        """
+        self.intensity_vals = np.asarray(quest_plus_s['intensityVals'], dtype=float)
+        grids = [np.atleast_1d(np.asarray(quest_plus_s[key], dtype=float)) for key in
+                 ['thresholdVals', 'slopeVals', 'lowerAsymptoteVals', 'lapseRateVals']]
+        shape = tuple(len(grid) for grid in grids)
+        params = [p.ravel() for p in np.meshgrid(*grids, indexing='ij')]
+        self.thresholds = params[0]
+
+        prior = np.ones(shape)
+        for axis, values in enumerate((grid_prior(quest_plus_s) or {}).values()):
+            prior = prior * np.reshape(values, [-1 if i == axis else 1 for i in range(len(shape))])
+        prior = prior.ravel() / prior.sum()
+        self.posterior = np.tile(prior, (n_runs, 1))
+
+        self.start_intensity = start_intensity(quest_plus_s)
+        self.method = quest_plus_s.get('stimSelectionMethod', 'minEntropy')
+        if self.method not in ['minEntropy', 'minNEntropy']:
+            raise ValueError(f'unknown stimSelectionMethod {self.method}')
+        options = quest_plus_s.get('stimSelectionOptions') or {}
+        self.n_stim = options.get('N', 4)
+        self.max_reps = options.get('maxConsecutiveReps', 2)
+        self.estimation = quest_plus_s.get('paramEstimationMethod', 'mean')
+        self.rngs = [np.random.default_rng(s) for s in
+                     (seed_seq or np.random.SeedSequence()).spawn(n_runs)]
+
+        # likelihoods of a correct (row 0) and incorrect (row 1) response
+        p = weibull(self.intensity_vals[:, np.newaxis], *params,
+                    scale=quest_plus_s.get('stimScale', 'log10'))
+        self.likelihoods = np.stack([p, 1 - p])
+        self.l_log_l = xlogy(self.likelihoods, self.likelihoods)
+        self.history = [[] for _ in range(n_runs)]
+        self.n_trials = 0
+
+    def expected_entropy(self):
+        """ Returns the expected entropy of every intensity, shape (n_runs, n_intensities) """
+        w_log_w = xlogy(self.posterior, self.posterior)
+        expected = 0
+        for likelihood, l_log_l in zip(self.likelihoods, self.l_log_l):
+            z = self.posterior @ likelihood.T
+            expected = expected + xlogy(z, z) - w_log_w @ likelihood.T - self.posterior @ l_log_l.T
+        return expected
+
+    def next(self):
+        """ Returns the index of the next intensity of every run """
+        if self.n_trials == 0 and self.start_intensity is not None:
+            idx = np.full(len(self.posterior), np.argmin(np.abs(self.intensity_vals - self.start_intensity)))
+        elif self.method == 'minEntropy':
+            idx = np.argmin(self.expected_entropy(), axis=1)
+        else:
+            best = np.argsort(self.expected_entropy(), axis=1)[:, :self.n_stim]
+            idx = np.zeros(len(best), dtype=int)
+            for run, (candidates, rng, history) in enumerate(zip(best, self.rngs, self.history)):
+                while True:
+                    idx[run] = rng.choice(candidates)
+                    if len(history) < 2 or not all(h == idx[run] for h in history[-self.max_reps:]):
+                        break
+        self.n_trials += 1
+        return idx
+
+    def update(self, idx, correct):
+        """ Updates every run with its response (correct: bool array) to intensity idx """
+        self.posterior *= self.likelihoods[np.where(correct, 0, 1), idx]
+        self.posterior /= self.posterior.sum(axis=1, keepdims=True)
+        for history, i in zip(self.history, idx):
+            history.append(i)
+
+    def threshold_estimates(self):
+        if self.estimation == 'mode':
+            return self.thresholds[np.argmax(self.posterior, axis=1)]
+        return self.posterior @ self.thresholds
+
+
+def simulate_batched(quest_plus_s, observers, uniforms, seed_seq):
+    """ Simulates runs of the questplus engine on a batch of observers
+
+    Returns the threshold estimate after every trial, (n_runs, n_trials).
+    """
+    quest = BatchedQuestPlus(quest_plus_s, len(observers), seed_seq)
+    estimates = np.zeros(uniforms.shape)
+    for trial in range(uniforms.shape[1]):
+        idx = quest.next()
+        p = weibull(quest.intensity_vals[idx], observers['threshold'].to_numpy(),
+                    observers['slope'].to_numpy(), 0.5, observers['lapse_rate'].to_numpy())
+        quest.update(idx, uniforms[:, trial] < p)
+        estimates[:, trial] = quest.threshold_estimates()
+    return estimates
+
+
+def simulate_handler(config, observers, uniforms, cache_dir):
+    """ Simulates runs through the session's staircase handler, one run at a time
+
+    Returns the threshold estimate after every trial, (n_runs, n_trials),
+    and the per-trial compute times (update plus selection, in s).
+    """
+    from prunedquest import PrunedQuestPlusHandler
+    from staircase import CachedQuestPlusHandler
+
+    n_runs, n_trials = uniforms.shape
+    correct_val, incorrect_val = config['questplus']['responseVals']
+    estimates, latencies = np.zeros(uniforms.shape), []
+    for run, observer in enumerate(observers.itertuples()):
+        if config['engine'] == 'pruned':
+            handler = PrunedQuestPlusHandler(nTrials=n_trials, **config['pruned'], **config['questplus'])
+        else:
+            handler = CachedQuestPlusHandler(nTrials=n_trials, cache_dir=cache_dir, **config['questplus'])
+        response = None
+        for trial in range(n_trials):
+            t = time.perf_counter()
+            if response is not None:
+                handler.addResponse(response)
+            intensity = handler.next()
+            latencies.append(time.perf_counter() - t)
+            correct = uniforms[run, trial] < weibull(intensity, observer.threshold, observer.slope,
+                                                     0.5, observer.lapse_rate)
+            response = correct_val if correct else incorrect_val
+            if trial:
+                estimates[run, trial - 1] = handler.paramEstimate['threshold']
+        handler.addResponse(response)
+        estimates[run, -1] = handler.paramEstimate['threshold']
+    return estimates, latencies
+
+
+def convergence_trials(estimates, thresholds, tolerance):
+    """ First trial (1-based) from which every estimate is within `tolerance` of the threshold
+
+    Runs that have not converged by their last trial get n_trials + 1.
+    """
+    outside = np.abs(estimates - thresholds[:, np.newaxis]) > tolerance
+    # index of the last trial outside the tolerance, -1 if there is none
+    last_outside = outside.shape[1] - 1 - np.argmax(outside[:, ::-1], axis=1)
+    last_outside[~outside.any(axis=1)] = -1
+    return last_outside + 2
+
+
+def _simulate_chunk(job):
+    """ Runs one chunk of one configuration (in a worker process) """
+    config, observers, uniforms = job['config'], job['observers'], job['uniforms']
+    latencies = []
+    if job['batched']:
+        estimates = simulate_batched(config['questplus'], observers, uniforms, job['seed_seq'])
+    else:
+        estimates, latencies = simulate_handler(config, observers, uniforms, job['cache_dir'])
+    return {'config': config['name'], 'chunk': job['chunk'], 'timing': job['timing'],
+            'final': estimates[:, -1],
+            'convergence': convergence_trials(estimates, observers['threshold'].to_numpy(), job['tolerance']),
+            'latencies': latencies}
+
+
+def sweep(configs, n_runs=2000, n_trials=115, seed=0, threshold_range=(1, 6), slope_range=(1, 4),
+          lapse_rate=0.02, tolerance=0.25, n_timed=3, chunk_size=250, cache_dir='data/qp_cache', n_jobs=None):
+    """ Monte Carlo comparison of staircase configurations.
+
+    Every configuration runs against the same population of simulated
+    observers (Weibull with a guess rate of 0.5, thresholds and slopes
+    drawn uniformly), with the same random numbers deciding their
+    responses, so differences between configurations are not sampling
+    noise of the population. Runs of the questplus engine are simulated
+    in batches (see BatchedQuestPlus), those of the pruned engine through
+    its handler. The per-trial compute time always comes from `n_timed`
+    extra runs through the session's own handler. Chunks of `chunk_size`
+    runs are spread over a process pool; each chunk has its own seed, so
+    results do not depend on `n_jobs`.
+
+    Returns
+    -------
+    summary : pd.DataFrame
+        Per configuration: bias, sd and RMSE of the final threshold
+        estimate, the median and 90th percentile of the trial from which
+        the estimate stays within `tolerance` of the true threshold, the
+        fraction of runs that got there, and the median and maximum
+        compute time per trial.
+    """
+    seed_seq = np.random.SeedSequence(seed)
+    population_seq, response_seq, selection_seq = seed_seq.spawn(3)
+    rng = np.random.default_rng(population_seq)
+    observers = pd.DataFrame({'threshold': rng.uniform(*threshold_range, size=n_runs + n_timed),
+                              'slope': rng.uniform(*slope_range, size=n_runs + n_timed),
+                              'lapse_rate': lapse_rate})
+    uniforms = np.random.default_rng(response_seq).random((n_runs + n_timed, n_trials))
+
+    jobs = []
+    for config_seq, config in zip(selection_seq.spawn(len(configs)), configs):
+        if config['engine'] == 'questplus':
+            # fails early on settings that questplus would reject
+            BatchedQuestPlus(config['questplus'], 1)
+        elif config['engine'] != 'pruned':
+            raise ValueError(f'unknown staircase engine {config["engine"]} in {config["name"]}')
+        starts = np.arange(0, n_runs, chunk_size)
+        for chunk, (start, chunk_seq) in enumerate(zip(starts, config_seq.spawn(len(starts)))):
+            stop = min(start + chunk_size, n_runs)
+            jobs.append({'config': config, 'chunk': chunk, 'timing': False, 'seed_seq': chunk_seq,
+                         'batched': config['engine'] == 'questplus',
+                         'observers': observers.iloc[start:stop], 'uniforms': uniforms[start:stop],
+                         'tolerance': tolerance, 'cache_dir': cache_dir})
+        if n_timed:
+            jobs.append({'config': config, 'chunk': len(starts), 'timing': True, 'seed_seq': None,
+                         'batched': False, 'observers': observers.iloc[n_runs:],
+                         'uniforms': uniforms[n_runs:], 'tolerance': tolerance, 'cache_dir': cache_dir})
+
+    if n_jobs == 1:
+        results = list(map(_simulate_chunk, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_simulate_chunk, jobs))
+
+    true = observers['threshold'].to_numpy()[:n_runs]
+    rows = []
+    for config in configs:
+        chunks = sorted([r for r in results if r['config'] == config['name']], key=lambda r: r['chunk'])
+        runs = [r for r in chunks if not r['timing']]
+        error = np.concatenate([r['final'] for r in runs]) - true
+        convergence = np.concatenate([r['convergence'] for r in runs])
+        latencies = np.concatenate([r['latencies'] for r in chunks if r['timing']] or [[np.nan]])
+        rows.append({'config': config['name'], 'engine': config['engine'],
+                     'n_runs': n_runs, 'n_trials': n_trials,
+                     'bias': error.mean(), 'sd': error.std(ddof=1), 'rmse': np.sqrt(np.mean(error ** 2)),
+                     'convergence_median': np.median(convergence),
+                     'convergence_p90': np.percentile(convergence, 90),
+                     'p_converged': np.mean(convergence <= n_trials),
+                     'trial_ms_median': np.median(latencies) * 1000,
+                     'trial_ms_max': np.max(latencies) * 1000})
+    return pd.DataFrame(rows)
+
+
+@click.command()
+@click.argument('configs_file', type=str)
+@click.option('--settings', default='defaults.yml', type=str, help='Settings file the configurations override')
+@click.option('--n_runs', default=2000, type=int, help='Simulated runs per configuration')
+@click.option('--n_trials', default=115, type=int, help='Trials per run (n_trials + 25 in the session)')
+@click.option('--thresholds', default='1,6', type=str, help='Range of the observer thresholds')
+@click.option('--slopes', default='1,4', type=str, help='Range of the observer slopes')
+@click.option('--lapse_rate', default=0.02, type=float, help='Lapse rate of the observers')
+@click.option('--tolerance', default=0.25, type=float, help='Distance to the threshold that counts as converged')
+@click.option('--n_timed', default=3, type=int, help='Runs through the handler to time each configuration')
+@click.option('--seed', default=0, type=int, help='Seed of the observers and their responses')
+@click.option('--n_jobs', default=None, type=int, help='Worker processes (default: all cores)')
+@click.option('--out', default=None, type=str, help='Also write the summary to this tsv')
+def main_api(configs_file, settings, n_runs, n_trials, thresholds, slopes, lapse_rate, tolerance,
+             n_timed, seed, n_jobs, out):
+    """ Compares questplus configurations on simulated observers """
+    with open(settings, 'r', encoding='utf8') as f_in:
+        settings = yaml.safe_load(f_in)
+    configs = load_configs(configs_file, settings)
+    summary = sweep(configs, n_runs=n_runs, n_trials=n_trials, seed=seed,
+                    threshold_range=[float(x) for x in thresholds.split(',')],
+                    slope_range=[float(x) for x in slopes.split(',')],
+                    lapse_rate=lapse_rate, tolerance=tolerance, n_timed=n_timed,
+                    cache_dir=settings['staircase']['cache_dir'], n_jobs=n_jobs)
+    print(summary.round(3).to_string(index=False))
+    if out is not None:
+        summary.to_csv(out, sep='\t', index=False, na_rep='NA')
+
+
+if __name__ == '__main__':
+    main_api()
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from analysis import LogIndex, read_trials
+from eventlog import format_events
+
+
+def write_events_tsv(fn):
+    """ Writes a run of three trials as exptools2 does, two of them answered """
+    global_log = pd.DataFrame({
+        'trial_nr': [0, 0, 0, 1, 1, 1, 1, 2],
+        'onset': [0.0, 1.0, 1.5, 3.0, 4.0, 4.4, 4.6, 6.0],
+        'event_type': ['fix', 'response', 'response', 'fix', 'pulse', 'response', 'response', 'fix'],
+        'phase': [0, 3, 3, 0, 1, 3, 3, 0],
+        'response': [np.nan, '1', '2', np.nan, 't', 'space', '4', np.nan],
+        'nr_frames': [60, np.nan, np.nan, 60, np.nan, np.nan, np.nan, 60],
+        'staircase_value': [2.0, 2.0, 2.0, 2.4, 2.4, 2.4, 2.4, 2.6],
+        'response_correct': [np.nan, 1, 0, np.nan, np.nan, np.nan, 0, np.nan],
+        'color': ['red'] * 3 + ['green'] * 4 + ['red']})
+    format_events(global_log, exp_start=10.0, t_stop=7.0, nr_frames=30).to_csv(
+        fn, sep='\t', na_rep='NA')
+
+
+def test_read_trials_from_exptools_tsv(tmp_path):
+    fn = str(tmp_path / 'sub-01_ses-01_task-test_run-01_events.tsv')
+    write_events_tsv(fn)
+    trials = read_trials(fn)
+
+    # the first answer of every trial, space presses skipped
+    assert trials['trial_nr'].tolist() == [0, 1]
+    assert trials['response_correct'].tolist() == [1, 0]
+    np.testing.assert_allclose(trials['staircase_value'], [2.0, 2.4])
+    assert trials['color'].tolist() == ['red', 'green']
+
+
+def test_index_scans_tsv_logs(tmp_path):
+    write_events_tsv(str(tmp_path / 'sub-02_ses-01_task-test_run-03_events.tsv'))
+    index = LogIndex(str(tmp_path))
+    assert index.scan() == ['sub-02_ses-01_task-test_run-03']
+    assert index.scan() == []
+
+    trials = index.trials()
+    assert len(trials) == 2
+    assert (trials['sub'] == 2).all() and (trials['run'] == 3).all()
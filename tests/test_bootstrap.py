@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bootstrap import bootstrap_group, bootstrap_thresholds
+from psychometric import weibull
+
+QUEST_PLUS_S = {'thresholdVals': np.linspace(0.5, 6, 23).tolist(),
+                'slopeVals': [1.5, 3.0, 5.0],
+                'lowerAsymptoteVals': [0.5],
+                'lapseRateVals': [0.01, 0.05]}
+
+
+def simulated_trials(seed=0, n_trials=120):
+    """ Two runs of two colors, answered by a Weibull observer with threshold 2 """
+    rng = np.random.default_rng(seed)
+    trials = []
+    for run in [1, 2]:
+        for color in ['red', 'green']:
+            staircase_value = rng.choice([1.0, 1.5, 2.0, 3.0, 4.0], size=n_trials)
+            correct = rng.random(n_trials) < weibull(staircase_value, 2.0, 3.0, lapse_rate=0.02)
+            trials.append(pd.DataFrame({'sub': 1, 'ses': 1, 'task': 'test', 'run': run, 'color': color,
+                                        'staircase_value': staircase_value,
+                                        'response_correct': correct.astype(float)}))
+    return pd.concat(trials, ignore_index=True)
+
+
+def test_group_intervals_reproduce_for_a_seed():
+    trials = simulated_trials().iloc[:120]
+    args = (trials['staircase_value'].to_numpy(), trials['response_correct'].to_numpy(), QUEST_PLUS_S)
+    first = bootstrap_group(np.random.SeedSequence(5), *args, n_boot=300, chunk_size=64)
+    again = bootstrap_group(np.random.SeedSequence(5), *args, n_boot=300, chunk_size=64)
+    other = bootstrap_group(np.random.SeedSequence(6), *args, n_boot=300, chunk_size=64)
+    assert first == again
+    assert first['threshold_lo'] != other['threshold_lo'] or first['threshold_hi'] != other['threshold_hi']
+    assert first['threshold'] == other['threshold']
+
+    assert first['n_trials'] == 120
+    assert first['threshold_lo'] < first['threshold'] < first['threshold_hi']
+    assert first['threshold_sd'] > 0
+
+
+def test_intervals_do_not_depend_on_n_jobs():
+    trials = simulated_trials()
+    intervals = [bootstrap_thresholds(trials, QUEST_PLUS_S, n_boot=200, seed=1, n_jobs=n_jobs, chunk_size=64)
+                 for n_jobs in [1, 2]]
+    pd.testing.assert_frame_equal(intervals[0], intervals[1])
+    assert len(intervals[0]) == 4
+    assert intervals[0][['run', 'color']].values.tolist() == [[1, 'green'], [1, 'red'], [2, 'green'], [2, 'red']]
+    # all groups come from the same observer
+    assert intervals[0]['threshold'].to_numpy() == pytest.approx(2.0, abs=0.75)
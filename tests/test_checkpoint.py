@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from checkpoint import StaircaseCheckpoint, checkpoint_prefix
+from prunedquest import PrunedQuestPlusHandler
+from staircase import CachedQuestPlusHandler, StaircaseWorker
+from test_staircase import QUEST_PLUS_S
+
+
+def make_handler(engine, tmp_path):
+    if engine == 'questplus':
+        return CachedQuestPlusHandler(nTrials=40, cache_dir=str(tmp_path / 'qp_cache'), **QUEST_PLUS_S)
+    return PrunedQuestPlusHandler(nTrials=40, **QUEST_PLUS_S)
+
+
+def make_checkpoint(handler, tmp_path):
+    return StaircaseCheckpoint(checkpoint_prefix(str(tmp_path), 1, 1, 'test', 1),
+                               posterior_shape=handler.posterior_shape,
+                               response_vals=QUEST_PLUS_S['responseVals'],
+                               settings_key=handler.cache_key, capacity=2)
+
+
+@pytest.mark.parametrize('engine', ['questplus', 'pruned'])
+def test_round_trip_through_set_state(engine, tmp_path):
+    handler = make_handler(engine, tmp_path)
+    checkpoint = make_checkpoint(handler, tmp_path)
+    checkpoint.create()
+    worker = StaircaseWorker(handler, deadline=10.0, checkpoint=checkpoint)
+
+    # start trials and unanswered trials also draw an intensity
+    shown, answered = [worker.next(), worker.next()], []
+    rng = np.random.default_rng(0)
+    for trial in range(8):
+        shown.append(worker.next())
+        if trial % 3 == 2:
+            continue
+        response = bool(rng.random() < 0.7)
+        answered.append((shown[-1], response))
+        worker.add_response(response)
+    worker.shutdown()
+
+    restored = make_handler(engine, tmp_path)
+    reopened = make_checkpoint(restored, tmp_path)
+    reopened.open()
+    state = reopened.read()
+    assert list(zip(state['intensities'], state['responses'])) == answered
+
+    restored.set_state(**state)
+    np.testing.assert_allclose(restored.get_state()['posterior'], handler.get_state()['posterior'])
+    assert restored.get_state()['intensities'] == [i for i, _ in answered]
+    # both go on with the same intensity
+    assert restored.next() == handler.next()
+
+
+def test_create_does_not_overwrite(tmp_path):
+    handler = make_handler('pruned', tmp_path)
+    checkpoint = make_checkpoint(handler, tmp_path)
+    checkpoint.create()
+    checkpoint.write(**{'posterior': handler.posterior_values(), 'intensities': [2.0], 'responses': [True]})
+
+    with pytest.raises(FileExistsError):
+        make_checkpoint(handler, tmp_path).create()
+    assert checkpoint.read()['responses'] == [True]
+    make_checkpoint(handler, tmp_path).create(overwrite=True)
+    again = make_checkpoint(handler, tmp_path)
+    again.open()
+    assert again.read() is None
+
+
+def test_every_run_has_its_own_checkpoint(tmp_path):
+    handler = make_handler('pruned', tmp_path)
+    first = make_checkpoint(handler, tmp_path)
+    first.create()
+    worker = StaircaseWorker(handler, deadline=10.0, checkpoint=first)
+    worker.next()
+    worker.add_response(True)
+
+    # the next run of the session, e.g. a second launch of main.py
+    second = StaircaseCheckpoint(checkpoint_prefix(str(tmp_path), 1, 1, 'test', 2),
+                                 posterior_shape=handler.posterior_shape,
+                                 response_vals=QUEST_PLUS_S['responseVals'],
+                                 settings_key=handler.cache_key, capacity=2)
+    assert second.prefix != first.prefix
+    second.create()
+    worker.set_checkpoint(second)
+    worker.next()
+    worker.add_response(False)
+    worker.shutdown()
+
+    assert first.read()['responses'] == [True]
+    # the staircase goes on, so does its state in the new checkpoint
+    assert second.read()['responses'] == [True, False]
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+# imported as a module: pytest would collect design.test_run_orientations
+import design
+
+
+def read_designs(out_dir):
+    designs = {}
+    for root, _, fns in os.walk(out_dir):
+        for fn in fns:
+            with open(os.path.join(root, fn), 'r', encoding='utf8') as f_in:
+                designs[os.path.relpath(os.path.join(root, fn), out_dir)] = f_in.read()
+    return designs
+
+
+def test_designs_do_not_depend_on_n_jobs(tmp_path):
+    runner = CliRunner()
+    designs = []
+    for n_jobs in [1, 3]:
+        out_dir = str(tmp_path / f'jobs-{n_jobs}')
+        result = runner.invoke(design.main_api, ['--subs', '1-2', '--n_train_runs', '1', '--n_test_runs', '2',
+                                                 '--seed', '7', '--n_jobs', str(n_jobs), '--out_dir', out_dir])
+        assert result.exit_code == 0, result.output
+        designs.append(read_designs(out_dir))
+
+    assert len(designs[0]) == 2 * 3
+    assert designs[0] == designs[1]
+    assert os.path.join('sub-02', 'sub-02_task-test_run-02.tsv') in designs[0]
+
+
+def test_every_run_has_its_own_seed(tmp_path):
+    kwargs = {'kappas': {n: 1.0 for n in range(2, 6)}}
+    fns = [design.write_run_design(1, 'test', run_id, str(tmp_path / str(i)), seed=0, test_kwargs=kwargs)
+           for i, run_id in enumerate([1, 1, 2])]
+    dfs = [pd.read_csv(fn, sep='\t', index_col=0, na_values='NA') for fn in fns]
+    pd.testing.assert_frame_equal(dfs[0], dfs[1])
+    assert not np.allclose(dfs[0]['grating_phase'], dfs[2]['grating_phase'])
+
+
+def test_train_run_orientations():
+    df = design.train_run_orientations(np.random.default_rng(0))
+    assert len(df) == 90
+    empty = df['color'] == 'black'
+    assert empty.sum() == 10
+    assert df.loc[empty, 'radians'].isna().all()
+    assert (df.loc[empty, 'grating_contrast_multiplier'] == 0).all()
+    # every orientation of the circle exactly once
+    np.testing.assert_allclose(np.sort(df.loc[~empty, 'radians']),
+                               np.linspace(-np.pi, np.pi, 80, endpoint=False))
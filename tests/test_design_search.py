@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from design_search import DEFAULT_WEIGHTS, sample_test_designs, score_designs, search_test_design
+
+KAPPAS = {n: 1.0 + n for n in range(2, 6)}
+
+
+def test_sampled_designs():
+    designs = sample_test_designs(np.random.default_rng(0), 500, KAPPAS)
+    for col in ['block', 'block_mean', 'block_kappa', 'radians', 'color']:
+        assert designs[col].shape == (500, 90)
+    assert designs['empty_trials'].shape == (500, 10)
+
+    color = designs['color']
+    np.testing.assert_array_equal((color == 0).sum(axis=1), 10)
+    np.testing.assert_array_equal((color == 1).sum(axis=1), 40)
+    np.testing.assert_array_equal((color == 2).sum(axis=1), 40)
+
+    # the empty trials are where the black trials are, near their even spacing
+    empty = np.sort(np.argwhere(color == 0)[:, 1].reshape(500, 10), axis=1)
+    np.testing.assert_array_equal(designs['empty_trials'], empty)
+    assert np.all(np.diff(designs['empty_trials'], axis=1) > 0)
+    for col in ['block_mean', 'block_kappa', 'radians']:
+        assert np.isnan(designs[col][color == 0]).all()
+        assert not np.isnan(designs[col][color > 0]).any()
+    assert (designs['block'][color == 0] == 0).all()
+
+    # the kappa of a block is that of its color's number of blocks
+    for c in [1, 2]:
+        n_blocks = np.where(color == c, designs['block'], 0).max(axis=1)
+        kappas = np.array([KAPPAS[n] for n in n_blocks])
+        np.testing.assert_array_equal(np.nanmax(np.where(color == c, designs['block_kappa'], np.nan), axis=1), kappas)
+        assert np.all((n_blocks >= 2) & (n_blocks < 6))
+
+
+def test_scores():
+    designs = sample_test_designs(np.random.default_rng(1), 200, KAPPAS)
+    total, scores = score_designs(designs)
+    assert set(scores) == set(DEFAULT_WEIGHTS)
+    assert np.all((scores['coverage'] > 0) & (scores['coverage'] <= 1))
+    assert np.all((scores['color_balance'] >= 0) & (scores['color_balance'] <= 1))
+    np.testing.assert_allclose(total, sum(scores.values()))
+
+
+def test_search_does_not_depend_on_n_jobs():
+    results = [search_test_design(np.random.SeedSequence([3, 1]), 1000, KAPPAS,
+                                  chunk_size=300, n_jobs=n_jobs)
+               for n_jobs in [1, 2]]
+    (df, score, scores), (df_2, score_2, scores_2) = results
+    assert score == score_2 and scores == scores_2
+    assert df.equals(df_2)
+    assert len(df) == 90 and (df['color'] == 'black').sum() == 10
+
+    # the best of more candidates is at least as good
+    _, best_score, _ = search_test_design(np.random.SeedSequence([3, 1]), 3000, KAPPAS, chunk_size=300)
+    assert best_score >= score
+    assert score == pytest.approx(sum(scores.values()))
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from eventlog import EVENT_SCHEMA, ColumnarEventLog, format_events, read_events, to_events_tsv
+
+
+def test_round_trip_keeps_kinds_from_schema(tmp_path):
+    fn = str(tmp_path / 'sub-01_events.h5')
+    schema = {**EVENT_SCHEMA, 'response_key': 'text', 'response_time': 'numeric'}
+    log = ColumnarEventLog(fn, constants={'stim_duration': 0.05}, run_info={'sub': 1}, schema=schema)
+    log.append(pd.DataFrame({'trial_nr': [2, 2], 'onset': [1.0, 1.5],
+                             'event_type': ['fix', 'response'], 'phase': [0, 3],
+                             'response': [np.nan, '1'],
+                             'response_key': [np.nan, '1'], 'response_time': [np.nan, 0.4]}))
+    # a column that is not in the schema, holding numbers and then text
+    log.append(pd.DataFrame({'trial_nr': [3], 'onset': [2.0], 'event_type': ['fix'],
+                             'phase': [0], 'extra': [1.5]}))
+    log.append(pd.DataFrame({'trial_nr': [3], 'onset': [2.5], 'event_type': ['fix'],
+                             'phase': [0], 'extra': ['a']}))
+    log.close()
+
+    events = read_events(fn)
+    assert list(events['response_key'].astype(object)[1:2]) == ['1']
+    assert list(events['extra'].astype(object)[2:]) == ['1.5', 'a']
+    np.testing.assert_array_equal(events['response_time'], [np.nan, 0.4, np.nan, np.nan])
+
+    tsv = pd.read_csv(to_events_tsv(fn), sep='\t', index_col=0, dtype=str, keep_default_na=False)
+    assert tsv['response_key'].tolist() == ['', '1', '', '']
+    assert tsv['response'].tolist() == ['', '1', '', '']
+
+
+def test_format_events_as_exptools_on_close():
+    global_log = pd.DataFrame({'trial_nr': [0, 0, 0, 1],
+                               'onset': [0.0, 1.0, 1.2, 2.0],
+                               'event_type': ['fix', 'stim', 'response', 'fix'],
+                               'phase': [0, 1, 1, 0],
+                               'response': [np.nan, np.nan, 'a', np.nan],
+                               'nr_frames': [0, 60, np.nan, 60]})
+    events = format_events(global_log, exp_start=100.0, t_stop=3.0, nr_frames=30)
+
+    assert list(events.index) == [0, 0, 0, 1]
+    np.testing.assert_allclose(events['onset_abs'], [100.0, 101.0, 101.2, 102.0])
+    np.testing.assert_allclose(events['duration'], [1.0, 1.0, np.nan, 1.0])
+    np.testing.assert_allclose(events['nr_frames'], [60, 60, np.nan, 30])
+
+
+def test_converted_tsv_matches_the_session_tsv(tmp_path):
+    global_log = pd.DataFrame({'trial_nr': [0, 0, 0, 1],
+                               'onset': [0.0, 1.0, 1.2, 2.0],
+                               'event_type': ['fix', 'stim', 'response', 'fix'],
+                               'phase': [0, 1, 1, 0],
+                               'response': [np.nan, np.nan, 'a', np.nan],
+                               'nr_frames': [0, 60, np.nan, 60]})
+    constants = {'stim_duration': 0.05, 'color_space': 'rgb'}
+    fn = str(tmp_path / 'sub-01_events.h5')
+    log = ColumnarEventLog(fn, constants=constants, run_info={'sub': 1})
+    log.append(global_log)
+    log.close(exp_start=100.0, t_stop=3.0, nr_frames=30)
+
+    # as the session writes it, with the constants the trials left out
+    session_fn = str(tmp_path / 'session_events.tsv')
+    format_events(global_log, exp_start=100.0, t_stop=3.0, nr_frames=30,
+                  constants=constants).to_csv(session_fn, sep='\t', index=True)
+    with open(session_fn) as f_in:
+        session_tsv = f_in.read()
+    with open(to_events_tsv(fn)) as f_in:
+        converted_tsv = f_in.read()
+    assert converted_tsv == session_tsv
+
+    tsv = pd.read_csv(fn.replace('.h5', '.tsv'), sep='\t', dtype=str, keep_default_na=False)
+    assert list(tsv.columns[:1]) == ['trial_nr']
+    assert tsv['trial_nr'].tolist() == ['0', '0', '0', '1']
+    assert tsv['phase'].tolist() == ['0', '1', '1', '0']
+    assert tsv['onset_abs'].tolist() == ['100.0', '101.0', '101.2', '102.0']
+    assert tsv['stim_duration'].tolist() == ['0.05'] * 4
+
+    # the session's own tsv is not replaced unless asked
+    with pytest.raises(FileExistsError):
+        to_events_tsv(fn)
+    to_events_tsv(fn, overwrite=True)
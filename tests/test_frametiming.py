@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from psychopy import core, logging
+
+from frametiming import FlipRecorder, read_flips, summarize
+
+
+class Window:
+    """ Flips 10 ms in the past, on the logging clock, as psychopy does """
+
+    def flip(self):
+        return logging.defaultClock.getTime() - 0.01
+
+
+def test_records_flip_timestamp_on_session_clock(tmp_path):
+    session = SimpleNamespace(clock=core.Clock(), current_trial=None)
+    win = Window()
+    recorder = FlipRecorder(session, str(tmp_path / 'flips.h5'), expected_interval=1 / 60)
+    recorder.install(win)
+    core.wait(0.05)
+    win.flip()
+    t_after = session.clock.getTime()
+    t = recorder.buffer[0]['t']
+    assert np.isclose(t, t_after - 0.01, atol=0.002)
+
+
+class Trial:
+
+    def __init__(self, trial_nr, phase=0):
+        self.trial_nr, self.phase = trial_nr, phase
+        self.phase_names = ['stim', 'iti']
+
+
+def test_long_gaps_count_dropped_frames(tmp_path):
+    session = SimpleNamespace(clock=core.Clock(), current_trial=Trial(0))
+    fn = str(tmp_path / 'flips.h5')
+    # a small buffer, so that it wraps and flushes by itself
+    recorder = FlipRecorder(session, fn, expected_interval=1 / 60, buffer_size=8)
+    frames = list(range(10)) + [15, 16, 17]
+    for frame in frames:
+        recorder.record(frame / 60)
+    session.current_trial = Trial(1, phase=1)
+    # a ten minute freeze
+    t_freeze = 17 / 60 + 600
+    for frame in range(3):
+        recorder.record(t_freeze + frame / 60)
+    recorder.close()
+
+    flips = read_flips(fn)
+    assert len(flips) == len(frames) + 3
+    np.testing.assert_allclose(flips['t'].iloc[:len(frames)], np.array(frames) / 60)
+    assert flips['late'].sum() == 2
+    assert flips.loc[flips['late'], 'n_dropped'].tolist() == [5, 36000 - 1]
+    assert flips['label'].tolist() == ['Trial.stim'] * len(frames) + ['Trial.iti'] * 3
+
+    summary = summarize(flips)
+    assert summary.loc['Trial.stim', 'n_flips'] == len(frames) - 1
+    assert summary.loc['Trial.stim', 'n_dropped'] == 5
+    assert summary.loc['Trial.iti', 'n_dropped'] == 36000 - 1
+    assert summary.loc['Trial.iti', 'max_ms'] == pytest.approx(600_000, rel=1e-6)
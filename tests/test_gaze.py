@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from gaze import GAZE_DTYPE, GazeStream, PylinkSampleSource
+
+
+def samples_at(t):
+    samples = np.zeros(len(t), dtype=GAZE_DTYPE)
+    samples['t'] = t
+    return samples
+
+
+def test_window_after_the_buffer_wrapped():
+    stream = GazeStream(source=None, buffer_size=100)
+    for start in range(0, 250, 10):
+        stream.push(samples_at(np.arange(start, start + 10) / 1000))
+    window = stream.window(0.180, 0.200)
+    np.testing.assert_allclose(window['t'], np.arange(180, 200) / 1000)
+    # older samples were overwritten
+    assert len(stream.window(0.0, 0.150)) == 0
+    assert stream.window(0.0, 1.0)['t'][0] == 0.150
+
+
+def test_pylink_source_drains_the_link_queue():
+    pylink = pytest.importorskip('pylink')
+
+    class Eye:
+        def __init__(self, x):
+            self.x = x
+
+        def getGaze(self):
+            return self.x, 540.0
+
+        def getPupilSize(self):
+            return 1000.0
+
+    class Tracker:
+        def __init__(self, n):
+            self.queue = [(pylink.SAMPLE_TYPE, SimpleNamespace(getTime=lambda t=t: t,
+                                                             getLeftEye=lambda: Eye(960.0)))
+                          for t in range(n)]
+            self.current = None
+
+        def getNextData(self):
+            if not self.queue:
+                return 0
+            data_type, self.current = self.queue.pop(0)
+            return data_type
+
+        def getFloatData(self):
+            return self.current
+
+        def trackerTime(self):
+            return 10.0
+
+    source = PylinkSampleSource(Tracker(10), clock=SimpleNamespace(getTime=lambda: 1.0),
+                                monitor=None, win_size=(1920, 1080))
+    source.pix2deg = lambda pix, monitor: pix
+    samples = source.get_samples()
+    assert len(samples) == 10
+    np.testing.assert_allclose(samples['t'], 1.0 - (10.0 - np.arange(10)) / 1000)
+    assert len(source.get_samples()) == 0
@@ -0,0 +1,73 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from psychopy import core
+
+from inputs import InputPoller, response_table
+
+EXP_S = {'ccw_buttons': ['a', 's', 'd', 'f'],
+         'cw_buttons': [';', 'l', 'k', 'j']}
+
+
+class Keyboard:
+    """ Hands out presses queued by the test, timed on psychopy's monotonic clock """
+
+    def __init__(self, backend='ptb'):
+        self.backend = backend
+        self.presses = []
+        self.lock = threading.Lock()
+
+    def getBackend(self):
+        return self.backend
+
+    def clearEvents(self):
+        with self.lock:
+            self.presses = []
+
+    def press(self, name):
+        with self.lock:
+            self.presses.append(SimpleNamespace(name=name, rt=core.monotonicClock.getTime()))
+
+    def getKeys(self, keyList, waitRelease, clear):
+        with self.lock:
+            keys = [key for key in self.presses if key.name in keyList]
+            self.presses = []
+        return keys
+
+
+def test_response_table():
+    table = response_table(EXP_S)
+    assert len(table) == 8
+    assert table[';'] == (1, 0) and table['j'] == (1, 3)
+    assert table['a'] == (-1, 0) and table['f'] == (-1, 3)
+
+
+def test_only_the_ptb_backend_is_polled():
+    with pytest.raises(RuntimeError, match='psychtoolbox'):
+        InputPoller(response_table(EXP_S), keyboard=Keyboard(backend='iohub'))
+
+
+def test_responses_are_timed_on_the_session_clock():
+    keyboard = Keyboard()
+    poller = InputPoller(response_table(EXP_S), keyboard=keyboard)
+    session_clock = core.Clock()
+    core.wait(0.05)
+    poller.start()
+
+    t_presses = []
+    for key in ['k', 'x', 'a']:
+        keyboard.press(key)
+        t_presses.append(session_clock.getTime())
+        core.wait(0.02)
+    core.wait(0.02)
+    poller.stop()
+
+    responses = poller.get_responses(session_clock)
+    # keys outside the table are not put on the queue
+    assert [response[0] for response in responses] == ['k', 'a']
+    assert [response[2:] for response in responses] == [(1, 2), (-1, 0)]
+    for (key, t, sign, confidence), t_press in zip(responses, [t_presses[0], t_presses[2]]):
+        assert t == pytest.approx(t_press, abs=2e-3)
+    # the queue is emptied
+    assert poller.get_responses(session_clock) == []
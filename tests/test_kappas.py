@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from kappas import optimal_kappas, overlap_vm, solve_kappa
+
+# as hardcoded in exp_designs/exp_design.ipynb, for an overlap of 2.2
+NOTEBOOK_KAPPAS = {2: 0.535578, 3: 0.752727, 4: 1.718991, 5: 3.661899, 6: 6.167782,
+                   7: 9.352917, 8: 13.278907, 9: 17.979412, 10: 23.484812}
+
+
+def test_kappas_match_the_notebook():
+    kappas = {n: solve_kappa(n, overlap=2.2) for n in NOTEBOOK_KAPPAS}
+    # the notebook picked the closest point of a 10000-point kappa grid
+    grid_step = 10 ** (2 / 10000) - 1
+    for n, kappa in NOTEBOOK_KAPPAS.items():
+        assert kappas[n] == pytest.approx(kappa, rel=grid_step)
+        assert overlap_vm(n, kappas[n]) == pytest.approx(2.2)
+
+    grid = np.logspace(-0.5, 1.5, 10000)
+    for n, kappa in NOTEBOOK_KAPPAS.items():
+        closest = grid[np.argmin(np.abs(overlap_vm(n, grid) - 2.2))]
+        assert closest == pytest.approx(kappa, abs=1e-6)
+
+
+def test_table_is_reused(tmp_path):
+    table_fn = str(tmp_path / 'kappas.tsv')
+    kappas = optimal_kappas([2, 3], table_fn=table_fn)
+    with open(table_fn, 'a') as f_out:
+        # a stored kappa is read back instead of solved again
+        f_out.write('4\t2.2\t100\t1.5\n')
+    assert optimal_kappas([2, 3, 4], table_fn=table_fn) == {**kappas, 4: 1.5}
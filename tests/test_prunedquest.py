@@ -0,0 +1,39 @@
+import numpy as np
+
+from prunedquest import PrunedQuestPlusHandler
+from psychometric import weibull
+
+FINE_GRID = list(np.round(np.arange(0.1, 8.05, 0.1), 6))
+
+
+def test_live_points_stay_within_budget():
+    handler = PrunedQuestPlusHandler(nTrials=30, intensityVals=FINE_GRID, thresholdVals=FINE_GRID,
+                                     slopeVals=[1.0, 2.0, 3.0, 4.0], lowerAsymptoteVals=[0.5],
+                                     lapseRateVals=[0.01, 0.05], responseVals=[True, False],
+                                     stimScale='linear', max_particles=500, max_candidates=16)
+    assert len(handler.live) == len(FINE_GRID) * 8
+
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        intensity = handler.next()
+        handler.addResponse(bool(rng.random() < weibull(intensity, 3.0, 3.0)))
+        assert len(handler.live) <= 500
+        assert len(np.unique(handler.live)) == len(handler.live)
+        assert np.isclose(handler.weights.sum(), 1)
+    assert abs(handler.paramEstimate['threshold'] - 3.0) < 1.0
+
+
+def test_thinning_keeps_the_likely_points_and_the_mean():
+    handler = PrunedQuestPlusHandler(nTrials=1, intensityVals=FINE_GRID, thresholdVals=FINE_GRID,
+                                     slopeVals=[2.0], lowerAsymptoteVals=[0.5], lapseRateVals=[0.01],
+                                     stimScale='linear', max_particles=20)
+    weights = np.random.default_rng(1).gamma(0.3, size=len(handler.weights))
+    handler.weights = weights / weights.sum()
+
+    idx, thinned = handler._thin()
+    assert len(idx) <= 20 and np.isclose(thinned.sum(), 1)
+    # the most likely point keeps its weight
+    best = np.argmax(handler.weights)
+    assert best in idx and np.isclose(thinned[idx == best], handler.weights[best])
+    thresholds = handler.live_params[0]
+    assert abs(thinned @ thresholds[idx] - handler.weights @ thresholds) < 0.5
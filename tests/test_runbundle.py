@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from runbundle import load_run_bundle, record_to_dict
+
+SETTINGS = {'experiment': {'stim_duration': 0.05}, 'stim_position_info': {'x_offset': 0}}
+
+
+def test_missing_values_survive_the_bundle(tmp_path):
+    tsv_path = str(tmp_path / 'run-01.tsv')
+    pd.DataFrame({'color': ['red', None, 'black'],
+                  'orientation': [10.0, np.nan, 30.0],
+                  'block': [1, 1, 2]}).to_csv(tsv_path, sep='\t', na_rep='NA')
+
+    records, constants = load_run_bundle(tsv_path, SETTINGS, str(tmp_path / 'bundles'))
+    rows = [record_to_dict(record) for record in records]
+
+    assert [row['color'] for row in rows[::2]] == ['red', 'black']
+    assert np.isnan(rows[1]['color']) and np.isnan(rows[1]['orientation'])
+    assert [row['block'] for row in rows] == [1, 1, 2]
+    assert constants == {'stim_duration': 0.05, 'x_offset': 0}
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from schedule import compile_stim_plan, fill_orientations, n_frames
+
+
+@pytest.mark.parametrize('refresh_rate', [60.0, 120.0, 144.0])
+def test_plan_counts_frames(refresh_rate):
+    plan = compile_stim_plan(stim_duration=0.25, interstim_interval=0.5, refresh_rate=refresh_rate)
+    n_on, n_off = n_frames(0.25, refresh_rate), n_frames(0.5, refresh_rate)
+    assert len(plan) == 2 * n_on + n_off
+    np.testing.assert_array_equal(plan['frame'], np.arange(len(plan)))
+    np.testing.assert_array_equal(np.bincount(plan['interval']), [n_off, n_on, n_on])
+    np.testing.assert_array_equal(plan['grating_on'], plan['interval'] > 0)
+    # the intervals are contiguous, in order
+    assert np.all(np.diff(plan['interval'][plan['grating_on']]) >= 0)
+    assert np.isnan(plan['orientation']).all()
+
+
+def test_durations_round_to_the_closest_frame():
+    assert n_frames(0.25, 60.0) == 15
+    assert n_frames(0.259, 60.0) == 16
+    assert n_frames(-0.1, 60.0) == 0
+    with pytest.raises(ValueError, match='half a frame'):
+        compile_stim_plan(stim_duration=0.005, interstim_interval=0.5, refresh_rate=60.0)
+
+
+def test_fill_orientations():
+    plan = compile_stim_plan(stim_duration=0.1, interstim_interval=0.1, refresh_rate=60.0)
+    filled = fill_orientations(plan, 30.0, -12.5)
+    np.testing.assert_array_equal(filled['orientation'][filled['interval'] == 1], 30.0)
+    np.testing.assert_array_equal(filled['orientation'][filled['interval'] == 2], -12.5)
+    assert np.isnan(filled['orientation'][filled['interval'] == 0]).all()
+    # the compiled plan is reused for the next trial
+    assert np.isnan(plan['orientation']).all()
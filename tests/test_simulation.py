@@ -0,0 +1,93 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from psychometric import weibull
+from simulation import (ScannerTriggers, SimulatedKeyboard, SimulatedObserver, VirtualClock,
+                        VirtualTime, simulate_run)
+
+EXP_S = {'ccw_buttons': ['a', 's', 'd', 'f'],
+         'cw_buttons': [';', 'l', 'k', 'j']}
+
+
+class ExpOriMapperTrial:
+    """ The parts of a trial the observer looks at """
+
+    def __init__(self, trial_nr, staircase_value, sign):
+        self.trial_nr, self.phase = trial_nr, 3
+        self.parameters = {'staircase_value': staircase_value, 'correct_response_sign': sign}
+
+
+def answer(observer, n_trials, staircase_value):
+    """ Returns (correct, key, rt) of n_trials answered by the observer """
+    session = SimpleNamespace(settings={'experiment': EXP_S}, current_trial=None)
+    answers = []
+    for trial_nr in range(n_trials):
+        sign = 1 if trial_nr % 2 else -1
+        session.current_trial = ExpOriMapperTrial(trial_nr, staircase_value, sign)
+        assert observer.poll(session, 10.0 * trial_nr) == []
+        # asked again in the same trial, the observer does not answer twice
+        observer.poll(session, 10.0 * trial_nr + 0.01)
+        (key, t), = observer.poll(session, 10.0 * trial_nr + 9.0)
+        correct = key in (EXP_S['cw_buttons'] if sign == 1 else EXP_S['ccw_buttons'])
+        answers.append((correct, key, t - 10.0 * trial_nr))
+    return answers
+
+
+def test_observer_is_reproducible():
+    first = answer(SimulatedObserver(seed=np.random.SeedSequence([0, 1])), 50, 2.0)
+    again = answer(SimulatedObserver(seed=np.random.SeedSequence([0, 1])), 50, 2.0)
+    other = answer(SimulatedObserver(seed=np.random.SeedSequence([0, 2])), 50, 2.0)
+    assert first == again
+    assert first != other
+
+
+@pytest.mark.parametrize('staircase_value', [1.0, 2.0, 4.0])
+def test_observer_follows_its_psychometric_function(staircase_value):
+    observer = SimulatedObserver(threshold=2.0, slope=3.0, seed=0)
+    answers = answer(observer, 4000, staircase_value)
+    p_correct = weibull(staircase_value, **observer.params)
+    correct = np.mean([correct for correct, _, _ in answers])
+    assert correct == pytest.approx(p_correct, abs=4 * np.sqrt(p_correct * (1 - p_correct) / 4000) + 1e-3)
+    rts = np.array([rt for _, _, rt in answers])
+    assert np.median(rts) == pytest.approx(observer.rt_median, rel=0.05)
+
+
+def test_keyboard_times_events_on_a_clock():
+    vtime = VirtualTime()
+    VirtualClock.time, clock_time = vtime, VirtualClock.time
+    try:
+        clock = VirtualClock()
+        vtime.advance(3.0)
+        clock.reset()
+        session = SimpleNamespace(current_trial=ExpOriMapperTrial(0, 1.0, 1))
+        keyboard = SimulatedKeyboard(session, vtime, [ScannerTriggers(tr=1.5, delay=0.5)])
+        # the scanner starts with the trial that waits for it
+        assert keyboard.getKeys(timeStamped=clock) == []
+
+        class DummyWaiterTrial:
+            pass
+        session.current_trial = DummyWaiterTrial()
+        assert keyboard.getKeys() == []
+        vtime.advance(2.5)
+        # triggers at 0.5 and 2.0 s after the start, on a clock reset at 3 s
+        keys = keyboard.getKeys(keyList=['t'], timeStamped=clock)
+        assert [key for key, _ in keys] == ['t', 't']
+        np.testing.assert_allclose([t for _, t in keys], [0.5, 2.0])
+        assert keyboard.getKeys(keyList=['space']) == []
+    finally:
+        VirtualClock.time = clock_time
+
+
+def test_simulated_runs_are_reproducible(tmp_path):
+    pytest.importorskip('exptools2')
+    pytest.importorskip('psychopy.visual')
+
+    settings_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'defaults.yml')
+    summaries = [simulate_run(1, 1, task='train', settings_file=settings_file,
+                              output_dir=str(tmp_path / str(i)), seed=3)
+                 for i in range(2)]
+    for key in ['virtual_duration', 'n_flips', 'n_responses', 'p_correct', 'final_intensity']:
+        assert summaries[0][key] == summaries[1][key]
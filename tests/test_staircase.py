@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+import questplus
+import yaml
+
+import staircase
+from prunedquest import PrunedQuestPlusHandler
+from sweep import BatchedQuestPlus
+from staircase import CachedQuestPlusHandler, StaircaseWorker
+
+DEFAULTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'defaults.yml')
+
+QUEST_PLUS_S = {
+    'intensityVals': [0.5, 1.0, 2.0, 4.0],
+    'thresholdVals': [0.5, 1.0, 2.0, 4.0],
+    'slopeVals': [1.0, 3.0],
+    'lowerAsymptoteVals': [0.5],
+    'lapseRateVals': [0.01, 0.05],
+    'responseVals': [True, False],
+    'startIntensity': 2.0,
+    'stimScale': 'linear',
+    'stimSelectionMethod': 'minEntropy',
+}
+
+
+def make_handler(tmp_path, n_trials=20):
+    return CachedQuestPlusHandler(nTrials=n_trials, cache_dir=str(tmp_path), **QUEST_PLUS_S)
+
+
+def test_likelihood_cache_is_mapped_on_second_handler(tmp_path):
+    cold = make_handler(tmp_path)
+    warm = make_handler(tmp_path)
+    assert not cold.cache_hit and warm.cache_hit
+    np.testing.assert_array_equal(cold._qp.likelihoods.values, warm._qp.likelihoods.values)
+
+
+def test_concurrent_misses_write_their_own_temp_files(tmp_path, monkeypatch):
+    # handlers missing the cache at the same time (e.g. sweep workers)
+    # must not write into the same temporary file
+    sources = []
+    replace = os.replace
+    both_writing = threading.Barrier(2, timeout=5)
+
+    def record_replace(src, dst):
+        if src.endswith('.npy'):
+            both_writing.wait()
+        sources.append(src)
+        replace(src, dst)
+    monkeypatch.setattr(staircase.os, 'replace', record_replace)
+    monkeypatch.setattr(staircase.os.path, 'isfile', lambda path: False)
+
+    threads = [threading.Thread(target=make_handler, args=(tmp_path,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(sources) == 4 and len(set(sources)) == 4
+    key = staircase.settings_hash(QUEST_PLUS_S)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f'likelihoods_{key}.json', f'likelihoods_{key}.npy']
+
+
+def test_cache_does_not_leak_into_other_threads(tmp_path):
+    # a handler under construction in one thread must not route the
+    # likelihoods of a QuestPlus created in another thread
+    entered, release = threading.Event(), threading.Event()
+    calls = []
+
+    class Blocking:
+        def _load_likelihoods(self, qp_self, gen_likelihoods):
+            calls.append(qp_self)
+            return gen_likelihoods(qp_self)
+
+    def construct():
+        staircase._constructing.handler = Blocking()
+        entered.set()
+        release.wait(5)
+        staircase._constructing.handler = None
+
+    thread = threading.Thread(target=construct)
+    thread.start()
+    entered.wait(5)
+    try:
+        questplus.QuestPlus(stim_domain={'intensity': [1.0, 2.0]},
+                            param_domain={'threshold': [1.0, 2.0], 'slope': [3.0],
+                                          'lower_asymptote': [0.5], 'lapse_rate': [0.01]},
+                            outcome_domain={'response': ['Correct', 'Incorrect']},
+                            func='weibull', stim_scale='linear')
+    finally:
+        release.set()
+        thread.join()
+    assert calls == []
+
+
+def test_deadline_miss_updates_at_shown_intensity(tmp_path):
+    handler = make_handler(tmp_path)
+    pick = handler.next
+
+    def slow_next():
+        time.sleep(0.05)
+        return pick()
+    handler.next = slow_next
+
+    worker = StaircaseWorker(handler, deadline=0.0)
+    shown = []
+    for _ in range(6):
+        shown.append(worker.next())
+        worker.add_response(True)
+    worker.shutdown()
+
+    assert all(decision['deadline_missed'] for decision in worker.decisions)
+    assert shown == [QUEST_PLUS_S['startIntensity']] * 6
+    assert [s['intensity'] for s in handler._qp.stim_history] == shown
+
+
+def test_engines_construct_with_shipped_prior(tmp_path):
+    with open(DEFAULTS, 'r', encoding='utf8') as f_in:
+        settings = yaml.safe_load(f_in)
+    quest_plus_s = settings['questplus']
+    full = CachedQuestPlusHandler(nTrials=5, cache_dir=str(tmp_path), **quest_plus_s)
+    pruned = PrunedQuestPlusHandler(nTrials=5, **settings['staircase']['pruned'], **quest_plus_s)
+
+    # the single threshold of the prior is the mode of its distribution
+    marginal = full._qp.posterior.sum(['slope', 'lower_asymptote', 'lapse_rate'])
+    assert np.isclose(marginal.threshold.values[int(marginal.argmax('threshold'))],
+                      quest_plus_s['prior']['threshold'])
+    for name, estimate in full.paramEstimate.items():
+        assert np.isclose(pruned.paramEstimate[name], estimate)
+
+
+@pytest.mark.parametrize('engine', ['questplus', 'pruned', 'batched'])
+def test_off_grid_start_intensity_is_rejected(engine, tmp_path):
+    quest_plus_s = {**QUEST_PLUS_S, 'startIntensity': 1.5}
+    with pytest.raises(ValueError, match='nearest are 1, 2'):
+        if engine == 'questplus':
+            CachedQuestPlusHandler(nTrials=5, cache_dir=str(tmp_path), **quest_plus_s)
+        elif engine == 'pruned':
+            PrunedQuestPlusHandler(nTrials=5, **quest_plus_s)
+        else:
+            BatchedQuestPlus(quest_plus_s, 2)
@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('psychopy.visual')
+from stimcache import gamma_pattern  # noqa: E402
+
+
+@pytest.mark.parametrize('size_pix', [(576, 576), (1245, 1245), (1000, 1300)])
+def test_gamma_pattern_has_one_row_per_display_row(size_pix):
+    image = gamma_pattern(size_pix)
+    assert image.shape == (size_pix[1], size_pix[0])
+    # next to the discs, dark and light rows alternate on every single row
+    column = image[:, 1]
+    assert np.all(np.diff(column) != 0)
@@ -0,0 +1,77 @@
+import numpy as np
+
+from stimstate import StimState, UpdateCounter
+
+
+class Stim:
+    """ Records what reaches it, as a psychopy stimulus would rebuild on """
+
+    def __init__(self):
+        self.pushed = []
+        self.ori = 0.0
+
+    def __setattr__(self, name, value):
+        if name != 'pushed':
+            self.pushed.append((name, value))
+        object.__setattr__(self, name, value)
+
+    def setColor(self, color, colorSpace=None):
+        self.pushed.append(('color', color, colorSpace))
+
+    def draw(self):
+        return 'drawn'
+
+
+def test_only_changes_reach_the_stimulus():
+    stim, counter = Stim(), UpdateCounter(capacity=2)
+    stim.pushed.clear()
+    state = StimState(stim, counter)
+
+    for frame in range(5):
+        # the first value always goes through, even if the stimulus has it
+        state.ori = 0.0
+        state.phase = 0.1 * (frame // 2)
+        state.setColor([1, -1, -1])
+        assert state.draw() == 'drawn'
+        counter.end_frame()
+
+    assert [push[:2] for push in stim.pushed if push[0] == 'ori'] == [('ori', 0.0)]
+    assert [push[1] for push in stim.pushed if push[0] == 'phase'] == [0.0, 0.1, 0.2]
+    assert len([push for push in stim.pushed if push[0] == 'color']) == 1
+    # reading goes to the stimulus
+    assert state.phase == stim.phase == 0.2
+
+    summary = counter.summary()
+    assert summary['n_frames'] == 5
+    assert summary['real'] == 5 and summary['redundant'] == 10
+    np.testing.assert_array_equal(counter.real[:5], [3, 0, 1, 0, 1])
+
+
+def test_arrays_are_compared_by_value():
+    stim = Stim()
+    state = StimState(stim)
+    color = [1.0, 0.0, 0.0]
+    state.setColor(color)
+    # changed in place by the caller: still a change
+    color[1] = 0.5
+    state.setColor(color)
+    state.setColor(np.array([1.0, 0.5, 0.0]))
+    state.setColor('red')
+    state.setColor('red')
+    assert len([push for push in stim.pushed if push[0] == 'color']) == 3
+
+
+def test_calls_with_more_arguments_are_never_skipped():
+    stim = Stim()
+    state = StimState(stim)
+    state.setColor('red')
+    state.setColor('red', colorSpace='named')
+    # the wrapper forgot the color, so the next one goes through too
+    state.setColor('red')
+    assert [push[2] for push in stim.pushed if push[0] == 'color'] == [None, 'named', None]
+
+    state.ori = 5.0
+    stim.ori = 10.0
+    state.invalidate('ori')
+    state.ori = 5.0
+    assert stim.ori == 5.0
@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+import pytest
+
+from triggers import SimulatedTriggers, TriggerClock
+
+
+def record(clock, scanner, duration, step=0.01):
+    """ Polls the scanner as the frame loop does and adds every trigger to the clock """
+    scanner.start(0.0)
+    volumes = []
+    for now in np.arange(0, duration, step):
+        for t in scanner.poll(now):
+            volumes.append(clock.add(t))
+    return volumes
+
+
+def test_tr_and_drift_are_estimated():
+    clock = TriggerClock(tr=1.5)
+    clock.arm()
+    scanner = SimulatedTriggers(tr=1.5, delay=1.0, drift=2e-3, jitter=1e-3, seed=0)
+    volumes = record(clock, scanner, 300)
+
+    assert volumes == list(range(len(volumes)))
+    assert clock.tr == pytest.approx(1.5 * (1 + 2e-3), abs=1e-5)
+    assert clock.drift == pytest.approx(2e-3, abs=1e-5)
+    # the next trigger is predicted to within the jitter
+    next_t = scanner.t0 + len(volumes) * scanner.tr
+    assert clock.predict(len(volumes)) == pytest.approx(next_t, abs=3e-3)
+    assert np.abs(clock.triggers()['residual']).max() < 5e-3
+
+
+def test_missed_triggers_skip_volumes():
+    clock = TriggerClock(tr=2.0)
+    clock.arm()
+    volumes = [clock.add(t) for t in [10.0, 12.0, 14.0, 20.0, 22.0]]
+
+    assert volumes == [0, 1, 2, 5, 6]
+    assert clock.last_volume == 6
+    assert clock.tr == pytest.approx(2.0)
+    assert clock.predict(3) == pytest.approx(16.0)
+
+    # with a random share of the triggers lost, every volume keeps its number
+    clock = TriggerClock(tr=1.0)
+    clock.arm()
+    scanner = SimulatedTriggers(tr=1.0, delay=0.5, drift=1e-3, jitter=1e-3, p_drop=0.2, seed=1)
+    scanner.start(0.0)
+    times = scanner.poll(200)
+    volumes = [clock.add(t) for t in times]
+    expected = np.round((np.asarray(times) - times[0]) / scanner.tr).astype(int)
+    assert len(times) < 200 * 0.9
+    np.testing.assert_array_equal(volumes, expected)
+    assert clock.drift == pytest.approx(1e-3, abs=1e-4)
+
+
+def test_double_triggers_are_ignored():
+    clock = TriggerClock(tr=2.0)
+    clock.arm()
+    volumes = [clock.add(t) for t in [10.0, 10.02, 12.0, 12.5, 14.0]]
+
+    assert volumes == [0, None, 1, None, 2]
+    assert clock.n_spurious == 2
+    assert clock.n_triggers == 3
+    assert clock.tr == pytest.approx(2.0)
+
+
+def test_triggers_outside_a_run():
+    clock = TriggerClock(tr=2.0, max_triggers=2)
+    assert clock.add(1.0) is None
+    assert clock.last_volume == -1
+    clock.arm()
+    clock.add(2.0)
+    clock.add(4.0)
+    with pytest.raises(RuntimeError, match='max_triggers'):
+        clock.add(6.0)
+
+    # arming again starts a new run
+    clock.arm()
+    assert clock.add(100.0) == 0
+    assert clock.n_spurious == 0 and clock.tr == 2.0
+
+
+def test_session_warnings_lock_to_volume_triggers(tmp_path, monkeypatch):
+    # drives a whole run headless, with a scanner that misses a trigger
+    pytest.importorskip('exptools2')
+    pytest.importorskip('psychopy.visual')
+    import yaml
+
+    import design
+    import exporimapper
+    from runbundle import load_run_bundle
+    from simulation import ContinueKeys, ScannerTriggers, SimulatedObserver, headless
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, 'defaults.yml'), 'r', encoding='utf8') as f_in:
+        settings = yaml.safe_load(f_in)
+    settings['staircase']['cache_dir'] = str(tmp_path / 'qp_cache')
+    settings['run_bundle']['cache_dir'] = str(tmp_path / 'bundles')
+    settings_file = tmp_path / 'settings.yml'
+    with open(settings_file, 'w', encoding='utf8') as f_out:
+        yaml.safe_dump(settings, f_out)
+
+    design_fn = tmp_path / 'design.tsv'
+    design.train_run_orientations(np.random.default_rng(0), total_n_trials=8, n_empty_trials=1).to_csv(
+        design_fn, sep='\t', na_rep='NA')
+    monkeypatch.setattr(exporimapper, 'load_run_bundle',
+                        lambda tsv_path, settings, cache_dir: load_run_bundle(str(design_fn), settings, cache_dir))
+
+    class MissingTriggers(ScannerTriggers):
+        """ Scanner whose triggers of volumes `missing` never arrive """
+
+        def __init__(self, *args, missing=(), **kwargs):
+            super().__init__(*args, **kwargs)
+            self.missing, self.volume = set(missing), 0
+
+        def poll(self, session, now):
+            events = []
+            for event in super().poll(session, now):
+                if self.volume not in self.missing:
+                    events.append(event)
+                self.volume += 1
+            return events
+
+    with headless(sources=[ContinueKeys(), SimulatedObserver(seed=0)]) as harness:
+        session = exporimapper.ExpOriMapperSession(
+            sub=1, run_id=1, ses=1, task='train', output_str='sub-01_ses-01_task-train_run-01',
+            output_dir=str(tmp_path), settings_file=str(settings_file), eyetracker_on=False,
+            overwrite_checkpoint=True)
+        tr = session.settings['mri']['TR']
+        # the trigger of the second trial's warning is missed
+        missing = session.warn_volume(1)
+        harness['keyboard'].sources.append(
+            MissingTriggers(tr, session.mri_trigger, delay=1.0, missing=[3, missing]))
+        session.run()
+
+    log = session.global_log
+    warnings = log.loc[log['event_type'] == 'warning', 'onset'].to_numpy()
+    first_trigger = session.trigger_clock.times[0]
+    expected = first_trigger + tr * np.array([session.warn_volume(k) for k in range(session.n_trials)])
+    assert len(warnings) == session.n_trials
+    # every warning on the trigger of its volume, to within two frames
+    np.testing.assert_allclose(warnings, expected, atol=2 / 60)
+    assert session.trigger_clock.n_spurious == 0
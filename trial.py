@@ -1,13 +1,14 @@
 import numpy as np
-from psychopy.visual import TextStim, ShapeStim, ImageStim
+from psychopy.visual import TextStim, ShapeStim
 from exptools2.core import Trial
+from schedule import fill_orientations
 
 
 class InstructionTrial(Trial):
     """ Simple trial with instruction text. """
 
     def __init__(self, session, trial_nr, phase_durations=[np.inf],
-                 txt=None, keys=None, draw_each_frame=False, **kwargs):
+                 txt=None, keys=None, draw_each_frame=False, txt_opacity=1.0, **kwargs):
 
         super().__init__(session, trial_nr, phase_durations,
                          draw_each_frame=draw_each_frame, **kwargs)
@@ -22,19 +23,21 @@ class InstructionTrial(Trial):
         if txt is None:
             txt = '''Press any button to continue.'''
 
-        self.gammastim = ImageStim(win=self.session.win,
-                                 image='data/gamma.png',
-                                 size=self.session.settings['various'].get('gamma_stim_size'))
-
-        self.text = TextStim(self.session.win, txt,
-                             height=txt_height,
-                             wrapWidth=txt_width,
-                             pos=[text_position_x, text_position_y],
-                             font='Helvetica',
-                             alignText='center',
-                             anchorHoriz='center',
-                             anchorVert='center')
-        self.text.setSize(txt_height)
+        # borrowed from the session, shared with the other trials
+        self.gammastim = self.session.stim_cache.gamma(
+            self.session.settings['various'].get('gamma_stim_size'),
+            monitor=self.session.monitor,
+            gamma=self.session.settings['monitor'].get('gamma'))
+
+        self.text = self.session.stim_cache.text(txt,
+                                                 font='Helvetica',
+                                                 height=txt_height,
+                                                 wrap_width=txt_width,
+                                                 pos=(text_position_x, text_position_y),
+                                                 opacity=txt_opacity,
+                                                 alignText='center',
+                                                 anchorHoriz='center',
+                                                 anchorVert='center')
 
         self.keys = keys
 
@@ -49,15 +52,19 @@ class InstructionTrial(Trial):
         self.session.win.flip()
 
     def get_events(self):
-        events = super().get_events()
-
+        events = self.session.collect_triggers(self, super().get_events())
+        if self.ends_phase(events):
+            self.stop_phase()
+        return events
+
+    def ends_phase(self, events):
+        """ Whether the events end the current phase: any event, or one of `keys` """
+        if self.session.settings['triggers']['locked']:
+            # with locked triggers the phases keep their durations
+            events = [(key, t) for key, t in events if key != self.session.mri_trigger]
         if self.keys is None:
-            if events:
-                self.stop_phase()
-        else:
-            for key, t in events:
-                if key in self.keys:
-                    self.stop_phase()
+            return bool(events)
+        return any(key in self.keys for key, t in events)
 
 
 class DummyWaiterTrial(InstructionTrial):
@@ -67,8 +74,11 @@ class DummyWaiterTrial(InstructionTrial):
                  txt="Waiting for scanner triggers.", draw_each_frame=False, **kwargs):
 
         super().__init__(session, trial_nr, phase_durations,
-                         txt, draw_each_frame=draw_each_frame, **kwargs)
-        self.text.setOpacity(0.25)
+                         txt, draw_each_frame=draw_each_frame, txt_opacity=0.25, **kwargs)
+
+    def run(self):
+        self.session.start_scan()
+        super().run()
 
     def draw(self):
         self.session.surround_fixation_dot.draw()
@@ -77,15 +87,12 @@ class DummyWaiterTrial(InstructionTrial):
             self.text.draw()
         self.session.win.flip()
 
-    def get_events(self):
-        events = super().get_events()
-
-        if events:
-            for key, t in events:
-                if key == self.session.mri_trigger:
-                    if self.phase == 0:
-                        self.stop_phase()
-                        self.session.win.flip()
+    def ends_phase(self, events):
+        if not self.session.settings['triggers']['locked']:
+            return super().ends_phase(events)
+        # only the trigger that starts the run ends the wait, the lead-in
+        # then lasts its full duration whatever comes in
+        return self.phase == 0 and self.session.trigger_clock.last_volume >= 0
 
 
 class OutroTrial(InstructionTrial):
@@ -149,6 +156,56 @@ class ExpOriMapperTrial(Trial):
         self.condition = condition
         self.last_fix_time, self.last_warn_time, self.last_stim_time = 0.0, 0.0, 0.0
         self.trial_answered = False
+        self.draw_plan, self.stim_frame = None, 0
+        self.stim_interval = 0
+        self.fixation_checked = False
+
+    def compile_draw_plan(self):
+        """ Fills the session's stimulus frame plan with this trial's orientations """
+        self.parameters['stim_value_p1'] = self.parameters['correct_response_sign'] * \
+            self.parameters['staircase_value'] / 2
+        self.parameters['stim_value_p2'] = -self.parameters['correct_response_sign'] * \
+            self.parameters['staircase_value'] / 2
+        self.draw_plan = fill_orientations(
+            self.session.stim_frame_plan,
+            self.parameters['rounded_orientation_degrees'] +
+            self.parameters['stim_value_p1'],
+            self.parameters['rounded_orientation_degrees'] +
+            self.parameters['stim_value_p2'])
+        self.stim_frame = 0
+
+    def log_stim_onset(self, interval):
+        """ Stamps the onset of stimulus interval 1 or 2, called at the flip that shows it """
+        self.parameters[f'stim_onset_p{interval}'] = self.session.clock.getTime()
+
+    def draw_grating(self, interval):
+        """ Draws the grating, stamping the first frame of each stimulus interval """
+        if interval > self.stim_interval:
+            self.stim_interval = interval
+            self.session.win.callOnFlip(self.log_stim_onset, interval)
+        self.session.grating.draw()
+
+    def check_fixation(self):
+        """ Checks fixation from the first stimulus frame up to now, and flags the trial """
+        gaze_s = self.session.settings['gaze']
+        t0, t1 = self.parameters['stim_onset_p1'], self.session.clock.getTime()
+        result = self.session.gaze_stream.fixation_break(
+            t0, t1,
+            center=(self.session.stim_position_info['x_offset'],
+                    self.session.stim_position_info['y_offset']),
+            radius=gaze_s['fixation_radius'],
+            min_duration=gaze_s['min_break_duration'])
+        self.session.gaze_stream.log_break(self.trial_nr, t0, t1, result)
+        self.parameters['fixation_break'] = int(result['n_breaks'] > 0)
+        self.fixation_checked = True
+
+    def run(self):
+        # onsets follow the predicted triggers rather than the previous trial
+        self.phase_durations = self.session.schedule_trial(self.trial_nr)
+        # the staircase value is only known right before the trial starts
+        if self.session.stim_frame_plan is not None:
+            self.compile_draw_plan()
+        super().run()
 
     def draw(self):
         exp_s = self.session.settings['experiment']
@@ -158,72 +215,78 @@ class ExpOriMapperTrial(Trial):
             self.last_warn_time = self.session.clock.getTime()
             self.session.grating.phase = self.parameters['grating_phase']
             self.session.grating.contrast = self.parameters['grating_contrast_multiplier'] * \
-                self.parameters['grating_contrast']
+                exp_s['grating_contrast']
         else:
             self.session.center_fixation_dot.setColor(
                 exp_s['fixation_center_color'])
 
-        if self.phase == 2:  # stimulus phase
+        if self.phase == 2 and self.draw_plan is not None:  # stimulus phase, frame-counted
+            frame = self.draw_plan[min(self.stim_frame, len(self.draw_plan) - 1)]
+            self.stim_frame += 1
+            if frame['grating_on']:
+                self.session.grating.ori = frame['orientation']
+                self.draw_grating(frame['interval'])
+        elif self.phase == 2:  # stimulus phase
             self.last_stim_time = self.session.clock.getTime()
-            draw_grating = False
+            interval = 0
             if (self.last_stim_time - self.last_warn_time) < exp_s['stim_duration']:
-                draw_grating = True
+                interval = 1
                 self.parameters['stim_value_p1'] = self.parameters['correct_response_sign'] * \
                     self.parameters['staircase_value'] / 2
                 self.session.grating.ori = self.parameters['rounded_orientation_degrees'] + \
                     self.parameters['stim_value_p1']
             elif (self.last_stim_time - self.last_warn_time) < (exp_s['stim_duration'] + exp_s['interstim_interval']):
-                draw_grating = False
+                interval = 0
             elif (self.last_stim_time - self.last_warn_time) < (2*exp_s['stim_duration'] + exp_s['interstim_interval']):
-                draw_grating = True
+                interval = 2
                 self.parameters['stim_value_p2'] = -self.parameters['correct_response_sign'] * \
                     self.parameters['staircase_value'] / 2
                 self.session.grating.ori = self.parameters['rounded_orientation_degrees'] + \
                     self.parameters['stim_value_p2']
-            if draw_grating:
-                self.session.grating.draw()
+            if interval:
+                self.draw_grating(interval)
+
+        if self.phase == 3 and not self.fixation_checked and self.session.gaze_stream is not None:
+            self.check_fixation()
 
         self.session.surround_fixation_dot.draw()
         self.session.center_fixation_dot.draw()
 
     def get_events(self):
-        exp_s = self.session.settings['experiment']
-        events = super().get_events()
+        events = self.session.collect_triggers(self, super().get_events())
 
-        if events:
-            for key, t in events:
-                if key == 't':
-                    if self.phase == 0:
-                        self.stop_phase()
-                        self.session.win.flip()
-                if self.phase == 3:
-                    if not self.trial_answered:
-                        if key in exp_s['cw_buttons']:
-                            self.parameters['response_key'] = key
-                            self.parameters['response_value'] = exp_s['cw_buttons'].index(
-                                key)
-                            self.parameters['response_sign'] = 1
-                            self.parameters['response_time'] = t - self.last_warn_time
-                            if self.parameters['correct_response_sign'] == 1:
-                                self.parameters['response_correct'] = 1
-                            else:
-                                self.parameters['response_correct'] = 0
-                            self.session.staircase.addResponse(
-                                self.parameters['response_correct'])
-                        elif key in exp_s['ccw_buttons']:
-                            self.parameters['response_key'] = key
-                            self.parameters['response_value'] = exp_s['ccw_buttons'].index(
-                                key)
-                            self.parameters['response_sign'] = -1
-                            self.parameters['response_time'] = t - self.last_warn_time
-                            if self.parameters['correct_response_sign'] == -1:
-                                self.parameters['response_correct'] = 1
-                            else:
-                                self.parameters['response_correct'] = 0
-                            self.session.staircase.addResponse(
-                                self.parameters['response_correct'])
-                        self.log_phase_info(None)
-                        self.trial_answered = True
+        if self.phase == 0:
+            if self.session.settings['triggers']['locked']:
+                # the trigger of the warning's volume, not just any trigger
+                if self.session.trigger_clock.last_volume >= self.session.warn_volume(self.trial_nr):
+                    self.stop_phase()
+                    self.session.win.flip()
+            elif any(key == self.session.mri_trigger for key, t in events):
+                self.stop_phase()
+                self.session.win.flip()
+
+        # responses as (key, t, sign, confidence): from the polling thread
+        # when it runs, otherwise from the keys the frame loop just read
+        if self.session.input_poller is not None:
+            responses = self.session.input_poller.get_responses(self.session.clock)
+        else:
+            responses = [(key, t) + self.session.response_table[key]
+                         for key, t in events or [] if key in self.session.response_table]
+
+        for key, t, sign, confidence in responses:
+            if self.phase == 3 and not self.trial_answered:
+                self.parameters['response_key'] = key
+                self.parameters['response_value'] = confidence
+                self.parameters['response_sign'] = sign
+                # from the first frame of the first stimulus interval
+                self.parameters['response_time'] = t - self.parameters['stim_onset_p1']
+                self.parameters['response_correct'] = int(
+                    sign == self.parameters['correct_response_sign'])
+                self.session.staircase_worker.add_response(
+                    self.parameters['response_correct'],
+                    intensity=self.parameters['staircase_value'])
+                self.log_phase_info(None)
+                self.trial_answered = True
 
 
 class PositioningTrial(Trial):
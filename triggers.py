@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+
+class TriggerClock:
+
+    def __init__(self, tr, max_triggers=4096):
+        """ Timestamps the volume triggers of a run and tracks the scanner's TR.
+
+        Every trigger gets a volume number (0 for the first one, more than
+        one step when triggers were missed) and its time is stored in a
+        preallocated array. The trigger times are regressed on the volume
+        numbers after every trigger, from running sums, so the current TR
+        and the time of any future volume are always available at no cost.
+
+        Parameters
+        ----------
+        tr : float
+            Nominal TR (in s), used until two triggers came in.
+        max_triggers : int
+            Number of triggers that can be stored.
+        """
+        self.nominal_tr = tr
+        self.times = np.full(max_triggers, np.nan)
+        self.volumes = np.zeros(max_triggers, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        """ Forgets all triggers, for the next run """
+        self.n_triggers = 0
+        self.n_spurious = 0
+        self.armed = False
+        self.tr = self.nominal_tr
+        self.intercept = np.nan
+        # running sums of the volumes and times relative to the first trigger
+        self._sums = np.zeros(5)
+
+    def arm(self):
+        """ Starts recording; triggers before this belong to no run """
+        self.reset()
+        self.armed = True
+
+    def add(self, t):
+        """ Records a trigger at time t, returns its volume number (None if ignored) """
+        if not self.armed:
+            return None
+        if self.n_triggers == 0:
+            volume = 0
+        else:
+            last_t, last_volume = self.times[self.n_triggers - 1], self.volumes[self.n_triggers - 1]
+            if t - last_t < self.tr / 2:
+                # a double key press or a trigger logged twice
+                self.n_spurious += 1
+                return None
+            volume = last_volume + max(int(round((t - last_t) / self.tr)), 1)
+        if self.n_triggers == len(self.times):
+            raise RuntimeError(f'more than {len(self.times)} triggers in a run, increase max_triggers')
+
+        self.times[self.n_triggers], self.volumes[self.n_triggers] = t, volume
+        self.n_triggers += 1
+        v, dt = volume, t - self.times[0]
+        self._sums += [1, v, dt, v * v, v * dt]
+        n, s_v, s_t, s_vv, s_vt = self._sums
+        if n > 1 and n * s_vv - s_v ** 2 > 0:
+            self.tr = (n * s_vt - s_v * s_t) / (n * s_vv - s_v ** 2)
+        self.intercept = self.times[0] + (s_t - self.tr * s_v) / n
+        return volume
+
+    @property
+    def last_volume(self):
+        """ Volume number of the last trigger, -1 before the first """
+        return int(self.volumes[self.n_triggers - 1]) if self.n_triggers else -1
+
+    @property
+    def drift(self):
+        """ Relative deviation of the measured from the nominal TR """
+        return self.tr / self.nominal_tr - 1
+
+    def predict(self, volume):
+        """ Predicted time of a volume's trigger """
+        return self.intercept + self.tr * volume
+
+    def triggers(self):
+        """ Returns the recorded triggers with their residuals from the fit """
+        times, volumes = self.times[:self.n_triggers], self.volumes[:self.n_triggers]
+        return pd.DataFrame({'volume': volumes, 'onset': times,
+                             'residual': times - self.predict(volumes)})
+
+    def save(self, fn):
+        """ Writes the triggers of the run to a tsv """
+        self.triggers().to_csv(fn, sep='\t', index=False, na_rep='NA')
+
+
+class SimulatedTriggers:
+
+    def __init__(self, tr, delay=1.0, drift=1e-4, jitter=0.001, p_drop=0.0, seed=None):
+        """ Stand-in for the scanner when mri.simulate is set.
+
+        Once started (see start), a trigger is due every tr * (1 + drift)
+        seconds, with normal jitter, and each one is missed with
+        probability `p_drop`. The session polls the due triggers from its
+        frame loop, so they reach the trials as timestamped key events
+        without going through the keyboard.
+
+        Parameters
+        ----------
+        tr : float
+            Nominal TR (in s).
+        delay : float
+            Time (in s) from start() to the first trigger.
+        drift : float
+            Relative deviation of the simulated scanner's TR from `tr`.
+        jitter : float
+            Sd (in s) of the trigger times.
+        p_drop : float
+            Probability that a trigger is missed.
+        seed : int
+            Seed of the jitter and drops.
+        """
+        self.tr = tr * (1 + drift)
+        self.delay = delay
+        self.jitter = jitter
+        self.p_drop = p_drop
+        self.rng = np.random.default_rng(seed)
+        self.t0 = None
+        self.next_volume, self.next_t = 0, None
+
+    def start(self, t):
+        """ Starts the scanner at time t (on the session clock) """
+        self.t0 = t + self.delay
+        self.next_volume, self.next_t = 0, self.t0 + self.rng.normal(0, self.jitter)
+
+    def poll(self, now):
+        """ Returns the times of the triggers that came in up to now """
+        times = []
+        while self.next_t is not None and self.next_t <= now:
+            if self.rng.random() >= self.p_drop:
+                times.append(self.next_t)
+            self.next_volume += 1
+            self.next_t = self.t0 + self.next_volume * self.tr + self.rng.normal(0, self.jitter)
+        return times